@@ -1,8 +1,10 @@
 import json
-from app import app, db
+from app import create_app, db
 from models import Section, Difficulty, Exercise
 from datetime import datetime
 
+app = create_app(web=False)
+
 def add_reading_tests():
     """Add multiple reading tests from the IELTS PDF materials"""
     with app.app_context():
@@ -9,7 +9,7 @@ from models import Article, User, ArticleView
 def add_sample_views():
     """Add sample article views"""
     print("Adding sample article views...")
-    app = create_app()
+    app = create_app(web=False)
     
     with app.app_context():
         articles = Article.query.all()
@@ -26,7 +26,7 @@ def add_sample_views():
         now = datetime.utcnow()
         start_date = now - timedelta(days=30)
         
-        views_added = 0
+        views = []
         
         # For each day in the last 30 days
         for day_offset in range(30):
@@ -46,14 +46,12 @@ def add_sample_views():
                 second = random.randint(0, 59)
                 timestamp = day.replace(hour=hour, minute=minute, second=second)
                 
-                # Create the view
-                view = ArticleView(
-                    article_id=article.id,
-                    user_id=user.id,
-                    viewed_at=timestamp
-                )
-                db.session.add(view)
-                views_added += 1
+                # Queue the view for a single bulk insert
+                views.append({
+                    'article_id': article.id,
+                    'user_id': user.id,
+                    'viewed_at': timestamp
+                })
         
         # Add more views to the first few articles to create distinct "popular" articles
         popular_articles = articles[:min(3, len(articles))]
@@ -66,15 +64,21 @@ def add_sample_views():
                                           hours=random.randint(0, 23),
                                           minutes=random.randint(0, 59))
                 
-                view = ArticleView(
-                    article_id=article.id,
-                    user_id=user.id,
-                    viewed_at=timestamp
-                )
-                db.session.add(view)
-                views_added += 1
+                views.append({
+                    'article_id': article.id,
+                    'user_id': user.id,
+                    'viewed_at': timestamp
+                })
         
+        # Insert in batches rather than one row per view
+        for i in range(0, len(views), 1000):
+            db.session.execute(ArticleView.__table__.insert(), views[i:i + 1000])
+        views_added = len(views)
         db.session.commit()
+        
+        # The bulk delete and insert bypass the view counters, so rebuild them exactly
+        from counters import recount_article_views
+        recount_article_views()
         print(f"Added {views_added} sample article views.")
 
 if __name__ == "__main__":
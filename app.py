@@ -1,21 +1,11 @@
 import os
+import sys
 import logging
 from flask import Flask, render_template
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import LoginManager
-from flask_migrate import Migrate
-
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler('app.log')
-    ]
-)
 
 logger = logging.getLogger(__name__)
 
@@ -24,10 +14,14 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 login_manager = LoginManager()
-migrate = Migrate()
+migrate = None  # Flask-Migrate (and Alembic) are only loaded for the flask CLI
+
+def create_app(config_name='config.Config', web=True):
+    """Factory function to create and configure the Flask application
 
-def create_app(config_name='config.Config'):
-    """Factory function to create and configure the Flask application"""
+    With web=False only configuration, the database and model hooks are set up;
+    seeding and maintenance scripts do not need blueprints, templates or login.
+    """
     app = Flask(__name__)
     
     # Determine config class based on environment
@@ -44,6 +38,10 @@ def create_app(config_name='config.Config'):
     # Load configuration
     app.config.from_object(config_name)
     
+    # Set up logging (queue-based and non-blocking unless LOG_MODE is 'sync')
+    from logging_utils import init_logging
+    init_logging(app)
+    
     # Set secret key from environment variable or use a random one
     app.secret_key = os.environ.get("SESSION_SECRET", os.urandom(24))
     
@@ -60,13 +58,81 @@ def create_app(config_name='config.Config'):
     # Initialize database with the app
     db.init_app(app)
     
+    # Keep denormalized counters in step with the rows they summarise
+    from counters import register_counter_listeners
+    register_counter_listeners(db.session)
+    
+    # Award badges from practice-record events
+    from badges import register_badge_listeners
+    register_badge_listeners(db.session)
+    
+    # Maintain score rollups for progress charts
+    from rollups import register_rollup_listeners
+    register_rollup_listeners(db.session)
+    
+    # Reference counts of stored uploads
+    from file_store import register_file_store_listeners
+    register_file_store_listeners(db.session)
+    
+    # Revision stamps for HTTP validators
+    from revisions import register_revision_listeners
+    register_revision_listeners(db.session)
+    
+    # Application cache (CACHE_TYPE) and its invalidation from model writes
+    from cache import init_cache
+    init_cache(app)
+    
+    # Cache parsed exercise content per process
+    from content_cache import init_content_cache
+    init_content_cache(app)
+    
     # Initialize database migrations
-    migrate.init_app(app, db)
+    if _flask_cli_invocation() or app.config.get('LOAD_MIGRATIONS'):
+        _init_migrations(app)
+    
+    # Register maintenance CLI commands
+    from commands import register_commands
+    register_commands(app)
+    
+    if web:
+        _init_web(app)
+    
+    # Check the schema version; only bootstrap when the database is behind
+    with app.app_context():
+        _ensure_database(app)
+    
+    # Call init_app on config if it exists (for env-specific setup)
+    if hasattr(app.config, 'init_app'):
+        app.config.init_app(app)
+    
+    return app
+
+def _init_web(app):
+    """Set up everything that only matters when serving requests"""
+    # Compress responses; registered first so it runs after every other after_request hook
+    from compression import init_compression
+    init_compression(app)
+    
+    # Batch article view writes off the request path
+    from view_buffer import init_view_buffer
+    init_view_buffer(app)
     
     # Register asset management
     from asset_utils import AssetManager
     AssetManager.register_asset_helpers(app)
     
+    # Authorized upload delivery, optionally offloaded to the front server
+    from upload_delivery import init_upload_delivery
+    init_upload_delivery(app)
+    
+    # Listening-test audio with byte ranges and precomputed frame offsets
+    from audio_stream import init_audio
+    init_audio(app)
+    
+    # Per-route Cache-Control policies and conditional GET
+    from http_cache import init_http_cache
+    init_http_cache(app)
+    
     # Add custom Jinja2 filters
     @app.template_filter('strftime')
     def _jinja2_filter_strftime(date, fmt=None):
@@ -85,12 +151,35 @@ def create_app(config_name='config.Config'):
             app.logger.error(f"Error parsing JSON: {value[:100]}")
             return {}
     
+    # Exercise content goes through the per-process content cache: use
+    # exercise|exercise_content (or exercise_content(exercise)) rather than
+    # exercise.content|from_json. The result is shared - treat it as read-only.
+    from utils import parse_exercise_content
+    app.add_template_filter(parse_exercise_content, 'exercise_content')
+    app.add_template_global(parse_exercise_content, 'exercise_content')
+    
     # Initialize and configure LoginManager
     login_manager.init_app(app)
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please log in to access this page.'
     login_manager.login_message_category = 'info'
     
+    # Load users with their role in one query, behind a short-TTL identity cache
+    from user_loader import init_user_loader
+    init_user_loader(app, login_manager)
+    
+    # Per-endpoint latency, SQL and response-size metrics at /admin/metrics
+    from request_metrics import init_request_metrics
+    init_request_metrics(app)
+    
+    # Flag repeated per-request queries (development and staging only)
+    from nplusone import init_nplusone
+    init_nplusone(app)
+    
+    # Background job queue status at /admin/jobs
+    from jobs import init_jobs
+    init_jobs(app)
+    
     # Import and register blueprints
     from routes.auth import auth_bp
     from routes.admin import admin_bp
@@ -110,22 +199,44 @@ def create_app(config_name='config.Config'):
     @app.route('/')
     def index():
         return render_template('index.html')
+
+def _flask_cli_invocation():
+    """True when the app is being loaded by the `flask` command"""
+    program = sys.argv[0] if sys.argv else ''
+    return os.path.basename(program) in ('flask', 'flask.exe') or program.endswith(os.path.join('flask', '__main__.py'))
+
+def _init_migrations(app):
+    global migrate
+    from flask_migrate import Migrate
+    if migrate is None:
+        migrate = Migrate()
+    migrate.init_app(app, db)
+
+def _ensure_database(app):
+    """Fast startup path: a version check instead of DDL and seed queries"""
+    import models  # Import models to register them with SQLAlchemy
+    from schema import SCHEMA_VERSION, current_version
     
-    # Initialize database tables
-    with app.app_context():
-        _initialize_database()
-    
-    # Call init_app on config if it exists (for env-specific setup)
-    if hasattr(app.config, 'init_app'):
-        app.config.init_app(app)
+    with db.engine.connect() as conn:
+        version = current_version(conn)
+    if version >= SCHEMA_VERSION:
+        return
     
-    return app
+    if not app.config.get('AUTO_BOOTSTRAP', True):
+        logger.warning(f"Database schema is at version {version}, expected {SCHEMA_VERSION}; "
+                       f"run 'flask bootstrap' before starting workers")
+        return
+    bootstrap_database()
 
-def _initialize_database():
+def bootstrap_database():
     """Initialize database tables and set up initial data"""
     import models  # Import models to register them with SQLAlchemy
     db.create_all()
     
+    # Bring databases created by older releases up to the current schema
+    from schema import upgrade
+    upgrade(db.engine)
+    
     # Create admin user if it doesn't exist
     from models import User, Role
     from werkzeug.security import generate_password_hash
@@ -154,14 +265,15 @@ def _initialize_database():
         db.session.commit()
         logger.info("Admin user created successfully")
 
-# User loader for Flask-Login
-@login_manager.user_loader
-def load_user(user_id):
-    from models import User
-    return User.query.get(int(user_id))
-
-# Create the application instance
-app = create_app()
+def __getattr__(name):
+    # The application instance is built on first use, so `from app import db`
+    # (models, scripts, workers building their own app) does not pay for it
+    if name == 'app':
+        global app
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
+    app = create_app()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -1,7 +1,116 @@
+"""
+Static asset URLs.
+
+``flask build-assets`` copies every static asset to a content-hashed name
+(``css/style.css`` -> ``css/style.3f9a0c1d2b4e.css``) and writes a manifest
+mapping logical names to hashed ones. Workers read the manifest once at
+startup, so ``asset_url_for('static', filename='css/style.css')`` costs a
+dictionary lookup and yields a URL that never changes content; the static
+view serves those names as ``immutable``. Files missing from the manifest
+(or every file, before the first build) fall back to a ``?v=`` parameter.
+"""
 import os
+import re
+import json
+import shutil
 import hashlib
+import logging
 from flask import current_app, url_for
 
+logger = logging.getLogger(__name__)
+
+# Assets the manifest fingerprints; uploads and .gz/.br siblings are left alone
+FINGERPRINT_EXTENSIONS = (
+    '.css', '.js', '.mjs', '.map', '.svg', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico',
+    '.woff', '.woff2', '.ttf', '.eot',
+)
+_HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.[^./]+$')
+
+def content_hash(path):
+    """Short hex digest of a file's contents"""
+    digest = hashlib.blake2b(digest_size=6)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hashed_filename(filename, digest):
+    root, ext = os.path.splitext(filename)
+    return f"{root}.{digest}{ext}"
+
+def _asset_files(static_folder, exclude, extensions):
+    """(static-relative name, path) for every asset under static_folder"""
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs
+                         if os.path.relpath(os.path.join(root, d), static_folder).replace(os.sep, '/') not in exclude)
+        for name in sorted(files):
+            if name.endswith(extensions):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, static_folder).replace(os.sep, '/'), path
+
+def build_manifest(static_folder, manifest_path, exclude=('uploads',), extensions=FINGERPRINT_EXTENSIONS, prune=False):
+    """Write content-hashed copies of static assets and the manifest; returns a summary
+
+    Hashed copies from earlier builds are kept, so pages rendered by workers
+    still running the previous release keep working. ``prune`` removes them.
+    """
+    summary = {'files': 0, 'written': 0, 'unchanged': 0, 'pruned': 0}
+    assets = {}
+    for filename, path in _asset_files(static_folder, exclude, extensions):
+        if _HASHED_NAME.search(filename):
+            continue
+        hashed = hashed_filename(filename, content_hash(path))
+        target = os.path.join(static_folder, hashed)
+        summary['files'] += 1
+        if os.path.exists(target):
+            summary['unchanged'] += 1
+        else:
+            shutil.copy2(path, target)
+            summary['written'] += 1
+        assets[filename] = hashed
+
+    if prune:
+        current = set(assets.values())
+        for filename, path in list(_asset_files(static_folder, exclude, extensions)):
+            if _HASHED_NAME.search(filename) and filename not in current:
+                os.remove(path)
+                summary['pruned'] += 1
+
+    # Replace atomically; a worker starting mid-build reads the old or the new manifest
+    temporary = f"{manifest_path}.tmp"
+    with open(temporary, 'w') as f:
+        json.dump({'version': 1, 'assets': assets}, f, indent=2, sort_keys=True)
+    os.replace(temporary, manifest_path)
+    return summary
+
+class AssetManifest:
+    """Logical static filenames mapped to their content-hashed copies"""
+
+    def __init__(self, assets=None):
+        self.assets = dict(assets or {})
+        self.hashed = frozenset(self.assets.values())
+
+    @classmethod
+    def load(cls, path):
+        """The manifest at path; empty when it is missing or unreadable"""
+        if not path or not os.path.exists(path):
+            return cls()
+        try:
+            with open(path) as f:
+                return cls(json.load(f).get('assets', {}))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read asset manifest {path}: {e}")
+            return cls()
+
+    def get(self, filename):
+        return self.assets.get(filename)
+
+    def is_hashed(self, filename):
+        return filename in self.hashed
+
+    def __len__(self):
+        return len(self.assets)
+
 class AssetManager:
     """Asset management utilities for the application"""
     
@@ -10,23 +119,23 @@ class AssetManager:
     @staticmethod
     def url_for(endpoint, **values):
         """Generate a URL with asset versioning if applicable"""
-        if endpoint == 'static' and current_app.config.get('ASSET_VERSIONING'):
-            filename = values.get('filename', '')
-            if filename:
-                values['v'] = AssetManager.get_asset_version(filename)
+        if endpoint != 'static':
+            return url_for(endpoint, **values)
+        
+        filename = values.get('filename', '')
+        manifest = current_app.extensions.get('asset_manifest')
+        hashed = manifest.get(filename) if manifest is not None else None
+        if hashed:
+            values['filename'] = hashed
+        elif filename and current_app.config.get('ASSET_VERSIONING'):
+            values.setdefault('v', AssetManager.get_asset_version(filename))
         
-        if current_app.config.get('CDN_DOMAIN') and endpoint == 'static':
+        cdn_base = current_app.extensions.get('asset_cdn_base')
+        if cdn_base:
             # Use CDN for static assets
-            filename = values.get('filename', '')
-            cdn_url = current_app.config['CDN_DOMAIN'].rstrip('/')
-            app_static_path = url_for('static', filename='', _external=False).rstrip('/')
-            asset_url = f"{cdn_url}{app_static_path}/{filename}"
-            
-            # Add version parameter if enabled
-            if current_app.config.get('ASSET_VERSIONING'):
-                version = values.get('v', AssetManager.get_asset_version(filename))
-                asset_url = f"{asset_url}?v={version}"
-                
+            asset_url = f"{cdn_base}/{values['filename']}"
+            if 'v' in values:
+                asset_url = f"{asset_url}?v={values['v']}"
             return asset_url
         
         # Fall back to standard url_for
@@ -34,7 +143,7 @@ class AssetManager:
     
     @staticmethod
     def get_asset_version(filename):
-        """Get the version hash for an asset file"""
+        """Get the version hash for an asset file missing from the manifest"""
         # Use global asset version if specified
         if current_app.config.get('ASSET_VERSION'):
             return current_app.config['ASSET_VERSION']
@@ -44,54 +153,86 @@ class AssetManager:
             return AssetManager._asset_hash_cache[filename]
         
         try:
-            file_path = os.path.join(current_app.root_path, 'static', filename)
+            file_path = os.path.join(current_app.static_folder, filename)
             if not os.path.exists(file_path):
                 return '1'
-                
-            with open(file_path, 'rb') as f:
-                file_hash = hashlib.md5(f.read()).hexdigest()[:8]
-                AssetManager._asset_hash_cache[filename] = file_hash
-                return file_hash
-        except:
+            
+            file_hash = content_hash(file_path)
+            AssetManager._asset_hash_cache[filename] = file_hash
+            return file_hash
+        except OSError:
             # Return a default version on error
             return '1'
     
+    @staticmethod
+    def bundle_urls(name):
+        """URLs a template includes for a bundle from ASSET_BUNDLES (see bundles.py)"""
+        from bundles import BUNDLE_DIR
+        
+        sources = current_app.config.get('ASSET_BUNDLES', {}).get(name)
+        if sources is None:
+            raise KeyError(f"Unknown asset bundle: {name}")
+        if name in current_app.extensions.get('asset_bundles_built', ()):
+            return [AssetManager.url_for('static', filename=f"{BUNDLE_DIR}/{name}")]
+        return [AssetManager.url_for('static', filename=source) for source in sources]
+    
+    @staticmethod
+    def add_preload_headers(response):
+        """Preload the ASSET_PRELOAD bundles from full HTML pages"""
+        if response.status_code != 200 or response.mimetype != 'text/html':
+            return response
+        for name in current_app.config.get('ASSET_PRELOAD', ()):
+            kind = 'style' if name.endswith('.css') else 'script'
+            for url in AssetManager.bundle_urls(name):
+                response.headers.add('Link', f"<{url}>; rel=preload; as={kind}")
+        return response
+    
     @staticmethod
     def add_cache_headers(response):
         """Add appropriate cache headers to the response"""
-        if not response.headers.get('Cache-Control'):
-            if request.path.startswith('/static/'):
-                # Cache static assets longer
-                timeout = current_app.config.get('STATIC_CACHE_TIMEOUT', 86400)  # Default to 1 day
-                response.headers['Cache-Control'] = f'public, max-age={timeout}'
-            else:
-                # Default cache control for dynamic content
-                timeout = current_app.config.get('CACHE_DEFAULT_TIMEOUT', 300)  # Default to 5 minutes
-                response.headers['Cache-Control'] = f'private, max-age={timeout}'
-                
-        return response
+        # Policies are chosen per route; see http_cache.py
+        from http_cache import apply_cache_policy
+        return apply_cache_policy(response)
+    
+    @staticmethod
+    def load_manifest(app):
+        """Read the asset manifest, the CDN base URL and the built bundles once, at startup"""
+        manifest = AssetManifest.load(app.config.get('ASSET_MANIFEST'))
+        app.extensions['asset_manifest'] = manifest
+        if len(manifest):
+            logger.info(f"Loaded asset manifest with {len(manifest)} assets")
+        
+        cdn_domain = app.config.get('CDN_DOMAIN')
+        app.extensions['asset_cdn_base'] = None
+        if cdn_domain:
+            static_root = app.config.get('APPLICATION_ROOT', '/').rstrip('/')
+            app.extensions['asset_cdn_base'] = f"{cdn_domain.rstrip('/')}{static_root}{app.static_url_path}"
+        
+        # Bundles are served whole once built; in debug mode their sources are linked instead
+        from bundles import BUNDLE_DIR
+        built = set()
+        if not app.config.get('ASSET_BUNDLES_DEBUG'):
+            for name in app.config.get('ASSET_BUNDLES', {}):
+                if manifest.get(f"{BUNDLE_DIR}/{name}") or os.path.exists(os.path.join(app.static_folder, BUNDLE_DIR, name)):
+                    built.add(name)
+        app.extensions['asset_bundles_built'] = frozenset(built)
+        return manifest
     
     @staticmethod
     def register_asset_helpers(app):
         """Register asset management helpers with the Flask application"""
+        AssetManager.load_manifest(app)
+        
         # Register asset_url template function
         @app.template_global()
         def asset_url_for(endpoint, **values):
             return AssetManager.url_for(endpoint, **values)
         
-        # Add cache headers after each request
-        @app.after_request
-        def add_cache_headers(response):
-            from flask import request
-            
-            if not response.headers.get('Cache-Control'):
-                if request.path.startswith('/static/'):
-                    # Cache static assets longer
-                    timeout = app.config.get('STATIC_CACHE_TIMEOUT', 86400)  # Default to 1 day
-                    response.headers['Cache-Control'] = f'public, max-age={timeout}'
-                else:
-                    # Default cache control for dynamic content
-                    timeout = app.config.get('CACHE_DEFAULT_TIMEOUT', 300)  # Default to 5 minutes
-                    response.headers['Cache-Control'] = f'private, max-age={timeout}'
-                    
-            return response 
\ No newline at end of file
+        @app.template_global()
+        def bundle_urls(name):
+            return AssetManager.bundle_urls(name)
+        
+        if app.config.get('ASSET_PRELOAD'):
+            app.after_request(AssetManager.add_preload_headers)
+        
+        # Cache-Control is set per route by http_cache.init_http_cache
@@ -0,0 +1,369 @@
+"""
+Audio delivery for listening tests.
+
+``/audio/<filename>`` serves files under ``UPLOAD_FOLDER/audio`` with byte
+ranges (``Range`` / ``If-Range`` / 206 / 416) and strong validators, so a
+player seeking inside a 30-minute test only fetches what it plays. Bodies
+from the current position to the end of the file, which is what players
+request, are handed to the server's ``wsgi.file_wrapper``; gunicorn sends
+those with ``sendfile`` without copying them through Python. Access is
+checked as for other uploads, and with ``UPLOAD_DELIVERY`` set the front
+server sends the file instead (see upload_delivery.py).
+
+Each file has a small index beside the uploads (``.audio-index/``) holding
+its SHA-256 (the ETag) and, for MP3s, the byte offset of the frame playing
+at every ``AUDIO_INDEX_INTERVAL`` seconds. The offset for a section start is
+then a list lookup instead of a scan of the file. Indexes are written by
+``flask index-audio`` and rebuilt on first use when missing or stale.
+
+Listening exercises may list their section start times (seconds) in their
+content as ``"sections": [{"number": 1, "start": 0}, ...]``; templates get
+``audio_sections(exercise)`` with the matching byte offsets.
+"""
+import os
+import re
+import json
+import mmap
+import hashlib
+import logging
+import mimetypes
+import tempfile
+import threading
+from datetime import datetime, timezone
+from flask import abort, current_app, request, url_for
+from werkzeug.datastructures import ContentRange
+from werkzeug.http import is_resource_modified
+from werkzeug.wsgi import wrap_file
+from upload_delivery import authorize, offload, signed_url, upload_file_path
+
+logger = logging.getLogger(__name__)
+
+AUDIO_DIR = 'audio'
+INDEX_DIR = '.audio-index'
+INDEX_VERSION = 1
+
+_CONTENT_ADDRESSED = re.compile(r'[0-9a-f]{64}\.\w+')
+
+# MPEG audio header tables: kbit/s by (MPEG-1, layer) and bitrate index,
+# sample rates by version bits (3 = MPEG-1, 2 = MPEG-2, 0 = MPEG-2.5)
+_BITRATES = {
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+def frame_header(data, pos):
+    """(frame length, samples, sample rate) of the MPEG audio frame at pos, or None"""
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version = (data[pos + 1] >> 3) & 3
+    layer_bits = (data[pos + 1] >> 1) & 3
+    bitrate_index = data[pos + 2] >> 4
+    rate_index = (data[pos + 2] >> 2) & 3
+    padding = (data[pos + 2] >> 1) & 1
+    # Reserved values, and free-format bitrates we cannot size
+    if version == 1 or layer_bits == 0 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+
+    layer = 4 - layer_bits
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][rate_index]
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    samples = 1152 if layer == 2 or mpeg1 else 576
+    return samples // 8 * bitrate // sample_rate + padding, samples, sample_rate
+
+def _id3_size(data):
+    """Bytes taken by a leading ID3v2 tag"""
+    if len(data) < 10 or data[:3] != b'ID3':
+        return 0
+    size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+    return size + (20 if data[5] & 0x10 else 10)
+
+def _synced(data, pos):
+    """Whether a frame header at pos is followed by another, ruling out stray 0xFF bytes"""
+    header = frame_header(data, pos)
+    if header is None:
+        return False
+    following = pos + header[0]
+    return following >= len(data) or frame_header(data, following) is not None
+
+def scan_frames(data, interval=1.0):
+    """Walk the MPEG frames of data; returns (duration seconds, frame count, offsets)
+
+    ``offsets[i]`` is the byte offset of the frame playing at ``i * interval``
+    seconds. A leading Xing/Info frame carries no audio and is not timed.
+    """
+    pos = _id3_size(data)
+    if not _synced(data, pos):
+        pos = data.find(b'\xff', pos)
+        while pos != -1 and not _synced(data, pos):
+            pos = data.find(b'\xff', pos + 1)
+        if pos == -1:
+            return 0.0, 0, []
+
+    duration = 0.0
+    frames = 0
+    offsets = []
+    first = True
+    while pos < len(data):
+        header = frame_header(data, pos)
+        if header is None:
+            # Lost sync (damage, or a trailing ID3v1 tag): look for the next frame
+            pos = data.find(b'\xff', pos + 1)
+            while pos != -1 and not _synced(data, pos):
+                pos = data.find(b'\xff', pos + 1)
+            if pos == -1:
+                break
+            continue
+        length, samples, sample_rate = header
+        if pos + length > len(data):
+            break
+        if first and (b'Xing' in data[pos + 4:pos + 40] or b'Info' in data[pos + 4:pos + 40]):
+            first = False
+            pos += length
+            continue
+        first = False
+        frame_seconds = samples / sample_rate
+        while len(offsets) * interval < duration + frame_seconds:
+            offsets.append(pos)
+        duration += frame_seconds
+        frames += 1
+        pos += length
+    return duration, frames, offsets
+
+def _index_path(folder, filename):
+    return os.path.join(folder, INDEX_DIR, AUDIO_DIR, filename + '.json')
+
+def build_index(folder, filename, interval=1.0):
+    """Write the index of UPLOAD_FOLDER/audio/<filename> and return it"""
+    path = os.path.join(folder, AUDIO_DIR, filename)
+    stat = os.stat(path)
+    index = {
+        'version': INDEX_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'interval': interval,
+        'duration': None,
+        'frames': None,
+        'offsets': [],
+    }
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        if stat.st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest.update(data)
+                if filename.lower().endswith('.mp3'):
+                    duration, frames, offsets = scan_frames(data, interval)
+                    index.update(duration=round(duration, 3), frames=frames, offsets=offsets)
+    index['sha256'] = digest.hexdigest()
+
+    target = _index_path(folder, filename)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # A temporary file of our own: other workers may be indexing the same file
+    fd, temporary = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(target))
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(temporary, target)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+    return index
+
+_indexes = {}  # index path -> index, for this process
+_indexes_lock = threading.Lock()
+
+def audio_index(folder, filename):
+    """The current index for an audio file, building it when missing or stale"""
+    stat = os.stat(os.path.join(folder, AUDIO_DIR, filename))
+    target = _index_path(folder, filename)
+    with _indexes_lock:
+        index = _indexes.get(target)
+    if index is None or index['size'] != stat.st_size or index['mtime_ns'] != stat.st_mtime_ns:
+        index = None
+        try:
+            with open(target) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            pass
+        if (index is None or index.get('version') != INDEX_VERSION
+                or index['size'] != stat.st_size or index['mtime_ns'] != stat.st_mtime_ns):
+            logger.info(f"Indexing audio file {filename}")
+            index = build_index(folder, filename, current_app.config.get('AUDIO_INDEX_INTERVAL', 1.0))
+        with _indexes_lock:
+            _indexes[target] = index
+    return index
+
+def offset_at(index, seconds):
+    """Byte offset of the frame playing at seconds, or None without a frame index"""
+    offsets = index.get('offsets')
+    if not offsets:
+        return None
+    return offsets[min(max(int(seconds // index['interval']), 0), len(offsets) - 1)]
+
+def index_audio(folder, force=False):
+    """(Re)build indexes for every file under UPLOAD_FOLDER/audio; returns the number built"""
+    interval = current_app.config.get('AUDIO_INDEX_INTERVAL', 1.0)
+    built = 0
+    audio_folder = os.path.join(folder, AUDIO_DIR)
+    for root, dirs, files in os.walk(audio_folder):
+        for name in files:
+            if name.startswith('.'):
+                continue
+            filename = os.path.relpath(os.path.join(root, name), audio_folder).replace(os.sep, '/')
+            target = _index_path(folder, filename)
+            if not force and os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(os.path.join(root, name)):
+                continue
+            build_index(folder, filename, interval)
+            built += 1
+    return built
+
+# -- serving -------------------------------------------------------------------
+
+def _read_range(f, length, chunk_size=64 * 1024):
+    try:
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+def _range_applies(etag, last_modified):
+    """If-Range: serve the range only if the client's copy is still current"""
+    if_range = request.if_range
+    if if_range.etag:
+        return if_range.etag == etag
+    if if_range.date:
+        return if_range.date >= last_modified
+    return True
+
+def audio_view(filename):
+    config = current_app.config
+    immutable = bool(_CONTENT_ADDRESSED.fullmatch(os.path.basename(filename)))
+    cache_control = authorize(config.get('STATIC_IMMUTABLE_MAX_AGE', 31536000) if immutable
+                              else config.get('AUDIO_MAX_AGE', 86400))
+    if immutable and 'private' not in cache_control:
+        cache_control += ', immutable'
+    folder = config['UPLOAD_FOLDER']
+    path = upload_file_path(folder, AUDIO_DIR, filename)
+    if path is None:
+        abort(404)
+
+    # With X-Accel-Redirect/X-Sendfile the front server handles ranges and validators
+    response = offload(f"{AUDIO_DIR}/{filename}", cache_control)
+    if response is not None:
+        return response
+
+    index = audio_index(folder, filename)
+    size = index['size']
+    etag = index['sha256'][:32]
+    last_modified = datetime.fromtimestamp(index['mtime_ns'] // 10**9, timezone.utc)
+    response_class = current_app.response_class
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = response_class(status=304)
+    else:
+        start, stop, status = 0, size, 200
+        if request.range is not None and _range_applies(etag, last_modified):
+            byte_range = request.range.range_for_length(size)
+            if byte_range is not None:
+                (start, stop), status = byte_range, 206
+            elif len(request.range.ranges) == 1:
+                response = response_class(status=416)
+                response.content_range = ContentRange('bytes', None, None, size)
+                return response
+            # Several ranges at once: answer with the whole file
+
+        f = open(path, 'rb')
+        f.seek(start)
+        if stop == size:
+            # To the end of the file: the server may send it with sendfile
+            body = wrap_file(request.environ, f)
+        else:
+            body = _read_range(f, stop - start)
+        response = response_class(body, status=status, mimetype=mimetypes.guess_type(filename)[0],
+                                  direct_passthrough=True)
+        response.content_length = stop - start
+        if status == 206:
+            response.content_range = ContentRange('bytes', start, stop, size)
+
+    response.accept_ranges = 'bytes'
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def audio_index_view(filename):
+    """Duration and validators of an audio file, plus byte offsets for ?t=<seconds> values"""
+    authorize()
+    folder = current_app.config['UPLOAD_FOLDER']
+    path = upload_file_path(folder, AUDIO_DIR, filename)
+    if path is None:
+        abort(404)
+    index = audio_index(folder, filename)
+    offsets = {}
+    for value in request.args.getlist('t'):
+        try:
+            offsets[value] = offset_at(index, float(value))
+        except ValueError:
+            abort(400)
+    return {
+        'url': audio_url(f"{AUDIO_DIR}/{filename}"),
+        'size': index['size'],
+        'duration': index['duration'],
+        'etag': index['sha256'][:32],
+        'offsets': offsets,
+    }
+
+# -- template helpers ------------------------------------------------------------
+
+def _audio_filename(value):
+    """Name under UPLOAD_FOLDER/audio for an Exercise.audio_file value, or None"""
+    from file_store import upload_path
+
+    path = upload_path(value, AUDIO_DIR)
+    if path and path.startswith(AUDIO_DIR + '/'):
+        return path[len(AUDIO_DIR) + 1:]
+    return None
+
+def audio_url(value):
+    """URL of the audio endpoint for an Exercise.audio_file value; signed when a CDN serves it"""
+    filename = _audio_filename(value)
+    if not filename:
+        return value
+    if current_app.config.get('CDN_DOMAIN'):
+        return signed_url('audio_stream', filename)
+    return url_for('audio_stream', filename=filename)
+
+def audio_sections(exercise):
+    """[{'number', 'start', 'offset'}] for the sections listed in a listening exercise"""
+    filename = _audio_filename(exercise.audio_file)
+    sections = (exercise.parsed_content or {}).get('sections') or []
+    if not filename or not sections:
+        return []
+    folder = current_app.config['UPLOAD_FOLDER']
+    try:
+        index = audio_index(folder, filename)
+    except OSError:
+        return []
+    return [{
+        'number': section.get('number', number),
+        'start': float(section.get('start', 0)),
+        'offset': offset_at(index, float(section.get('start', 0))),
+    } for number, section in enumerate(sections, 1)]
+
+def init_audio(app):
+    """Serve listening-test audio with byte ranges at /audio/<filename>"""
+    app.add_url_rule('/audio/<path:filename>', 'audio_stream', audio_view)
+    app.add_url_rule('/audio-index/<path:filename>', 'audio_index', audio_index_view)
+    app.add_template_global(audio_url)
+    app.add_template_global(audio_sections)
@@ -0,0 +1,324 @@
+"""
+Event-driven badge awards.
+
+Badge criteria are compiled once into ``BadgeRule`` objects that compare a named
+per-user counter (``UserCounter``) against a threshold. When a practice record
+is completed, or the score of a completed record changes, a flush hook adjusts
+the affected counters and evaluates only the rules that read them. Awards are
+inserted in the same transaction with ON CONFLICT DO NOTHING against the unique
+(user_id, badge_id) index, so concurrent evaluations cannot double-award.
+"""
+import time
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from sqlalchemy import and_, delete, event, func, select, tuple_
+from counters import insert_ignore, previous_value, upsert
+
+logger = logging.getLogger(__name__)
+
+HIGH_SCORE = 7.0
+HIGH_SCORES_COUNTER = 'high_scores'
+RULES_TTL = 300  # seconds before another worker's badge edits are picked up
+
+_PENDING_KEY = 'badges.pending_counter_deltas'
+
+def section_counter(section_id):
+    return f"section_completed:{section_id}"
+
+@dataclass(frozen=True)
+class BadgeRule:
+    """Award badge_id once counter reaches threshold"""
+    badge_id: int
+    counter: str
+    threshold: int
+
+def _section_completion_rule(badge):
+    """Complete 5 exercises in the badge's section"""
+    if badge.section_id is not None and badge.points_required == 50:
+        return BadgeRule(badge.id, section_counter(badge.section_id), 5)
+
+def _high_score_rule(badge):
+    """Score 7.0 or higher on 3 completed exercises"""
+    if badge.section_id is None and badge.points_required == 200:
+        return BadgeRule(badge.id, HIGH_SCORES_COUNTER, 3)
+
+# Each definition maps a Badge row to a BadgeRule, or None if it does not apply
+RULE_DEFINITIONS = [_section_completion_rule, _high_score_rule]
+
+class CompiledRules:
+    """Badge rules indexed by the counter they read"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.by_counter = defaultdict(list)
+        for rule in rules:
+            self.by_counter[rule.counter].append(rule)
+
+_compiled = None
+_compiled_at = 0.0
+
+def get_rules(connection):
+    """Return the compiled rules, recompiling after badge edits or RULES_TTL"""
+    global _compiled, _compiled_at
+    if _compiled is None or time.monotonic() - _compiled_at > RULES_TTL:
+        from models import Badge
+
+        badges = Badge.__table__
+        rules = []
+        for badge in connection.execute(select(badges.c.id, badges.c.section_id, badges.c.points_required)):
+            for definition in RULE_DEFINITIONS:
+                rule = definition(badge)
+                if rule:
+                    rules.append(rule)
+        _compiled = CompiledRules(rules)
+        _compiled_at = time.monotonic()
+    return _compiled
+
+def invalidate_rules(*args):
+    global _compiled
+    _compiled = None
+
+# -- counters --------------------------------------------------------------
+
+def _contribution(completed, score):
+    """(counts as a completion, counts as a high score) for one record state"""
+    return bool(completed), bool(completed and score and score >= HIGH_SCORE)
+
+def _record_delta(pending, user_id, exercise_id, before, after):
+    completed_delta = after[0] - before[0]
+    high_delta = after[1] - before[1]
+    if completed_delta:
+        pending.append((user_id, exercise_id, completed_delta, 0))
+    if high_delta:
+        pending.append((user_id, None, 0, high_delta))
+
+def _collect_deleted_records(session, flush_context, instances):
+    from models import PracticeRecord
+
+    pending = session.info.setdefault(_PENDING_KEY, [])
+    for obj in session.deleted:
+        if isinstance(obj, PracticeRecord) and obj.user_id:
+            _record_delta(pending, obj.user_id, obj.exercise_id,
+                          _contribution(obj.completed_at, obj.score), (False, False))
+
+def _apply_practice_events(session, flush_context):
+    """Turn completion and score changes into counter deltas, then evaluate rules"""
+    from models import PracticeRecord
+
+    pending = session.info.pop(_PENDING_KEY, None) or []
+    for obj in session.new:
+        if isinstance(obj, PracticeRecord):
+            _record_delta(pending, obj.user_id, obj.exercise_id,
+                          (False, False), _contribution(obj.completed_at, obj.score))
+    for obj in session.dirty:
+        if isinstance(obj, PracticeRecord):
+            before = _contribution(previous_value(obj, 'completed_at'), previous_value(obj, 'score'))
+            _record_delta(pending, obj.user_id, obj.exercise_id,
+                          before, _contribution(obj.completed_at, obj.score))
+    if not pending:
+        return
+
+    connection = session.connection()
+    deltas = _counter_deltas(connection, pending)
+    apply_counter_deltas(connection, deltas)
+    awarded = evaluate(connection, {user_id for user_id, _ in deltas}, {name for _, name in deltas})
+    if awarded:
+        touched = session.info.setdefault('badges.touched_users', set())
+        touched.update(user_id for user_id, _ in awarded)
+
+def _counter_deltas(connection, pending):
+    """Resolve exercises to sections and sum deltas per (user_id, counter)"""
+    from models import Exercise
+
+    exercise_ids = {exercise_id for _, exercise_id, completed, _ in pending if completed}
+    sections = {}
+    if exercise_ids:
+        exercises = Exercise.__table__
+        sections = dict(connection.execute(
+            select(exercises.c.id, exercises.c.section_id).where(exercises.c.id.in_(exercise_ids))
+        ).all())
+
+    deltas = defaultdict(int)
+    for user_id, exercise_id, completed, high in pending:
+        if completed and exercise_id in sections:
+            deltas[(user_id, section_counter(sections[exercise_id]))] += completed
+        if high:
+            deltas[(user_id, HIGH_SCORES_COUNTER)] += high
+    return {key: delta for key, delta in deltas.items() if delta}
+
+def apply_counter_deltas(connection, deltas):
+    """Add {(user_id, counter): delta} to UserCounter rows, creating them as needed"""
+    from models import UserCounter
+
+    if not deltas:
+        return
+    counters = UserCounter.__table__
+    stmt = upsert(
+        connection, counters,
+        index_elements=[counters.c.user_id, counters.c.name],
+        set_=lambda row: {'value': counters.c.value + row.value},
+    )
+    connection.execute(stmt, [
+        {'user_id': user_id, 'name': name, 'value': delta}
+        for (user_id, name), delta in deltas.items()
+    ])
+
+def _expire_awarded_users(session, flush_context):
+    from models import User
+
+    for user_id in session.info.pop('badges.touched_users', ()):
+        user = session.identity_map.get(session.identity_key(User, user_id))
+        if user is not None:
+            session.expire(user, ['badges'])
+
+# -- evaluation ------------------------------------------------------------
+
+def evaluate(connection, user_ids, counter_names=None):
+    """Award every badge whose rule is satisfied for the given users
+
+    Only rules reading ``counter_names`` are considered when it is given.
+    Returns the list of (user_id, badge_id) pairs newly awarded.
+    """
+    from models import UserBadge, UserCounter
+
+    compiled = get_rules(connection)
+    if counter_names is None:
+        rules = set(compiled.rules)
+    else:
+        rules = {rule for name in counter_names for rule in compiled.by_counter.get(name, ())}
+    if not rules or not user_ids:
+        return []
+
+    counters = UserCounter.__table__
+    values = connection.execute(
+        select(counters.c.user_id, counters.c.name, counters.c.value).where(
+            counters.c.user_id.in_(list(user_ids)),
+            counters.c.name.in_(list({rule.counter for rule in rules})),
+        )
+    ).all()
+    candidates = set()
+    for user_id, name, value in values:
+        for rule in compiled.by_counter.get(name, ()):
+            if rule in rules and value >= rule.threshold:
+                candidates.add((user_id, rule.badge_id))
+    if not candidates:
+        return []
+
+    user_badges = UserBadge.__table__
+    existing = set(connection.execute(
+        select(user_badges.c.user_id, user_badges.c.badge_id).where(
+            tuple_(user_badges.c.user_id, user_badges.c.badge_id).in_(list(candidates))
+        )
+    ).all())
+    awarded = sorted(candidates - existing)
+    if awarded:
+        now = datetime.utcnow()
+        stmt = insert_ignore(connection, user_badges, [user_badges.c.user_id, user_badges.c.badge_id])
+        connection.execute(stmt, [
+            {'user_id': user_id, 'badge_id': badge_id, 'earned_at': now}
+            for user_id, badge_id in awarded
+        ])
+        logger.info(f"Awarded {len(awarded)} badges")
+    return awarded
+
+def evaluate_user(user_id):
+    """Evaluate every rule for one user and commit any awards"""
+    from app import db
+
+    from cache import invalidate_on_commit
+
+    awarded = evaluate(db.session.connection(), [user_id])
+    if awarded:
+        invalidate_on_commit(db.session, [f'user:{user_id}'])
+    db.session.commit()
+    return awarded
+
+# -- backfill --------------------------------------------------------------
+
+def rebuild_counters(connection, user_ids):
+    """Recompute the badge counters for a batch of users from practice records"""
+    from models import Exercise, PracticeRecord, UserCounter
+
+    records = PracticeRecord.__table__
+    exercises = Exercise.__table__
+    counters = UserCounter.__table__
+    completed = and_(records.c.user_id.in_(user_ids), records.c.completed_at.isnot(None))
+
+    rows = []
+    for user_id, section_id, count in connection.execute(
+        select(records.c.user_id, exercises.c.section_id, func.count())
+        .join(exercises, records.c.exercise_id == exercises.c.id)
+        .where(completed)
+        .group_by(records.c.user_id, exercises.c.section_id)
+    ):
+        rows.append({'user_id': user_id, 'name': section_counter(section_id), 'value': count})
+    for user_id, count in connection.execute(
+        select(records.c.user_id, func.count())
+        .where(completed, records.c.score >= HIGH_SCORE)
+        .group_by(records.c.user_id)
+    ):
+        rows.append({'user_id': user_id, 'name': HIGH_SCORES_COUNTER, 'value': count})
+
+    connection.execute(delete(counters).where(counters.c.user_id.in_(user_ids)))
+    if rows:
+        connection.execute(counters.insert(), rows)
+
+def backfill(batch_size=500, rebuild=True, connection=None):
+    """Re-evaluate every user in streaming batches; return the number of awards
+
+    Use after adding or changing a rule. With ``rebuild`` the counters are
+    recomputed from practice records first. Each batch commits on its own
+    unless an open ``connection`` is passed in, in which case the caller also
+    owns invalidating the cached stats of awarded users.
+    """
+    from app import db
+    from cache import cache
+
+    invalidate_rules()
+    total_awarded = 0
+    last_id = 0
+    while True:
+        if connection is not None:
+            last_id, awarded = _backfill_batch(connection, last_id, batch_size, rebuild)
+        else:
+            with db.engine.begin() as batch_connection:
+                last_id, awarded = _backfill_batch(batch_connection, last_id, batch_size, rebuild)
+            # Core inserts bypass the ORM hooks in cache.py
+            cache.invalidate(*sorted({f'user:{user_id}' for user_id, _ in awarded}))
+        if last_id is None:
+            break
+        total_awarded += len(awarded)
+    logger.info(f"Badge backfill awarded {total_awarded} badges")
+    return total_awarded
+
+def _backfill_batch(connection, last_id, batch_size, rebuild):
+    """Process the users after last_id; return (new last_id or None, awarded pairs)"""
+    from models import User
+
+    users = User.__table__
+    user_ids = connection.execute(
+        select(users.c.id).where(users.c.id > last_id).order_by(users.c.id).limit(batch_size)
+    ).scalars().all()
+    if not user_ids:
+        return None, []
+    if rebuild:
+        rebuild_counters(connection, user_ids)
+    return user_ids[-1], evaluate(connection, user_ids)
+
+def register_badge_listeners(session):
+    """Attach the practice-record event hooks to a (scoped) session, once"""
+    from models import Badge
+
+    hooks = (
+        (session, 'before_flush', _collect_deleted_records),
+        (session, 'after_flush', _apply_practice_events),
+        (session, 'after_flush_postexec', _expire_awarded_users),
+        (Badge, 'after_insert', invalidate_rules),
+        (Badge, 'after_update', invalidate_rules),
+        (Badge, 'after_delete', invalidate_rules),
+    )
+    for target, name, fn in hooks:
+        if not event.contains(target, name, fn):
+            event.listen(target, name, fn)
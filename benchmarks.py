@@ -0,0 +1,521 @@
+"""
+Performance benchmarks for hot code paths.
+
+Each benchmark builds its own throwaway SQLite database, so it can be run on a
+development machine without touching real data:
+
+    python benchmarks.py                # list available benchmarks
+    python benchmarks.py user_stats     # run one benchmark
+    python benchmarks.py all            # run every benchmark
+
+`startup_budget` exits non-zero when a worker's cold start exceeds the budget,
+so it can gate CI.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """Register a benchmark function under a command-line name"""
+    def decorator(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return decorator
+
+def _timed(fn, repeat=5):
+    """Run fn repeatedly and return (median seconds, last result)"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+def _bench_app(workdir, web=False, **overrides):
+    """Create an application bound to a scratch SQLite database
+
+    Without ``web`` no blueprints or request hooks are registered, which is all
+    the query benchmarks need.
+    """
+    from app import create_app
+    from config import DevelopmentConfig
+
+    settings = {
+        'DEBUG': False,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'VIEW_BUFFER_ENABLED': False,
+    }
+    settings.update(overrides)
+    config = type('BenchmarkConfig', (DevelopmentConfig,), settings)
+    return create_app(config, web=web)
+
+def _seed_practice_history(records_per_user, users=1, exercises=40, content_size=20000):
+    """Create sections, exercises and completed practice records"""
+    from app import db
+    from models import Section, Difficulty, Exercise, PracticeRecord, User, Role
+
+    rng = random.Random(42)
+    sections = [Section(name=name) for name in ('Reading', 'Writing', 'Listening', 'Speaking')]
+    difficulty = Difficulty(name='Intermediate')
+    db.session.add_all(sections + [difficulty])
+    db.session.flush()
+
+    passage = 'x' * content_size
+    exercise_rows = [Exercise(
+        title=f"Exercise {i}",
+        section_id=sections[i % len(sections)].id,
+        difficulty_id=difficulty.id,
+        content=json.dumps({'passage': passage, 'questions': []}),
+    ) for i in range(exercises)]
+    db.session.add_all(exercise_rows)
+
+    student_role = Role.query.filter_by(name='student').first()
+    user_rows = [User(username=f"bench{i}", email=f"bench{i}@example.com",
+                      password_hash='x', role_id=student_role.id) for i in range(users)]
+    db.session.add_all(user_rows)
+    db.session.flush()
+
+    start = datetime(2024, 1, 1)
+    for user in user_rows:
+        rows = [{
+            'user_id': user.id,
+            'exercise_id': rng.choice(exercise_rows).id,
+            'started_at': start + timedelta(minutes=i * 30),
+            'completed_at': start + timedelta(minutes=i * 30 + 20),
+            'score': rng.choice([0, 4.0, 5.5, 6.0, 6.5, 7.0, 8.0]),
+            'points_earned': 10,
+        } for i in range(records_per_user)]
+        db.session.execute(PracticeRecord.__table__.insert(), rows)
+    db.session.commit()
+    return user_rows
+
+def _legacy_get_user_stats(user):
+    """get_user_stats as it was before the grouped-query rewrite, for comparison"""
+    from models import Section
+
+    completed_records = [r for r in user.practice_records if r.completed_at]
+    section_data = {}
+    for section in Section.query.all():
+        section_records = [r for r in completed_records if r.exercise.section_id == section.id]
+        avg_score = sum([r.score for r in section_records if r.score]) / max(1, len([r for r in section_records if r.score]))
+        section_data[section.name] = {
+            'completed': len(section_records),
+            'average_score': avg_score if section_records else 0
+        }
+    recent_records = sorted(completed_records, key=lambda r: r.completed_at or datetime.min, reverse=True)[:5]
+    return {
+        'total_completed': len(completed_records),
+        'section_data': section_data,
+        'recent_records': recent_records,
+        'badges_earned': len(user.badges),
+        'average_score': sum([r.score for r in completed_records if r.score]) / max(1, len([r for r in completed_records if r.score]))
+    }
+
+@benchmark('user_stats')
+def bench_user_stats(records=10000):
+    """Dashboard statistics for a user with 10k practice records"""
+    from app import db
+    from models import User
+    from utils import get_user_stats
+
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        app = _bench_app(workdir)
+        with app.app_context():
+            user_id = _seed_practice_history(records)[0].id
+
+            def run(fn):
+                db.session.remove()
+                return fn(db.session.get(User, user_id))
+
+            legacy_time, legacy = _timed(lambda: run(_legacy_get_user_stats), repeat=3)
+            new_time, new = _timed(lambda: run(get_user_stats).to_dict(), repeat=3)
+
+            for result in (legacy, new):
+                result['recent_records'] = [r.id for r in result['recent_records']]
+            assert legacy == new, f"Output mismatch:\n{legacy}\n{new}"
+
+            print(f"records per user:  {records}")
+            print(f"legacy (Python):   {legacy_time * 1000:.1f} ms")
+            print(f"grouped SQL:       {new_time * 1000:.1f} ms")
+            print(f"speedup:           {legacy_time / new_time:.1f}x (outputs identical)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+class _StatementRecorder:
+    """Capture the SQL statements an engine executes"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            self.statements.append((statement, parameters))
+
+    def __enter__(self):
+        from sqlalchemy import event
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        from sqlalchemy import event
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    def bytes_fetched(self):
+        """Replay the captured SELECTs and total the size of every value returned"""
+        total = 0
+        raw = self.engine.raw_connection()
+        try:
+            cursor = raw.cursor()
+            for statement, parameters in self.statements:
+                cursor.execute(statement, parameters)
+                for row in cursor.fetchall():
+                    for value in row:
+                        if isinstance(value, (str, bytes)):
+                            total += len(value)
+                        elif value is not None:
+                            total += 8
+        finally:
+            raw.close()
+        return total
+
+@benchmark('exercise_listing')
+def bench_exercise_listing(exercises=40, content_size=60000):
+    """Bytes fetched by an exercise listing and a history page"""
+    from app import db
+    from sqlalchemy.orm import undefer
+    from models import Exercise, PracticeRecord
+
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        app = _bench_app(workdir)
+        with app.app_context():
+            user_id = _seed_practice_history(200, exercises=exercises, content_size=content_size)[0].id
+
+            def listing_request(eager_content):
+                db.session.remove()
+                query = Exercise.query
+                if eager_content:
+                    query = query.options(undefer(Exercise.content))
+                titles = [(e.title, e.section_id, e.duration) for e in query.order_by(Exercise.id).all()]
+                history = PracticeRecord.query.filter_by(user_id=user_id).order_by(
+                    PracticeRecord.completed_at.desc()).limit(50).all()
+                titles += [(r.exercise.title, r.score, None) for r in history]
+                return titles
+
+            results = {}
+            for label, eager in (('full rows (before)', True), ('metadata only (after)', False)):
+                with _StatementRecorder(db.engine) as recorder:
+                    elapsed, _ = _timed(lambda: listing_request(eager), repeat=1)
+                results[label] = (recorder.bytes_fetched(), len(recorder.statements), elapsed)
+
+            print(f"exercises: {exercises}, content per exercise: {content_size} bytes")
+            for label, (fetched, statements, elapsed) in results.items():
+                print(f"{label:24} {fetched / 1024:10.1f} KiB fetched  {statements:3} queries  {elapsed * 1000:7.1f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+_COLD_START_PROBE = """
+import time
+started = time.perf_counter()
+import app as application
+imported = time.perf_counter()
+flask_app = application.app
+
+@flask_app.route('/__cold_start_probe')
+def cold_start_probe():
+    return 'ok'
+
+response = flask_app.test_client().get('/__cold_start_probe')
+assert response.status_code == 200, response.status_code
+done = time.perf_counter()
+print(f"{(imported - started) * 1000:.1f} {(done - started) * 1000:.1f}")
+"""
+
+def _cold_start(workdir, env_overrides=None):
+    """Time a fresh interpreter from 'import app' to its first response"""
+    import subprocess
+
+    env = dict(os.environ)
+    env.update({
+        'DATABASE_URL': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        'FLASK_ENV': 'development',
+        'PYTHONPATH': os.pathsep.join(p for p in sys.path if p),
+    })
+    env.update(env_overrides or {})
+    output = subprocess.run(
+        [sys.executable, '-c', _COLD_START_PROBE],
+        cwd=workdir, env=env, capture_output=True, text=True, check=True,
+    ).stdout.strip().splitlines()[-1]
+    import_ms, first_response_ms = (float(value) for value in output.split())
+    return import_ms, first_response_ms
+
+@benchmark('cold_start')
+def bench_cold_start(runs=5):
+    """Worker cold start, from import to first response"""
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        _, bootstrap_ms = _cold_start(workdir)
+        timings = [_cold_start(workdir) for _ in range(runs)]
+        print(f"first boot (bootstraps the database): {bootstrap_ms:8.1f} ms")
+        print(f"warm database, import only (median):  {statistics.median(t[0] for t in timings):8.1f} ms")
+        print(f"warm database, first response:        {statistics.median(t[1] for t in timings):8.1f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+@benchmark('request_metrics')
+def bench_request_metrics(requests=2000):
+    """Per-request overhead of endpoint latency/SQL metrics collection"""
+    from app import db
+    from models import Exercise, Section
+    from request_metrics import render_metrics, request_metrics
+
+    def per_request_us(metrics_enabled):
+        workdir = tempfile.mkdtemp(prefix='bench-')
+        try:
+            app = _bench_app(workdir, web=True, METRICS_ENABLED=metrics_enabled)
+
+            @app.route('/__bench_listing')
+            def bench_listing():
+                sections = Section.query.all()
+                exercises = Exercise.query.limit(20).all()
+                return {'sections': len(sections), 'exercises': len(exercises)}
+
+            client = app.test_client()
+            elapsed, _ = _timed(lambda: [client.get('/__bench_listing') for _ in range(requests)], repeat=3)
+            return elapsed / requests * 1e6, app
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline_us, _ = per_request_us(False)
+    instrumented_us, app = per_request_us(True)
+    render_time, body = _timed(lambda: render_metrics(app), repeat=5)
+    request_metrics.reset()
+
+    print(f"requests per run:         {requests}")
+    print(f"without metrics:          {baseline_us:8.1f} us/request")
+    print(f"with metrics:             {instrumented_us:8.1f} us/request")
+    print(f"overhead:                 {instrumented_us - baseline_us:8.1f} us/request "
+          f"({(instrumented_us - baseline_us) / baseline_us * 100:.1f}%)")
+    print(f"render /admin/metrics:    {render_time * 1000:8.2f} ms ({len(body)} bytes)")
+
+_MOCK_TEST_PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+  <meta charset="utf-8">
+  <title>{{ title }} - IELTS Prep</title>
+  <link rel="stylesheet" href="/static/css/bootstrap.min.css">
+  <link rel="stylesheet" href="/static/css/style.css">
+</head>
+<body class="mock-test">
+  <nav class="navbar navbar-expand-lg navbar-dark bg-primary"><div class="container">
+    <a class="navbar-brand" href="/">IELTS Prep</a>
+    <ul class="navbar-nav">{% for item in ['Dashboard', 'Practice', 'Mock Tests', 'Resources', 'Profile'] %}
+      <li class="nav-item"><a class="nav-link" href="#">{{ item }}</a></li>{% endfor %}</ul>
+  </div></nav>
+  <main class="container my-4">
+    <div class="d-flex justify-content-between"><h1>{{ title }}</h1><div id="timer" class="badge bg-warning">60:00</div></div>
+    <form method="post" id="test-form">
+    {% for key, passage in content.passages.items() %}
+      <section class="row passage-block" id="{{ key }}">
+        <div class="col-md-7 passage-text">{{ passage|safe }}</div>
+        <div class="col-md-5 questions">
+        {% for question in content.questions.get(key, []) %}
+          <div class="card mb-3 question" data-number="{{ question.number }}"><div class="card-body">
+            <p class="question-text"><strong>{{ question.number }}.</strong> {{ question.text }}</p>
+            {% if question.options %}{% for option in question.options %}
+            <div class="form-check">
+              <input class="form-check-input" type="radio" name="q{{ question.number }}" id="q{{ question.number }}_{{ loop.index }}" value="{{ option }}">
+              <label class="form-check-label" for="q{{ question.number }}_{{ loop.index }}">{{ option }}</label>
+            </div>{% endfor %}{% else %}
+            <input class="form-control" type="text" name="q{{ question.number }}" autocomplete="off">{% endif %}
+          </div></div>
+        {% endfor %}
+        </div>
+      </section>
+    {% endfor %}
+      <button type="submit" class="btn btn-success btn-lg">Submit answers</button>
+    </form>
+  </main>
+  <script src="/static/js/bootstrap.bundle.min.js"></script>
+  <script src="/static/js/practice.js"></script>
+</body>
+</html>
+"""
+
+def _mock_test_page():
+    """Render the reading mock test seeded by create_mock_reading_test.py as a full page"""
+    import ast
+    from jinja2 import Template
+
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'create_mock_reading_test.py')
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    content = next(
+        ast.literal_eval(node.value) for node in ast.walk(tree)
+        if isinstance(node, ast.Assign) and getattr(node.targets[0], 'id', None) == 'reading_content'
+    )
+    return Template(_MOCK_TEST_PAGE).render(title='Academic Reading Mock Test', content=content).encode('utf-8')
+
+@benchmark('compression')
+def bench_compression(repeat=50):
+    """CPU cost against bytes saved when compressing a mock-test page"""
+    from compression import BROTLI_AVAILABLE, compress
+
+    page = _mock_test_page()
+    settings = [('gzip', level) for level in (1, 6, 9)]
+    if BROTLI_AVAILABLE:
+        settings += [('br', level) for level in (4, 6, 11)]
+
+    print(f"page: {len(page) / 1024:.1f} KiB of HTML")
+    print(f"{'encoding':10} {'level':>5} {'size KiB':>9} {'saved':>7} {'cpu ms':>8} {'KiB saved per cpu ms':>21}")
+    for encoding, level in settings:
+        elapsed, compressed = _timed(lambda: compress(page, encoding, level), repeat=repeat)
+        saved = len(page) - len(compressed)
+        print(f"{encoding:10} {level:5} {len(compressed) / 1024:9.1f} {saved / len(page):6.1%} "
+              f"{elapsed * 1000:8.2f} {saved / 1024 / max(elapsed * 1000, 1e-6):21.1f}")
+    if not BROTLI_AVAILABLE:
+        print("(install brotli to include br in the comparison)")
+
+def _upload_source(path, size, header):
+    """Write a fake upload of the given size starting with header"""
+    with open(path, 'wb') as f:
+        f.write(header)
+        block = os.urandom(1024 * 1024)
+        remaining = size - len(header)
+        while remaining > 0:
+            f.write(block[:remaining])
+            remaining -= len(block)
+
+@benchmark('upload_streaming')
+def bench_upload_streaming(size_mb=40, repeat=3):
+    """Throughput and peak memory of streamed against save-then-sniff uploads"""
+    import tracemalloc
+    from werkzeug.datastructures import FileStorage
+    from upload_utils import MAGIC_AVAILABLE, FileUploader
+
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        app = _bench_app(workdir)
+        app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')  # create_app sets its own
+        audio = os.path.join(workdir, 'lecture.mp3')
+        _upload_source(audio, size_mb * 1024 * 1024, b'ID3\x03\x00\x00\x00\x00\x00\x00' + b'\xff\xfb\x90\x64' * 512)
+        fake = os.path.join(workdir, 'fake.mp3')
+        _upload_source(fake, size_mb * 1024 * 1024, b'MZ\x90\x00' + b'\x00' * 60)
+
+        def upload(source, stream):
+            with open(source, 'rb') as f:
+                filename = 'lecture.mp3' if source == audio else 'not_audio.mp3'
+                result = FileUploader.save_file(FileStorage(f, filename=filename), 'bench', 'audio', stream=stream)
+            if result[0]:
+                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], result[1]))
+            return result
+
+        print(f"upload size: {size_mb} MiB; MIME detection: {'libmagic' if MAGIC_AVAILABLE else 'mimetypes fallback (install python-magic to sniff content)'}")
+        print(f"{'mode':22} {'accepted MiB/s':>15} {'rejected ms':>12} {'peak KiB':>9}")
+        with app.test_request_context():
+            for label, stream in (('save, then sniff', False), ('streamed', True)):
+                elapsed, result = _timed(lambda: upload(audio, stream), repeat=repeat)
+                rejected, rejected_result = _timed(lambda: upload(fake, stream), repeat=repeat)
+                tracemalloc.start()
+                upload(audio, stream)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"{label:22} {size_mb / elapsed:15.0f} {rejected * 1000:12.1f} {peak / 1024:9.0f}")
+                if not result[0]:
+                    print(f"  upload failed: {result[1]}")
+                if not MAGIC_AVAILABLE and rejected_result[0]:
+                    print("  (fake upload accepted: the filename fallback cannot see its content)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def _import_times(module='app'):
+    """Per-module import cost from `python -X importtime`, in microseconds
+
+    Returns a list of (module, self_us, cumulative_us) in import order.
+    """
+    import subprocess
+
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    stderr = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        env=env, capture_output=True, text=True, check=True,
+    ).stderr
+    timings = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timings.append((name.strip(), int(self_us), int(cumulative_us)))
+    return timings
+
+@benchmark('import_profile')
+def bench_import_profile(module='app', top=25):
+    """Per-module import cost of `import app`, slowest first"""
+    timings = _import_times(module)
+    by_package = {}
+    for name, self_us, _ in timings:
+        package = name.split('.')[0]
+        by_package[package] = by_package.get(package, 0) + self_us
+
+    total_us = sum(self_us for _, self_us, _ in timings)
+    print(f"{len(timings)} modules, {total_us / 1000:.1f} ms total")
+    print(f"\n{'package':30} {'self ms':>9}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"{package:30} {self_us / 1000:9.1f}")
+    print(f"\n{'module':50} {'self ms':>9} {'cumul. ms':>10}")
+    for name, self_us, cumulative_us in sorted(timings, key=lambda item: -item[1])[:top]:
+        print(f"{name:50} {self_us / 1000:9.1f} {cumulative_us / 1000:10.1f}")
+
+# Default budget for a worker to import, build the app and answer one request.
+# Override with STARTUP_BUDGET_MS on slower CI machines.
+STARTUP_BUDGET_MS = 2000
+
+@benchmark('startup_budget')
+def bench_startup_budget(runs=5):
+    """Fail when worker cold start exceeds STARTUP_BUDGET_MS"""
+    budget_ms = float(os.environ.get('STARTUP_BUDGET_MS', STARTUP_BUDGET_MS))
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    try:
+        _cold_start(workdir)  # first boot bootstraps the database; not part of the budget
+        first_response_ms = statistics.median(_cold_start(workdir)[1] for _ in range(runs))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{f'first response (median of {runs}):':34} {first_response_ms:8.1f} ms")
+    print(f"{'budget:':34} {budget_ms:8.1f} ms")
+    if first_response_ms > budget_ms:
+        print("FAIL: startup budget exceeded; run 'python benchmarks.py import_profile' to find the cost")
+        return False
+    print("OK")
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        for name, fn in BENCHMARKS.items():
+            print(f"{name:20} {fn.__doc__}")
+        sys.exit(0)
+    names = list(BENCHMARKS) if sys.argv[1] == 'all' else sys.argv[1:]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmark: {', '.join(unknown)}")
+        sys.exit(2)
+    # A benchmark that checks a budget returns False when it is exceeded;
+    # the rest still run and the exit status reports the failure
+    failed = []
+    for name in names:
+        print(f"== {name}: {BENCHMARKS[name].__doc__}")
+        if BENCHMARKS[name]() is False:
+            failed.append(name)
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+        sys.exit(1)
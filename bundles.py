@@ -0,0 +1,142 @@
+"""
+CSS/JS bundles for templates.
+
+``ASSET_BUNDLES`` maps a logical bundle name to the static files it is built
+from. ``flask build-bundles`` (also run by ``flask build-assets``) concatenates
+and minifies each bundle into ``static/bundles/<name>``; the asset manifest
+then gives it a content-hashed URL. Templates ask for bundles by name:
+
+    {% for url in bundle_urls('base.css') %}<link rel="stylesheet" href="{{ url }}">{% endfor %}
+
+which yields the one bundle URL, or the separate source files while
+``ASSET_BUNDLES_DEBUG`` is set or the bundle has not been built.
+
+CSS is minified by ``rcssmin`` when installed, otherwise by a conservative
+built-in minifier. JavaScript is only minified when ``rjsmin`` is installed;
+without it bundles are concatenated as they are, which still saves the round
+trips, and gzip/brotli take care of most of the whitespace.
+"""
+import os
+import re
+import logging
+import posixpath
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_DIR = 'bundles'
+
+# Minifiers are optional; without them CSS gets the built-in minifier and JS none
+RCSSMIN_AVAILABLE = False
+try:
+    import rcssmin
+    RCSSMIN_AVAILABLE = True
+except ImportError:
+    logger.info("rcssmin not available, using the built-in CSS minifier")
+
+RJSMIN_AVAILABLE = False
+try:
+    import rjsmin
+    RJSMIN_AVAILABLE = True
+except ImportError:
+    logger.info("rjsmin not available, JavaScript bundles will not be minified")
+
+_CSS_STRING_OR_COMMENT = re.compile(r'''"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|/\*.*?\*/''', re.S)
+_CSS_PUNCTUATION = re.compile(r'\s*([{};,>])\s*')
+_CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+_CSS_CHARSET = re.compile(r'@charset\s+["\'][^"\']*["\']\s*;', re.I)
+
+def _squeeze_css(code):
+    code = re.sub(r'\s+', ' ', code)
+    code = _CSS_PUNCTUATION.sub(r'\1', code)
+    code = re.sub(r':\s+', ':', code)
+    code = re.sub(r'\(\s+', '(', code)
+    code = re.sub(r'\s+\)', ')', code)
+    return code.replace(';}', '}')
+
+def minify_css(text):
+    """Strip comments and insignificant whitespace; strings and /*! notices are kept"""
+    if RCSSMIN_AVAILABLE:
+        return rcssmin.cssmin(text, keep_bang_comments=True)
+
+    out, code, pos = [], [], 0
+
+    def flush():
+        out.append(_squeeze_css(''.join(code)))
+        code.clear()
+
+    for match in _CSS_STRING_OR_COMMENT.finditer(text):
+        code.append(text[pos:match.start()])
+        token = match.group()
+        if token.startswith('/*') and not token.startswith('/*!'):
+            code.append(' ')  # a comment still separates the tokens around it
+        else:
+            flush()
+            out.append(token)
+        pos = match.end()
+    code.append(text[pos:])
+    flush()
+    return ''.join(out).strip()
+
+def minify_js(text):
+    if RJSMIN_AVAILABLE:
+        return rjsmin.jsmin(text, keep_bang_comments=True)
+    return text
+
+def rebase_css_urls(text, source, target_dir):
+    """Rewrite relative url(...) references of a stylesheet moved into target_dir"""
+    source_dir = posixpath.dirname(source)
+
+    def rebase(match):
+        quote, url = match.group(1), match.group(2).strip()
+        if url.startswith(('/', '#', 'data:')) or re.match(r'^[a-z][a-z0-9+.-]*:', url, re.I):
+            return match.group()
+        rebased = posixpath.relpath(posixpath.normpath(posixpath.join(source_dir, url)), target_dir)
+        return f"url({quote}{rebased}{quote})"
+
+    return _CSS_URL.sub(rebase, text)
+
+def _bundle_contents(static_folder, name, sources):
+    parts = []
+    for source in sources:
+        with open(os.path.join(static_folder, source), encoding='utf-8') as f:
+            text = f.read()
+        if name.endswith('.css'):
+            if '@import' in text:
+                logger.warning(f"{source} uses @import, which only works at the top of bundle {name}")
+            text = _CSS_CHARSET.sub('', rebase_css_urls(text, source, posixpath.dirname(f'{BUNDLE_DIR}/{name}')))
+            parts.append(minify_css(text))
+        else:
+            parts.append(minify_js(text).strip())
+    # A JS source without a trailing semicolon must not run into the next one
+    return ('\n' if name.endswith('.css') else ';\n').join(parts) + '\n'
+
+def build_bundles(static_folder, bundles):
+    """Write every bundle whose sources exist into static/bundles; returns a summary
+
+    A bundle is only rewritten when its contents change, so the hashed name
+    and any precompressed siblings stay valid across identical builds.
+    """
+    summary = {'bundles': 0, 'written': 0, 'unchanged': 0, 'missing': {}, 'bytes_in': 0, 'bytes_out': 0}
+    for name, sources in sorted(bundles.items()):
+        missing = [source for source in sources if not os.path.isfile(os.path.join(static_folder, source))]
+        if missing:
+            summary['missing'][name] = missing
+            logger.warning(f"Skipping bundle {name}: missing {', '.join(missing)}")
+            continue
+
+        contents = _bundle_contents(static_folder, name, sources).encode('utf-8')
+        summary['bundles'] += 1
+        summary['bytes_in'] += sum(os.path.getsize(os.path.join(static_folder, source)) for source in sources)
+        summary['bytes_out'] += len(contents)
+
+        target = os.path.join(static_folder, BUNDLE_DIR, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            with open(target, 'rb') as f:
+                if f.read() == contents:
+                    summary['unchanged'] += 1
+                    continue
+        with open(target, 'wb') as f:
+            f.write(contents)
+        summary['written'] += 1
+    return summary
@@ -0,0 +1,384 @@
+"""
+Application cache selected by ``CACHE_TYPE``.
+
+``SimpleCache`` keeps entries in this process, ``RedisCache`` shares them
+between workers through ``CACHE_REDIS_URL`` and ``NullCache`` disables
+caching. With ``SimpleCache`` an invalidation only reaches the worker that
+made the write, so its entries never outlive ``CACHE_LOCAL_TIMEOUT``. Service functions opt in with ``@memoize``; keys are namespaced by
+``CACHE_KEY_PREFIX`` and the function name, and entries carry tags.
+
+Invalidation is by tag: every tag has a version stored in the backend and an
+entry is only served while the versions it was stored with are current.
+Committed writes to exercises, articles, practice records, badges and badge
+awards bump the matching tags (see ``model_tags``). Writes that bypass the ORM (bulk inserts,
+raw SQL) do not invalidate; entries then expire after their timeout.
+"""
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from datetime import date, datetime
+from functools import wraps
+from sqlalchemy import event, inspect
+from sqlalchemy.exc import NoInspectionAvailable
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+_TAG_SPACE = 'tag:'
+
+class NullBackend:
+    """Stores nothing"""
+
+    def get_many(self, keys):
+        return [None] * len(keys)
+
+    def set(self, key, value, timeout):
+        pass
+
+    def add(self, key, value, timeout):
+        return False
+
+    def delete(self, key):
+        pass
+
+    def incr(self, key):
+        return None
+
+    def clear(self, prefix):
+        pass
+
+class SimpleBackend:
+    """Thread-safe in-process store with expiry and an entry threshold"""
+
+    def __init__(self, threshold=500):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._entries = {}  # key -> (expires_at or 0, bytes)
+
+    def _live(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] and entry[0] <= now:
+            del self._entries[key]
+            return None
+        return entry[1]
+
+    def get_many(self, keys):
+        now = time.monotonic()
+        with self._lock:
+            return [self._live(key, now) for key in keys]
+
+    def _prune(self, now):
+        if len(self._entries) < self.threshold:
+            return
+        for key in [key for key, (expires, _) in self._entries.items() if expires and expires <= now]:
+            del self._entries[key]
+        # Still full: drop the oldest insertions first
+        while len(self._entries) >= self.threshold:
+            del self._entries[next(iter(self._entries))]
+
+    def set(self, key, value, timeout):
+        now = time.monotonic()
+        with self._lock:
+            self._entries.pop(key, None)
+            self._prune(now)
+            self._entries[key] = (now + timeout if timeout else 0, value)
+
+    def add(self, key, value, timeout):
+        now = time.monotonic()
+        with self._lock:
+            if self._live(key, now) is not None:
+                return False
+            self._prune(now)
+            self._entries[key] = (now + timeout if timeout else 0, value)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def incr(self, key):
+        with self._lock:
+            expires, value = self._entries.get(key, (0, b'0'))
+            value = str(int(value) + 1).encode()
+            self._entries[key] = (expires, value)
+            return int(value)
+
+    def clear(self, prefix):
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+class RedisBackend:
+    """Shared store in Redis; values are opaque bytes"""
+
+    def __init__(self, url=None, client=None):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self.client = client
+
+    def get_many(self, keys):
+        return self.client.mget(keys)
+
+    def set(self, key, value, timeout):
+        self.client.set(key, value, ex=timeout or None)
+
+    def add(self, key, value, timeout):
+        return bool(self.client.set(key, value, ex=timeout or None, nx=True))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+    def clear(self, prefix):
+        keys = list(self.client.scan_iter(match=f"{prefix}*", count=500))
+        for i in range(0, len(keys), 500):
+            self.client.delete(*keys[i:i + 500])
+
+def make_backend(config):
+    cache_type = config.get('CACHE_TYPE', 'SimpleCache')
+    if cache_type == 'NullCache':
+        return NullBackend()
+    if cache_type == 'SimpleCache':
+        return SimpleBackend(config.get('CACHE_THRESHOLD', 500))
+    if cache_type == 'RedisCache':
+        return RedisBackend(config.get('CACHE_REDIS_URL'))
+    raise ValueError(f"Unsupported CACHE_TYPE: {cache_type}")
+
+class AppCache:
+    """Tagged get/set on top of a backend; backend errors are treated as misses"""
+
+    def __init__(self, backend=None, prefix='ieltsprep:', default_timeout=3600, max_timeout=None):
+        self.backend = backend or NullBackend()
+        self.prefix = prefix
+        self.default_timeout = default_timeout
+        self.max_timeout = max_timeout
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    def configure(self, backend, prefix, default_timeout, max_timeout=None):
+        self.backend = backend
+        self.prefix = prefix
+        self.default_timeout = default_timeout
+        self.max_timeout = max_timeout
+
+    @property
+    def enabled(self):
+        return not isinstance(self.backend, NullBackend)
+
+    def _tag_key(self, tag):
+        return f"{self.prefix}{_TAG_SPACE}{tag}"
+
+    def get(self, key, tags=()):
+        """The cached value for key, or _MISSING when absent, expired or invalidated"""
+        return self.lookup(key, tags)[0]
+
+    def lookup(self, key, tags=()):
+        """(value or _MISSING, tag versions) for key
+
+        On a miss the versions are the ones current before the caller computes
+        the value; passing them to ``set`` stores it as stale if a tag is
+        invalidated meanwhile. They are None when the backend failed.
+        """
+        tags = list(tags)
+        try:
+            raw, *versions = self.backend.get_many([self.prefix + key] + [self._tag_key(tag) for tag in tags])
+        except Exception as e:
+            self._failed('get', e)
+            return _MISSING, None
+        if raw is not None:
+            stored_versions, value = pickle.loads(raw)
+            if stored_versions == versions and None not in versions:
+                self.hits += 1
+                return value, versions
+        self.misses += 1
+        try:
+            versions = [self._tag_version(tag) if version is None else version
+                        for tag, version in zip(tags, versions)]
+        except Exception as e:
+            self._failed('get', e)
+            return _MISSING, None
+        return _MISSING, versions
+
+    def set(self, key, value, timeout=None, tags=(), versions=None):
+        """Store value with its tags' versions, taken from ``lookup`` when given
+
+        Without versions the current ones are read, which is only safe when
+        value cannot predate a concurrent invalidation.
+        """
+        timeout = self.default_timeout if timeout is None else timeout
+        if self.max_timeout and (not timeout or timeout > self.max_timeout):
+            timeout = self.max_timeout
+        try:
+            if versions is None:
+                versions = [self._tag_version(tag) for tag in tags]
+            self.backend.set(self.prefix + key, pickle.dumps((list(versions), value), pickle.HIGHEST_PROTOCOL), timeout)
+        except Exception as e:
+            self._failed('set', e)
+
+    def _tag_version(self, tag):
+        key = self._tag_key(tag)
+        # Start unseen tags at a time-based version, so a tag that is evicted
+        # and recreated can never match entries stored against the old one
+        self.backend.add(key, str(time.time_ns()).encode(), 0)
+        return self.backend.get_many([key])[0]
+
+    def delete(self, key):
+        try:
+            self.backend.delete(self.prefix + key)
+        except Exception as e:
+            self._failed('delete', e)
+
+    def invalidate(self, *tags):
+        """Make every entry stored with any of these tags stale"""
+        for tag in tags:
+            try:
+                self.backend.incr(self._tag_key(tag))
+                self.invalidations += 1
+            except Exception as e:
+                self._failed('invalidate', e)
+
+    def clear(self):
+        try:
+            self.backend.clear(self.prefix)
+        except Exception as e:
+            self._failed('clear', e)
+
+    def _failed(self, operation, error):
+        self.errors += 1
+        logger.warning(f"Cache {operation} failed: {error}")
+
+    def metrics(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'errors': self.errors,
+        }
+
+cache = AppCache()
+
+def _key_part(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return repr(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return '(' + ','.join(_key_part(item) for item in value) + ')'
+    if isinstance(value, dict):
+        return '{' + ','.join(f"{_key_part(k)}:{_key_part(v)}" for k, v in sorted(value.items())) + '}'
+    try:
+        state = inspect(value)
+    except NoInspectionAvailable:
+        return repr(value)
+    # Model instances are keyed by class and primary key
+    return f"{type(value).__name__}#{_key_part(state.identity)}"
+
+def make_key(namespace, args, kwargs, version=1):
+    arguments = _key_part(args) + _key_part(kwargs)
+    digest = hashlib.blake2b(arguments.encode('utf-8'), digest_size=12).hexdigest()
+    return f"{namespace}:v{version}:{digest}"
+
+def memoize(timeout=None, tags=(), namespace=None, version=1):
+    """Cache a function's return value per argument list
+
+    ``tags`` is a sequence of tag names, or a callable taking the function's
+    arguments and returning one (e.g. ``lambda user_id: [f'user:{user_id}']``).
+    Bump ``version`` when the shape of the returned value changes. Results are
+    pickled, so return plain data rather than ORM objects.
+    """
+    def decorator(fn):
+        name = namespace or f"{fn.__module__}.{fn.__qualname__}"
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not cache.enabled:
+                return fn(*args, **kwargs)
+            key = make_key(name, args, kwargs, version)
+            entry_tags = list(tags(*args, **kwargs) if callable(tags) else tags)
+            value, versions = cache.lookup(key, entry_tags)
+            if value is _MISSING:
+                value = fn(*args, **kwargs)
+                if versions is not None:
+                    # Versions from before fn ran: a concurrent invalidation leaves this entry stale
+                    cache.set(key, value, timeout, entry_tags, versions)
+            return value
+
+        wrapper.uncached = fn
+        wrapper.invalidate = lambda *args, **kwargs: cache.delete(make_key(name, args, kwargs, version))
+        return wrapper
+    return decorator
+
+# -- invalidation from model writes ------------------------------------------
+
+_PENDING_TAGS = 'cache.pending_tags'
+
+def model_tags(obj):
+    """Tags made stale by a committed write to obj"""
+    from models import Article, Badge, Exercise, PracticeRecord, UserBadge
+
+    if isinstance(obj, Exercise):
+        return {'exercises', f'exercise:{obj.id}'}
+    if isinstance(obj, Article):
+        return {'articles', f'article:{obj.id}'}
+    if isinstance(obj, PracticeRecord):
+        return {f'user:{obj.user_id}', 'leaderboard'}
+    if isinstance(obj, Badge):
+        return {'badges'}
+    if isinstance(obj, UserBadge):
+        return {f'user:{obj.user_id}'}
+    return set()
+
+def _collect_tags(session, flush_context):
+    pending = session.info.setdefault(_PENDING_TAGS, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        pending |= model_tags(obj)
+
+def _invalidate_committed(session):
+    tags = session.info.pop(_PENDING_TAGS, None)
+    if tags:
+        cache.invalidate(*sorted(tags))
+
+def invalidate_on_commit(session, tags):
+    """Bump tags when session commits, for writes that bypass the ORM"""
+    session.info.setdefault(_PENDING_TAGS, set()).update(tags)
+
+def _discard_pending(session, previous_transaction):
+    # A rolled-back savepoint leaves the outer transaction's writes pending
+    if not session.in_transaction():
+        session.info.pop(_PENDING_TAGS, None)
+
+def register_cache_listeners(session):
+    """Invalidate tags after commit, so a concurrent read cannot re-cache old rows"""
+    hooks = (
+        ('after_flush', _collect_tags),
+        ('after_commit', _invalidate_committed),
+        ('after_soft_rollback', _discard_pending),
+    )
+    for name, fn in hooks:
+        if not event.contains(session, name, fn):
+            event.listen(session, name, fn)
+
+def init_cache(app):
+    """Select the backend from CACHE_TYPE and hook up write invalidation"""
+    from app import db
+
+    backend = make_backend(app.config)
+    # Other workers never see this process's invalidations, so bound how stale they get
+    max_timeout = app.config.get('CACHE_LOCAL_TIMEOUT', 60) if isinstance(backend, SimpleBackend) else None
+    cache.configure(
+        backend,
+        app.config.get('CACHE_KEY_PREFIX', 'ieltsprep:'),
+        app.config.get('CACHE_DEFAULT_TIMEOUT', 3600),
+        max_timeout,
+    )
+    register_cache_listeners(db.session)
+    app.extensions['cache'] = cache
@@ -0,0 +1,107 @@
+"""
+Query-plan regression check for the core access paths.
+
+Runs EXPLAIN (PostgreSQL) or EXPLAIN QUERY PLAN (SQLite) for each known hot
+query against the configured database and fails if any of them falls back to
+a full table scan. tests/test_query_plans.py runs the same check in the test
+suite; run it by hand against a real database after schema changes:
+
+    python check_query_plans.py          # exit status 1 on regression
+    python check_query_plans.py --show   # also print every plan
+"""
+import sys
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import select, text
+from app import db
+from models import User, Exercise, PracticeRecord, Badge, UserBadge, ArticleView
+
+def known_queries():
+    """(name, statement) pairs for the queries that must stay indexed"""
+    since = datetime(2024, 1, 1)
+    return [
+        ('recent practice records for a user', select(PracticeRecord.id)
+            .where(PracticeRecord.user_id == 1, PracticeRecord.completed_at.is_not(None))
+            .order_by(PracticeRecord.completed_at.desc()).limit(5)),
+        ('practice records for an exercise', select(PracticeRecord.id)
+            .where(PracticeRecord.exercise_id == 1)),
+        ('article views in a date range', select(ArticleView.id)
+            .where(ArticleView.article_id == 1, ArticleView.viewed_at >= since,
+                   ArticleView.viewed_at < since + timedelta(days=30))),
+        ('badge already awarded', select(UserBadge.id)
+            .where(UserBadge.user_id == 1, UserBadge.badge_id == 1)),
+        ('exercise listing by section and difficulty', select(Exercise.id, Exercise.title)
+            .where(Exercise.section_id == 1, Exercise.difficulty_id == 1, Exercise.is_mock_test.is_(False))),
+        ('badge lookup by section and threshold', select(Badge.id)
+            .where(Badge.section_id == 1, Badge.points_required == 50)),
+        ('points leaderboard', select(User.id)
+            .order_by(User.points_total.desc()).limit(10)),
+    ]
+
+def _sqlite_plan(conn, sql):
+    rows = conn.execute(text(f"EXPLAIN QUERY PLAN {sql}")).all()
+    plan = [row[-1] for row in rows]
+    # "SCAN t" is a full scan; "SCAN t USING [COVERING] INDEX ix" walks an index in order
+    full_scans = [line for line in plan if line.startswith('SCAN') and 'USING' not in line]
+    return plan, full_scans
+
+def _postgresql_plan(conn, sql):
+    # Tiny tables make sequential scans legitimately cheaper, so only allow one
+    # when no usable index exists
+    conn.execute(text("SET LOCAL enable_seqscan = off"))
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    full_scans = []
+
+    def walk(node):
+        if node.get('Node Type') == 'Seq Scan':
+            full_scans.append(f"Seq Scan on {node.get('Relation Name')}")
+        for child in node.get('Plans', []):
+            walk(child)
+
+    walk(plan[0]['Plan'])
+    return plan, full_scans
+
+def explain(conn, stmt):
+    """(SQL, plan, full scans) for a statement on conn's database"""
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        explain_sql = _sqlite_plan
+    elif dialect == 'postgresql':
+        explain_sql = _postgresql_plan
+    else:
+        raise RuntimeError(f"No plan checker for the {dialect} dialect")
+    sql = str(stmt.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True}))
+    with conn.begin():
+        plan, full_scans = explain_sql(conn, sql)
+    return sql, plan, full_scans
+
+def check_query_plans(show=False):
+    """Return the list of (name, full scans) for queries that regressed"""
+    dialect = db.engine.dialect.name
+    regressions = []
+    with db.engine.connect() as conn:
+        for name, stmt in known_queries():
+            sql, plan, full_scans = explain(conn, stmt)
+            status = 'FULL SCAN' if full_scans else 'ok'
+            print(f"[{status}] {name}")
+            if show or full_scans:
+                print(f"    {sql}")
+                lines = plan if dialect == 'sqlite' else json.dumps(plan, indent=2).splitlines()
+                for line in lines:
+                    print(f"      {line}")
+            if full_scans:
+                regressions.append((name, full_scans))
+    return regressions
+
+if __name__ == '__main__':
+    from app import create_app
+
+    app = create_app(web=False)
+    with app.app_context():
+        regressions = check_query_plans(show='--show' in sys.argv)
+    if regressions:
+        print(f"{len(regressions)} queries regressed to a full scan")
+        sys.exit(1)
+    print("All known queries use an index")
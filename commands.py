@@ -0,0 +1,162 @@
+import click
+import logging
+
+logger = logging.getLogger(__name__)
+
+def register_commands(app):
+    """Register maintenance commands with the Flask CLI"""
+
+    @app.cli.command('bootstrap')
+    def bootstrap_command():
+        """Create tables, apply schema upgrades and seed roles and the admin user."""
+        from app import bootstrap_database
+        from schema import SCHEMA_VERSION
+
+        bootstrap_database()
+        click.echo(f"Database bootstrapped at schema version {SCHEMA_VERSION}")
+
+    @app.cli.command('upgrade-schema')
+    def upgrade_schema_command():
+        """Apply pending schema upgrades to the configured database."""
+        from app import db
+        from schema import upgrade
+
+        version = upgrade(db.engine)
+        click.echo(f"Database schema is at version {version}")
+
+    @app.cli.command('reconcile-points')
+    @click.option('--user-id', 'user_ids', type=int, multiple=True,
+                  help='Only rebuild these users (repeatable). Defaults to all users.')
+    def reconcile_points_command(user_ids):
+        """Rebuild User.points_total from practice records."""
+        from counters import reconcile_points
+
+        updated = reconcile_points(user_ids or None)
+        click.echo(f"Reconciled points for {updated} users")
+
+    @app.cli.command('recount-article-views')
+    @click.option('--article-id', 'article_ids', type=int, multiple=True,
+                  help='Only recount these articles (repeatable). Defaults to all articles.')
+    def recount_article_views_command(article_ids):
+        """Exactly recount article views and rebuild unique-viewer sketches."""
+        from counters import recount_article_views
+
+        updated = recount_article_views(article_ids or None)
+        click.echo(f"Recounted views for {updated} articles")
+
+    @app.cli.command('backfill-badges')
+    @click.option('--batch-size', default=500, show_default=True, help='Users evaluated per transaction.')
+    @click.option('--no-rebuild', is_flag=True, help='Evaluate existing counters without recomputing them.')
+    def backfill_badges_command(batch_size, no_rebuild):
+        """Re-evaluate badge rules for every user, e.g. after a rule change."""
+        from badges import backfill
+
+        awarded = backfill(batch_size=batch_size, rebuild=not no_rebuild)
+        click.echo(f"Awarded {awarded} badges")
+
+    def _build_bundles():
+        from flask import current_app
+        from bundles import build_bundles
+
+        summary = build_bundles(current_app.static_folder, current_app.config.get('ASSET_BUNDLES', {}))
+        click.echo(f"{summary['bundles']} bundles: {summary['written']} written, {summary['unchanged']} unchanged, "
+                   f"{summary['bytes_in']} source bytes -> {summary['bytes_out']}")
+        for name, missing in summary['missing'].items():
+            click.echo(f"Skipped {name}: missing {', '.join(missing)}", err=True)
+
+    @app.cli.command('build-bundles')
+    def build_bundles_command():
+        """Concatenate and minify the CSS/JS bundles in ASSET_BUNDLES."""
+        _build_bundles()
+
+    @app.cli.command('build-assets')
+    @click.option('--prune', is_flag=True, help='Delete hashed copies left by earlier builds.')
+    def build_assets_command(prune):
+        """Build bundles, then write content-hashed copies of static assets and the asset manifest."""
+        from flask import current_app
+        from asset_utils import build_manifest
+
+        _build_bundles()
+        manifest_path = current_app.config['ASSET_MANIFEST']
+        summary = build_manifest(current_app.static_folder, manifest_path,
+                                 exclude=current_app.config.get('ASSET_MANIFEST_EXCLUDE', ('uploads',)),
+                                 prune=prune)
+        click.echo(f"{summary['files']} assets: {summary['written']} hashed copies written, "
+                   f"{summary['unchanged']} unchanged, {summary['pruned']} pruned")
+        click.echo(f"Manifest written to {manifest_path}; run 'flask compress-static' next "
+                   f"and restart workers to pick it up")
+
+    @app.cli.command('compress-static')
+    @click.option('--min-size', default=1024, show_default=True, help='Skip files smaller than this (bytes).')
+    @click.option('--force', is_flag=True, help='Recompress files whose siblings are up to date.')
+    def compress_static_command(min_size, force):
+        """Write .gz/.br siblings of static files for precompressed serving."""
+        from flask import current_app
+        from compression import BROTLI_AVAILABLE, precompress_static
+
+        summary = precompress_static(current_app.static_folder, min_size=min_size, force=force,
+                                     exclude=current_app.config.get('ASSET_MANIFEST_EXCLUDE', ('uploads',)))
+        click.echo(f"{summary['files']} files: {summary['written']} siblings written, "
+                   f"{summary['skipped']} up to date, {summary['removed']} stale removed")
+        click.echo(f"gzip saves {summary['saved']['gzip']} of {summary['bytes_in']} bytes")
+        if BROTLI_AVAILABLE:
+            click.echo(f"brotli saves {summary['saved']['br']} of {summary['bytes_in']} bytes")
+        else:
+            click.echo("brotli not installed; only .gz siblings were written")
+
+    @app.cli.command('dedupe-uploads')
+    @click.option('--dry-run', is_flag=True, help='Report duplicates without changing anything.')
+    def dedupe_uploads_command(dry_run):
+        """Keep one copy of each distinct upload and register it in the content store."""
+        from file_store import dedupe_uploads
+
+        summary = dedupe_uploads(dry_run=dry_run)
+        verb = 'would remove' if dry_run else 'removed'
+        click.echo(f"{summary['files']} files, {summary['distinct']} distinct: {verb} {summary['duplicates']} "
+                   f"duplicates ({summary['bytes_freed']} bytes), "
+                   f"{summary['references_rewritten']} references repointed")
+
+    @app.cli.command('index-audio')
+    @click.option('--force', is_flag=True, help='Rebuild indexes that are up to date.')
+    def index_audio_command(force):
+        """Build validators and MP3 frame offsets for files in uploads/audio."""
+        from flask import current_app
+        from audio_stream import index_audio
+
+        built = index_audio(current_app.config['UPLOAD_FOLDER'], force=force)
+        click.echo(f"Indexed {built} audio files")
+
+    @app.cli.command('rebuild-score-rollups')
+    @click.option('--batch-size', default=500, show_default=True, help='Users rebuilt per transaction.')
+    def rebuild_score_rollups_command(batch_size):
+        """Recompute daily and weekly score rollups from practice records."""
+        from rollups import rebuild
+
+        rebuilt = rebuild(batch_size=batch_size)
+        click.echo(f"Rebuilt score rollups for {rebuilt} users")
+
+    @app.cli.command('jobs-worker')
+    @click.option('--processes', type=int, default=None, help='Pool processes running jobs (default JOBS_PROCESSES; 0 runs them in this process).')
+    @click.option('--burst', is_flag=True, help='Exit once no jobs are due.')
+    def jobs_worker_command(processes, burst):
+        """Run background jobs until stopped."""
+        from jobs import work
+
+        ran = work(processes=processes, burst=burst)
+        click.echo(f"{ran} jobs succeeded")
+
+    @app.cli.command('jobs-retry')
+    @click.option('--task', 'name', default=None, help='Only jobs of this task.')
+    def jobs_retry_command(name):
+        """Queue failed background jobs again."""
+        from jobs import retry_failed
+
+        click.echo(f"Requeued {retry_failed(name)} failed jobs")
+
+    @app.cli.command('jobs-purge')
+    @click.option('--days', default=7, show_default=True, help='Keep jobs that finished more recently.')
+    def jobs_purge_command(days):
+        """Delete finished background jobs."""
+        from jobs import purge
+
+        click.echo(f"Deleted {purge(days)} finished jobs")
@@ -0,0 +1,153 @@
+"""
+Negotiated response compression.
+
+Dynamic responses of a compressible type and at least ``COMPRESS_MIN_SIZE``
+bytes are compressed with brotli or gzip, whichever the client prefers (brotli
+only when the ``brotli`` package is installed). Static files are never
+compressed per request: ``flask compress-static`` writes ``.br`` / ``.gz``
+siblings at build time, and the static view serves the best sibling the
+client accepts.
+"""
+import os
+import gzip
+import logging
+import mimetypes
+from flask import current_app, request, send_from_directory
+
+logger = logging.getLogger(__name__)
+
+# Brotli is optional; without it only gzip is offered
+BROTLI_AVAILABLE = False
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    logger.info("brotli not available, responses will be gzip-compressed only")
+
+COMPRESSIBLE_TYPES = (
+    'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+    'application/javascript', 'application/json', 'application/xml', 'image/svg+xml',
+)
+STATIC_EXTENSIONS = ('.css', '.js', '.mjs', '.map', '.json', '.svg', '.html', '.txt', '.xml', '.ico')
+
+# Encodings in server preference order, with their sibling suffixes
+_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+def _available(encoding):
+    return encoding == 'gzip' or (encoding == 'br' and BROTLI_AVAILABLE)
+
+def negotiate(accept_encodings, offered=('br', 'gzip')):
+    """The encoding to use for a request's Accept-Encoding, or None for identity"""
+    best, best_quality = None, 0
+    for encoding in offered:
+        if not _available(encoding):
+            continue
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def compress(data, encoding, level=None):
+    if encoding == 'br':
+        return brotli.compress(data, quality=4 if level is None else level)
+    return gzip.compress(data, compresslevel=6 if level is None else level, mtime=0)
+
+def compress_response(response):
+    """Compress a dynamic response in place when the client and thresholds allow it"""
+    config = current_app.config
+    if (not config.get('COMPRESS_ENABLED', True)
+            or response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code in (204, 206, 304)
+            or 'Content-Encoding' in response.headers
+            or 'no-transform' in response.headers.get('Cache-Control', '')
+            or response.mimetype not in config.get('COMPRESS_MIMETYPES', COMPRESSIBLE_TYPES)):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < config.get('COMPRESS_MIN_SIZE', 1024):
+        return response
+    encoding = negotiate(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    level = config.get('COMPRESS_BR_LEVEL') if encoding == 'br' else config.get('COMPRESS_GZIP_LEVEL')
+    response.set_data(compress(data, encoding, level))
+    response.headers['Content-Encoding'] = encoding
+    # A strong validator names one representation; keep it distinct per encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f"{etag}-{encoding}")
+    return response
+
+def _precompressed_sibling(static_folder, filename):
+    """(encoding, sibling filename) for the best precompressed file the client accepts"""
+    accepted = request.accept_encodings
+    for encoding, suffix in _ENCODINGS:
+        if accepted[encoding] and os.path.isfile(os.path.join(static_folder, filename + suffix)):
+            return encoding, filename + suffix
+    return None, None
+
+def static_view(filename):
+    """Flask's static view, serving .br/.gz siblings written by `flask compress-static`"""
+    app = current_app
+    max_age = app.get_send_file_max_age(filename)
+    encoding, sibling = None, None
+    if app.config.get('COMPRESS_STATIC_SIBLINGS', True):
+        encoding, sibling = _precompressed_sibling(app.static_folder, filename)
+    if sibling is None:
+        return send_from_directory(app.static_folder, filename, max_age=max_age)
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_from_directory(app.static_folder, sibling, max_age=max_age, mimetype=mimetype)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def precompress_static(static_folder, min_size=1024, extensions=STATIC_EXTENSIONS, force=False, exclude=('uploads',)):
+    """Write .gz (and .br) siblings for compressible static files; returns a summary
+
+    A sibling is only kept when it is meaningfully smaller than its source, and
+    siblings whose source is gone are removed. Subdirectories listed in
+    exclude (static-relative, like the asset manifest's) are skipped.
+    """
+    summary = {'files': 0, 'written': 0, 'skipped': 0, 'removed': 0, 'bytes_in': 0, 'saved': {'gzip': 0, 'br': 0}}
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [d for d in dirs
+                   if os.path.relpath(os.path.join(root, d), static_folder).replace(os.sep, '/') not in exclude]
+        for name in files:
+            path = os.path.join(root, name)
+            for _, suffix in _ENCODINGS:
+                if name.endswith(suffix) and not os.path.exists(path[:-len(suffix)]):
+                    os.remove(path)
+                    summary['removed'] += 1
+            if not name.endswith(extensions) or os.path.getsize(path) < min_size:
+                continue
+
+            summary['files'] += 1
+            with open(path, 'rb') as f:
+                data = f.read()
+            summary['bytes_in'] += len(data)
+            for encoding, suffix in _ENCODINGS:
+                if not _available(encoding):
+                    continue
+                target = path + suffix
+                if not force and os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    summary['skipped'] += 1
+                    continue
+                compressed = compress(data, encoding, 11 if encoding == 'br' else 9)
+                if len(compressed) > len(data) * 0.9:
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+                with open(target, 'wb') as f:
+                    f.write(compressed)
+                summary['written'] += 1
+                summary['saved'][encoding] += len(data) - len(compressed)
+    return summary
+
+def init_compression(app):
+    """Compress dynamic responses and serve precompressed static siblings"""
+    if app.has_static_folder and 'static' in app.view_functions:
+        app.view_functions['static'] = static_view
+    app.after_request(compress_response)
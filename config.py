@@ -22,6 +22,26 @@ class Config:
     # Upload configuration
     MAX_CONTENT_LENGTH = 50 * 1024 * 1024  # 50MB file size limit
     UPLOAD_FOLDER = os.path.join(basedir, 'static/uploads')
+    UPLOAD_STREAMING = True  # sniff the first chunk and stream uploads to disk (see FileUploader.save_stream)
+    UPLOAD_SNIFF_SIZE = 8192  # bytes read for MIME detection before anything is written
+    UPLOAD_CHUNK_SIZE = 64 * 1024
+    UPLOAD_DEDUPLICATE = True  # keep one copy per distinct upload (see file_store.py)
+    AUDIO_MAX_AGE = 86400  # Cache-Control for /audio/ files whose names are not content hashes
+    AUDIO_INDEX_INTERVAL = 1.0  # seconds between byte offsets in the MP3 frame index
+    # Who sends /uploads/ and /audio/ bodies: 'direct' (Python), 'x-accel' (nginx) or 'x-sendfile' (Apache)
+    UPLOAD_DELIVERY = os.environ.get('UPLOAD_DELIVERY', 'direct')
+    UPLOAD_ACCEL_PREFIX = os.environ.get('UPLOAD_ACCEL_PREFIX', '/_protected_uploads/')  # nginx internal location
+    UPLOAD_REQUIRE_AUTH = os.environ.get('UPLOAD_REQUIRE_AUTH', 'True').lower() in ('true', 'yes', 't', 'y', '1')
+    UPLOAD_URL_SECRET = os.environ.get('UPLOAD_URL_SECRET')  # signs expiring upload URLs; shared by all workers
+    UPLOAD_URL_TTL = 3600  # signed URLs stay valid for one to two of these periods
+    UPLOAD_MAX_AGE = 86400
+    # Background jobs (see jobs.py); run them with `flask jobs-worker`
+    JOBS_PROCESSES = int(os.environ.get('JOBS_PROCESSES', 2))  # pool size of each worker; 0 runs jobs in the worker itself
+    JOBS_POLL_INTERVAL = 1.0  # seconds between queue checks when idle
+    JOBS_LEASE_SECONDS = 300  # a running job not renewed for this long is picked up again
+    JOBS_MAX_ATTEMPTS = 5
+    JOBS_RETRY_BASE = 10  # seconds before the first retry, doubled for each further one
+    JOBS_RETRY_MAX = 3600
     ALLOWED_EXTENSIONS = {
         'image': ['png', 'jpg', 'jpeg', 'gif', 'svg', 'webp'],
         'audio': ['mp3', 'wav', 'ogg', 'm4a'],
@@ -31,7 +51,83 @@ class Config:
     # Cache configuration
     CACHE_TYPE = 'SimpleCache'
     CACHE_DEFAULT_TIMEOUT = 3600  # 1 hour
+    CACHE_KEY_PREFIX = os.environ.get('CACHE_KEY_PREFIX', 'ieltsprep:')  # namespace shared Redis instances
+    CACHE_THRESHOLD = 500  # max entries for SimpleCache
+    # SimpleCache is per worker: a write only invalidates the worker that made it, so
+    # with several workers (and no REDIS_URL in production) other workers can serve
+    # stale user stats and score series until their entries expire. Entries are capped
+    # at this many seconds there; use RedisCache for the full CACHE_DEFAULT_TIMEOUT.
+    CACHE_LOCAL_TIMEOUT = int(os.environ.get('CACHE_LOCAL_TIMEOUT', 60))
     STATIC_CACHE_TIMEOUT = 2592000  # 30 days for static assets
+    STATIC_IMMUTABLE_MAX_AGE = 31536000  # one year for content-hashed assets from the manifest
+    
+    # HTTP caching of dynamic pages (see http_cache.py). Pages revalidate on every use
+    # unless a route policy says otherwise; keys are endpoints or blueprint names.
+    DEFAULT_CACHE_CONTROL = 'private, no-cache'
+    CACHE_CONTROL_POLICIES = {
+        'auth': 'no-store',
+        'request_metrics': 'no-store',
+        'nplusone_report': 'no-store',
+    }
+    ETAG_SEED = os.environ.get('ASSET_VERSION', '1.0')  # change on deploy to drop all validators
+    ETAG_BODY_HASH_MAX = 1024 * 1024  # larger bodies are not hashed for ETags
+    
+    # Response compression (see compression.py)
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_ENABLED', 'True').lower() in ('true', 'yes', 't', 'y', '1')
+    COMPRESS_MIN_SIZE = 1024  # bytes; smaller bodies are sent as they are
+    COMPRESS_MIMETYPES = (
+        'text/html', 'text/css', 'text/plain', 'text/xml', 'text/javascript',
+        'application/javascript', 'application/json', 'application/xml', 'image/svg+xml',
+    )
+    COMPRESS_GZIP_LEVEL = 6
+    COMPRESS_BR_LEVEL = 4
+    COMPRESS_STATIC_SIBLINGS = True  # serve .br/.gz files written by 'flask compress-static'
+    
+    # Run 'flask bootstrap' automatically when a worker finds an outdated schema.
+    # Disable in deployments that bootstrap once before starting workers.
+    AUTO_BOOTSTRAP = os.environ.get('AUTO_BOOTSTRAP', 'True').lower() in ('true', 'yes', 't', 'y', '1')
+    
+    # Flask-Migrate is loaded for the flask CLI only; set to load it in other entry points
+    LOAD_MIGRATIONS = os.environ.get('LOAD_MIGRATIONS', 'False').lower() in ('true', 'yes', 't', 'y', '1')
+    
+    # Flask-Login identity cache (see user_loader.py)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 30))  # seconds; 0 disables
+    AUTH_QUERY_HEADER = False  # add X-Auth-Query-Count to responses
+    
+    # Parsed exercise content cache (see content_cache.py)
+    CONTENT_CACHE_MAX_ENTRIES = int(os.environ.get('CONTENT_CACHE_MAX_ENTRIES', 256))
+    # Estimated memory of the parsed documents (several times their JSON length)
+    CONTENT_CACHE_MAX_BYTES = int(os.environ.get('CONTENT_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+    
+    # Buffered article view ingestion (see view_buffer.py)
+    VIEW_BUFFER_ENABLED = True
+    VIEW_BUFFER_FLUSH_INTERVAL = float(os.environ.get('VIEW_BUFFER_FLUSH_INTERVAL', 5.0))  # seconds
+    VIEW_BUFFER_MAX_BATCH = int(os.environ.get('VIEW_BUFFER_MAX_BATCH', 500))
+    VIEW_BUFFER_FSYNC_INTERVAL = float(os.environ.get('VIEW_BUFFER_FSYNC_INTERVAL', 1.0))  # max seconds of views lost on a host crash
+    VIEW_BUFFER_SPOOL_DIR = os.environ.get('VIEW_BUFFER_SPOOL_DIR', os.path.join(basedir, 'instance', 'view_spool'))
+    
+    # Logging (see logging_utils.py). 'queue' hands records to a background
+    # listener so request threads never wait on disk; 'sync' writes inline.
+    LOG_MODE = os.environ.get('LOG_MODE', 'queue')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # 'json' or 'text'
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FILE = os.environ.get('LOG_FILE', 'app.log')  # empty to log to stderr only
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))  # records beyond this are dropped
+    # Fraction of records below WARNING to keep, per logger (and its children)
+    LOG_SAMPLE_RATES = {
+        'error_handlers.not_found': 0.1,
+    }
+    
+    # Request metrics at /admin/metrics (see request_metrics.py). Admins can view them
+    # in the browser; scrapers send "Authorization: Bearer <METRICS_TOKEN>".
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() in ('true', 'yes', 't', 'y', '1')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # N+1 query detection (see nplusone.py); costs a stack walk per SQL statement,
+    # so enable it in development and staging only
+    NPLUSONE_ENABLED = os.environ.get('NPLUSONE_ENABLED', 'False').lower() in ('true', 'yes', 't', 'y', '1')
+    NPLUSONE_THRESHOLD = int(os.environ.get('NPLUSONE_THRESHOLD', 5))  # identical SELECTs per request
+    NPLUSONE_REPORT_SIZE = 100  # recent offending requests kept for /admin/nplusone
     
     # Debug configuration
     DEBUG = False
@@ -43,9 +139,20 @@ class Config:
     REMEMBER_COOKIE_SECURE = os.environ.get('REMEMBER_COOKIE_SECURE', 'False').lower() in ('true', 'yes', 't', 'y', '1')
     REMEMBER_COOKIE_HTTPONLY = True
     
-    # Asset Management
+    # Asset Management ('flask build-assets' writes the manifest of content-hashed names)
+    ASSET_MANIFEST = os.environ.get('ASSET_MANIFEST', os.path.join(basedir, 'static/manifest.json'))
+    ASSET_MANIFEST_EXCLUDE = ('uploads',)  # static subdirectories left out of the manifest
     ASSET_VERSIONING = True
-    ASSET_VERSION = os.environ.get('ASSET_VERSION', '1.0')
+    ASSET_VERSION = os.environ.get('ASSET_VERSION')  # ?v= for files missing from the manifest; unset hashes each file
+    # CSS/JS bundles built by 'flask build-bundles' (see bundles.py); names are static/bundles/<name>
+    ASSET_BUNDLES = {
+        'base.css': ['css/style.css'],
+        'base.js': ['js/darkMode.js'],
+        'dashboard.js': ['js/charts.js'],
+        'practice.js': ['js/timer.js', 'js/audioRecorder.js'],
+    }
+    ASSET_BUNDLES_DEBUG = False  # link the source files instead of the built bundles
+    ASSET_PRELOAD = ('base.css',)  # bundles announced in Link: rel=preload headers on HTML pages
 
 class DevelopmentConfig(Config):
     DEBUG = True
@@ -55,6 +162,10 @@ class DevelopmentConfig(Config):
         'pool_pre_ping': True,
     }
     CACHE_TYPE = 'NullCache'  # Disable caching in development
+    AUTH_QUERY_HEADER = True
+    NPLUSONE_ENABLED = os.environ.get('NPLUSONE_ENABLED', 'True').lower() in ('true', 'yes', 't', 'y', '1')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    ASSET_BUNDLES_DEBUG = True
 
 class TestingConfig(Config):
     TESTING = True
@@ -63,6 +174,9 @@ class TestingConfig(Config):
     SERVER_NAME = 'localhost:5000'
     WTF_CSRF_ENABLED = False
     CACHE_TYPE = 'NullCache'  # Disable caching in tests
+    VIEW_BUFFER_ENABLED = False  # Write article views inline so tests see them immediately
+    LOG_MODE = 'sync'  # Let tests capture log records as they are emitted
+    LOG_FILE = None
 
 class ProductionConfig(Config):
     # Production specific settings
@@ -77,24 +191,17 @@ class ProductionConfig(Config):
         
     # Enable file logging
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT', 'False').lower() in ('true', 'yes', 't', 'y', '1')
+    if LOG_TO_STDOUT:
+        LOG_FILE = None
     
     # CDN configuration if available
     CDN_DOMAIN = os.environ.get('CDN_DOMAIN')
     
     @classmethod
     def init_app(cls, app):
-        # Set up production-specific handlers
+        # Log handlers (including the rotating app.log) are installed by
+        # logging_utils.init_logging; adding another here would duplicate lines
         import logging
-        from logging.handlers import RotatingFileHandler
-        
-        # Configure production logging
-        if not cls.LOG_TO_STDOUT:
-            file_handler = RotatingFileHandler('app.log', maxBytes=10*1024*1024, backupCount=10)
-            file_handler.setFormatter(logging.Formatter(
-                '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-            ))
-            file_handler.setLevel(logging.INFO)
-            app.logger.addHandler(file_handler)
         
         app.logger.setLevel(logging.INFO)
         app.logger.info('StudentExamPrep startup')
@@ -0,0 +1,156 @@
+"""
+Per-process LRU of parsed exercise content.
+
+``Exercise.content`` holds whole reading passages and question sets as JSON, so
+parsing it on every request is expensive. Parsed documents are cached under
+(exercise id, content digest): an edited exercise gets a new digest and can
+never be served stale, and edits also drop the old entry straight away.
+
+Cached documents are shared between requests - treat them as read-only. Only
+exercise content is cached; other JSON (answers, form data) is parsed fresh,
+so callers may modify it. ``CONTENT_CACHE_MAX_BYTES`` bounds the estimated
+in-memory size of the parsed documents, not the length of their source.
+"""
+import sys
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Strings shorter than this are cheaper to parse than to hash and look up
+MIN_CACHED_LENGTH = 2048
+
+def parsed_size(obj):
+    """Approximate memory used by a parsed JSON document, in bytes"""
+    size = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+    return size
+
+class ParsedContentCache:
+    """Thread-safe LRU bounded by entry count and by the estimated size of parsed documents"""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (parsed, size)
+        self._keys_by_exercise = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def configure(self, max_entries, max_bytes):
+        with self._lock:
+            self.max_entries = max_entries
+            self.max_bytes = max_bytes
+            self._evict()
+
+    @staticmethod
+    def digest(text):
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def get_or_parse(self, text, exercise_id=None):
+        """Return the parsed JSON for text, parsing at most once per revision"""
+        key = (exercise_id, self.digest(text))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        parsed = json.loads(text)
+        size = parsed_size(parsed)
+        if size > self.max_bytes:
+            return parsed
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = (parsed, size)
+                self.bytes += size
+                if exercise_id is not None:
+                    self._keys_by_exercise.setdefault(exercise_id, set()).add(key)
+                self._evict()
+        return parsed
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self.bytes > self.max_bytes):
+            key, (_, size) = self._entries.popitem(last=False)
+            self._forget(key, size)
+            self.evictions += 1
+
+    def _forget(self, key, size):
+        self.bytes -= size
+        exercise_id = key[0]
+        if exercise_id is not None:
+            keys = self._keys_by_exercise.get(exercise_id)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_exercise[exercise_id]
+
+    def invalidate(self, exercise_id):
+        """Drop every cached revision of one exercise"""
+        with self._lock:
+            for key in list(self._keys_by_exercise.get(exercise_id, ())):
+                _, size = self._entries.pop(key)
+                self._forget(key, size)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_exercise.clear()
+            self.bytes = 0
+
+    def metrics(self):
+        """Snapshot of cache counters for monitoring"""
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+content_cache = ParsedContentCache()
+
+def parse_content(text, exercise_id=None):
+    """Parse a JSON document; exercise content large enough to matter goes through the cache
+
+    Without an exercise_id the result is always a fresh object.
+    """
+    if not isinstance(text, str):
+        return text
+    if exercise_id is None or len(text) < MIN_CACHED_LENGTH:
+        return json.loads(text)
+    return content_cache.get_or_parse(text, exercise_id)
+
+def _invalidate_exercise(mapper, connection, target):
+    content_cache.invalidate(target.id)
+
+def init_content_cache(app):
+    """Apply cache limits from config and invalidate on exercise edits"""
+    from sqlalchemy import event
+    from models import Exercise
+
+    content_cache.configure(
+        app.config.get('CONTENT_CACHE_MAX_ENTRIES', 256),
+        app.config.get('CONTENT_CACHE_MAX_BYTES', 64 * 1024 * 1024),
+    )
+    for name in ('after_update', 'after_delete'):
+        if not event.contains(Exercise, name, _invalidate_exercise):
+            event.listen(Exercise, name, _invalidate_exercise)
@@ -0,0 +1,229 @@
+"""
+Denormalized counters kept in step with the rows they summarise.
+
+The totals are written with atomic ``UPDATE ... SET x = x + delta`` statements
+from SQLAlchemy flush events, so they commit (or roll back) in the same
+transaction as the rows that changed them.
+"""
+import logging
+from collections import defaultdict
+from sqlalchemy import event, func, inspect, select, update
+from sketches import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+_PENDING_POINTS_KEY = 'counters.pending_points'
+_TOUCHED_KEY = 'counters.touched'
+
+_MYSQL_DIALECTS = ('mysql', 'mariadb')
+
+def dialect_insert(connection, table):
+    """INSERT construct of the connection's dialect, with its conflict-handling clauses"""
+    name = connection.dialect.name
+    if name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif name in _MYSQL_DIALECTS:
+        from sqlalchemy.dialects.mysql import insert
+    else:
+        raise ValueError(f"Unsupported database dialect for upserts: {name} (use PostgreSQL, SQLite or MySQL)")
+    return insert(table)
+
+def upsert(connection, table, index_elements, set_):
+    """INSERT that updates the existing row when it conflicts on index_elements
+
+    ``set_`` maps column names to new values, or is a callable taking the
+    proposed row's columns (``excluded`` / MySQL ``VALUES()``) and returning
+    that mapping. MySQL resolves a conflict on any unique key, so
+    index_elements must be the only one an insert can clash on.
+    """
+    stmt = dialect_insert(connection, table)
+    if connection.dialect.name in _MYSQL_DIALECTS:
+        return stmt.on_duplicate_key_update(set_(stmt.inserted) if callable(set_) else set_)
+    values = set_(stmt.excluded) if callable(set_) else set_
+    return stmt.on_conflict_do_update(index_elements=index_elements, set_=values)
+
+def insert_ignore(connection, table, index_elements):
+    """INSERT that skips rows conflicting on index_elements; rowcount counts new rows only
+
+    On MySQL this is ``INSERT IGNORE``, which also downgrades other errors on
+    the row (such as a bad foreign key) to warnings.
+    """
+    stmt = dialect_insert(connection, table)
+    if connection.dialect.name in _MYSQL_DIALECTS:
+        return stmt.prefix_with('IGNORE')
+    return stmt.on_conflict_do_nothing(index_elements=index_elements)
+
+def previous_value(obj, attr):
+    """Value an attribute had before the pending flush (needs active_history)"""
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.added:
+        return None
+    return getattr(obj, attr)
+
+def _collect_deleted_points(session, flush_context, instances):
+    """Capture points of deleted records before their rows disappear"""
+    from models import PracticeRecord
+
+    pending = session.info.setdefault(_PENDING_POINTS_KEY, defaultdict(int))
+    for obj in session.deleted:
+        if isinstance(obj, PracticeRecord) and obj.user_id and obj.points_earned:
+            pending[obj.user_id] -= obj.points_earned
+
+def _apply_points_deltas(session, flush_context):
+    """Apply point deltas for inserted, re-scored and deleted practice records"""
+    from models import PracticeRecord, User
+
+    deltas = session.info.pop(_PENDING_POINTS_KEY, None) or defaultdict(int)
+
+    for obj in session.new:
+        if isinstance(obj, PracticeRecord) and obj.points_earned:
+            deltas[obj.user_id] += obj.points_earned
+
+    for obj in session.dirty:
+        if not isinstance(obj, PracticeRecord):
+            continue
+        history = inspect(obj).attrs.points_earned.history
+        if history.has_changes():
+            added = sum(value or 0 for value in history.added)
+            removed = sum(value or 0 for value in history.deleted)
+            deltas[obj.user_id] += added - removed
+
+    connection = session.connection()
+    for user_id, delta in deltas.items():
+        if not user_id or not delta:
+            continue
+        connection.execute(
+            update(User.__table__)
+            .where(User.__table__.c.id == user_id)
+            .values(points_total=User.__table__.c.points_total + delta)
+        )
+        _mark_touched(session, User, user_id, 'points_total')
+
+def _apply_article_view_counts(session, flush_context):
+    """Bump view totals and fold new viewers into each article's sketch"""
+    from models import Article, ArticleView
+
+    viewers = defaultdict(list)
+    for obj in session.new:
+        if isinstance(obj, ArticleView) and obj.article_id:
+            viewers[obj.article_id].append(obj.user_id)
+    if viewers:
+        record_article_views(session.connection(), viewers)
+        for article_id in viewers:
+            _mark_touched(session, Article, article_id, 'view_total', 'unique_viewers', 'viewer_sketch')
+
+def record_article_views(connection, viewers):
+    """Apply {article_id: [viewer user ids]} to the article counters
+
+    Totals are bumped atomically; each sketch is read with a row lock (where
+    the database supports one), merged and written back with its estimate.
+    """
+    from models import Article
+
+    articles = Article.__table__
+    for article_id, user_ids in viewers.items():
+        sketch_data = connection.execute(
+            select(articles.c.viewer_sketch).where(articles.c.id == article_id).with_for_update()
+        ).scalar()
+        sketch = HyperLogLog(sketch_data)
+        values = {'view_total': articles.c.view_total + len(user_ids)}
+        if sketch.update(user_id for user_id in user_ids if user_id):
+            values['viewer_sketch'] = sketch.to_bytes()
+            values['unique_viewers'] = sketch.estimate()
+        connection.execute(update(articles).where(articles.c.id == article_id).values(**values))
+
+def _mark_touched(session, model, pk, *attrs):
+    session.info.setdefault(_TOUCHED_KEY, set()).add((model, pk, attrs))
+
+def _expire_touched(session, flush_context):
+    """Make loaded objects re-read counters updated behind the ORM's back"""
+    for model, pk, attrs in session.info.pop(_TOUCHED_KEY, ()):
+        obj = session.identity_map.get(session.identity_key(model, pk))
+        if obj is not None:
+            session.expire(obj, list(attrs))
+
+def register_counter_listeners(session):
+    """Attach the counter maintenance hooks to a (scoped) session, once"""
+    hooks = (
+        ('before_flush', _collect_deleted_points),
+        ('after_flush', _apply_points_deltas),
+        ('after_flush', _apply_article_view_counts),
+        ('after_flush_postexec', _expire_touched),
+    )
+    for name, fn in hooks:
+        if not event.contains(session, name, fn):
+            event.listen(session, name, fn)
+
+def points_reconcile_statement(user_ids=None):
+    """Build the UPDATE that recomputes points_total from practice records"""
+    from models import PracticeRecord, User
+
+    users = User.__table__
+    records = PracticeRecord.__table__
+    total = (
+        select(func.coalesce(func.sum(records.c.points_earned), 0))
+        .where(records.c.user_id == users.c.id)
+        .scalar_subquery()
+    )
+    stmt = update(users).values(points_total=total)
+    if user_ids:
+        stmt = stmt.where(users.c.id.in_(list(user_ids)))
+    return stmt
+
+def reconcile_points(user_ids=None):
+    """Rebuild points totals from PracticeRecord rows and return the rows updated"""
+    from app import db
+
+    result = db.session.execute(points_reconcile_statement(user_ids))
+    db.session.commit()
+    logger.info(f"Reconciled points totals for {result.rowcount} users")
+    return result.rowcount
+
+def recount_article_views(article_ids=None, batch_size=5000):
+    """Exactly recount views and rebuild viewer sketches; return articles updated"""
+    from app import db
+    from models import Article, ArticleView
+
+    articles = Article.__table__
+    views = ArticleView.__table__
+    connection = db.session.connection()
+
+    totals_query = select(
+        views.c.article_id,
+        func.count(),
+        func.count(func.distinct(views.c.user_id)),
+    ).group_by(views.c.article_id)
+    if article_ids:
+        totals_query = totals_query.where(views.c.article_id.in_(list(article_ids)))
+    totals = {article_id: (total, unique) for article_id, total, unique in connection.execute(totals_query)}
+
+    # Rebuild sketches from the distinct (article, viewer) pairs, streamed in batches
+    sketches = defaultdict(HyperLogLog)
+    pairs_query = select(views.c.article_id, views.c.user_id).distinct()
+    if article_ids:
+        pairs_query = pairs_query.where(views.c.article_id.in_(list(article_ids)))
+    result = connection.execute(pairs_query.execution_options(yield_per=batch_size))
+    for article_id, user_id in result:
+        sketches[article_id].add(user_id)
+
+    target_query = select(articles.c.id)
+    if article_ids:
+        target_query = target_query.where(articles.c.id.in_(list(article_ids)))
+    updated = 0
+    for (article_id,) in connection.execute(target_query).all():
+        total, unique = totals.get(article_id, (0, 0))
+        sketch = sketches.get(article_id)
+        connection.execute(update(articles).where(articles.c.id == article_id).values(
+            view_total=total,
+            unique_viewers=unique,
+            viewer_sketch=sketch.to_bytes() if sketch else None,
+        ))
+        updated += 1
+
+    db.session.commit()
+    logger.info(f"Recounted views for {updated} articles")
+    return updated
@@ -1,8 +1,10 @@
 import json
-from app import app, db
+from app import create_app, db
 from models import Section, Difficulty, Exercise
 from datetime import datetime
 
+app = create_app(web=False)
+
 def create_complete_mock_test():
     """Create a complete IELTS Reading mock test with three passages"""
     with app.app_context():
@@ -1,9 +1,11 @@
 import json
 import os
 import shutil
-from app import app, db
+from app import create_app, db
 from models import Exercise, Section, Difficulty
 
+app = create_app(web=False)
+
 def create_mock_listening_test():
     """Create a mock IELTS listening test using data from JSON"""
     with app.app_context():
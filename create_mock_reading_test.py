@@ -1,8 +1,10 @@
 import json
-from app import app, db
+from app import create_app, db
 from models import Exercise, Section, Difficulty
 from datetime import datetime
 
+app = create_app(web=False)
+
 def create_mock_reading_test():
     """Create a complete IELTS reading mock test with 3 passages"""
     with app.app_context():
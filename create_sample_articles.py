@@ -432,7 +432,7 @@ Remember: The IELTS rewards lexical resource that is accurate, appropriate, and
 def create_articles():
     """Create sample articles for the platform"""
     print("Creating sample articles...")
-    app = create_app()
+    app = create_app(web=False)
     
     with app.app_context():
         # Get admin user
@@ -6,6 +6,8 @@ from sqlalchemy.exc import SQLAlchemyError, DatabaseError
 from werkzeug.http import HTTP_STATUS_CODES
 
 logger = logging.getLogger(__name__)
+# 404s are logged separately so they can be sampled (see LOG_SAMPLE_RATES)
+not_found_logger = logging.getLogger(f"{__name__}.not_found")
 
 class ErrorResponse:
     """Standardized error response structure"""
@@ -57,7 +59,7 @@ def register_error_handlers(app):
 
     @app.errorhandler(404)
     def not_found_error(error):
-        logger.info(f"404 Not Found: {request.path}")
+        not_found_logger.info(f"404 Not Found: {request.path}")
         if request.is_json:
             return jsonify(ErrorResponse.make_error(404)), 404
         return render_template('errors/404.html', error=error), 404
@@ -0,0 +1,288 @@
+"""
+Content-addressed upload storage.
+
+Each distinct upload is kept once, as ``<directory>/<sha256>.<ext>`` under
+``UPLOAD_FOLDER``, with a ``StoredFile`` row keyed by its SHA-256. Uploading
+the same listening MP3 or article image again returns the path of the copy
+already stored instead of writing another one.
+
+``StoredFile.ref_count`` counts the rows that point at a file through
+``Exercise.audio_file`` or ``Article.image_url``. It is kept in step from
+flush events, in the same transaction as the rows (like counters.py), and
+can be rebuilt with ``reconcile_refcounts``. ``FileUploader.delete_file``
+refuses to remove a file that is still referenced.
+
+``flask dedupe-uploads`` brings an existing upload tree into the store: it
+hashes every file, points references at one copy per content, deletes the
+other copies and registers the survivors.
+"""
+import os
+import hashlib
+import logging
+import mimetypes
+import posixpath
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+from flask import current_app
+from sqlalchemy import delete, event, inspect, select, update
+from counters import insert_ignore, upsert
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_URL_PATH = '/static/uploads/'
+
+_PENDING_REFS_KEY = 'file_store.pending_refs'
+
+def reference_columns():
+    """(model, attribute, directory) for every column that points at uploads
+
+    The directory resolves bare filenames: exercises store just the name of a
+    file in ``audio/``.
+    """
+    from models import Article, Exercise
+
+    return ((Exercise, 'audio_file', 'audio'), (Article, 'image_url', 'images'))
+
+def upload_path(value, directory):
+    """Path relative to UPLOAD_FOLDER that a column value refers to, or None"""
+    if not value:
+        return None
+    parts = urlsplit(value)
+    if UPLOAD_URL_PATH in parts.path:
+        return parts.path.split(UPLOAD_URL_PATH, 1)[1]
+    if parts.scheme or parts.netloc or parts.path.startswith('/'):
+        return None  # external image or a page outside the upload folder
+    if parts.path.startswith(UPLOAD_URL_PATH[1:]):
+        return parts.path[len(UPLOAD_URL_PATH) - 1:]
+    if '/' not in parts.path:
+        return f"{directory}/{parts.path}"
+    return parts.path
+
+def _rewrite_reference(value, old_path, new_path, directory):
+    """value pointing at new_path instead of old_path, in the same style"""
+    if UPLOAD_URL_PATH + old_path in value:
+        return value.replace(UPLOAD_URL_PATH + old_path, UPLOAD_URL_PATH + new_path)
+    if posixpath.dirname(new_path) == directory and '/' not in value:
+        return posixpath.basename(new_path)
+    return new_path
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# -- storing uploads -----------------------------------------------------------
+
+def store(file, directory, file_type=None, check_content=True):
+    """
+    Save an upload once per distinct content
+
+    Returns:
+        Tuple of (success, path relative to UPLOAD_FOLDER or error message)
+    """
+    from app import db
+    from models import StoredFile
+    from upload_utils import FileUploader
+
+    success, saved = FileUploader.save_stream(file, directory, file_type, check_content)
+    if not success:
+        return (False, saved)
+
+    folder = current_app.config['UPLOAD_FOLDER']
+    existing = db.session.get(StoredFile, saved.sha256)
+    if existing is not None and os.path.exists(os.path.join(folder, existing.path)):
+        os.unlink(os.path.join(folder, saved.path))
+        logger.info(f"Upload {file.filename} is a duplicate of {existing.path}")
+        return (True, existing.path)
+
+    ext = saved.path.rsplit('.', 1)[1].lower()
+    path = posixpath.join(directory, f"{saved.sha256}.{ext}")
+    os.replace(os.path.join(folder, saved.path), os.path.join(folder, path))
+    if existing is not None:
+        # The stored copy went missing; this upload replaces it
+        existing.path = path
+    else:
+        files = StoredFile.__table__
+        connection = db.session.connection()
+        # A concurrent upload of the same content may have registered it first
+        connection.execute(insert_ignore(connection, files, [files.c.sha256]).values(
+            sha256=saved.sha256, path=path, size=saved.size, mime_type=saved.mime_type, ref_count=0,
+        ))
+    if directory == 'audio':
+        # Index new audio in the background instead of on its first playback
+        from jobs import enqueue
+        enqueue('audio.index', {'filename': posixpath.basename(path)}, key=f'audio.index:{saved.sha256}')
+    return (True, path)
+
+# -- reference counting --------------------------------------------------------
+
+def _reference_changes(obj, sign, deltas):
+    for model, attr, directory in reference_columns():
+        if isinstance(obj, model):
+            path = upload_path(getattr(obj, attr), directory)
+            if path:
+                deltas[path] += sign
+
+def _collect_deleted_refs(session, flush_context, instances):
+    """Capture the references of deleted rows before they disappear"""
+    pending = session.info.setdefault(_PENDING_REFS_KEY, Counter())
+    for obj in session.deleted:
+        _reference_changes(obj, -1, pending)
+
+def _apply_ref_deltas(session, flush_context):
+    from models import StoredFile
+
+    deltas = session.info.pop(_PENDING_REFS_KEY, None) or Counter()
+    for obj in session.new:
+        _reference_changes(obj, 1, deltas)
+    for obj in session.dirty:
+        for model, attr, directory in reference_columns():
+            if not isinstance(obj, model):
+                continue
+            # active_history on the column makes the replaced value available here
+            history = inspect(obj).attrs[attr].history
+            for value in history.added:
+                path = upload_path(value, directory)
+                if path:
+                    deltas[path] += 1
+            for value in history.deleted:
+                path = upload_path(value, directory)
+                if path:
+                    deltas[path] -= 1
+
+    files = StoredFile.__table__
+    connection = None
+    # Sorted, so concurrent transactions lock rows in the same order
+    for path, delta in sorted(deltas.items()):
+        if not delta:
+            continue
+        connection = connection or session.connection()
+        connection.execute(update(files).where(files.c.path == path).values(ref_count=files.c.ref_count + delta))
+
+def register_file_store_listeners(session):
+    """Attach the reference counting hooks to a (scoped) session, once"""
+    hooks = (
+        ('before_flush', _collect_deleted_refs),
+        ('after_flush', _apply_ref_deltas),
+    )
+    for name, fn in hooks:
+        if not event.contains(session, name, fn):
+            event.listen(session, name, fn)
+
+def reference_counts(connection):
+    """Counter of upload paths referenced by exercise and article rows"""
+    counts = Counter()
+    for model, attr, directory in reference_columns():
+        column = model.__table__.c[attr]
+        for (value,) in connection.execute(select(column).where(column.isnot(None))):
+            path = upload_path(value, directory)
+            if path:
+                counts[path] += 1
+    return counts
+
+def is_referenced(path):
+    """Whether any row still points at path; checked against the rows, not ref_count
+
+    Pending changes are flushed first, so a row deleted or repointed earlier
+    in the same transaction no longer counts.
+    """
+    from app import db
+
+    db.session.flush()
+    return reference_counts(db.session.connection())[path] > 0
+
+def forget(path):
+    """Drop the store entry of a deleted file (committed with the caller's transaction)"""
+    from app import db
+    from models import StoredFile
+
+    db.session.execute(delete(StoredFile.__table__).where(StoredFile.__table__.c.path == path))
+
+def reconcile_refcounts(connection):
+    """Rebuild every ref_count from the referencing rows; returns the entries changed"""
+    from models import StoredFile
+
+    files = StoredFile.__table__
+    counts = reference_counts(connection)
+    changed = 0
+    for path, ref_count in connection.execute(select(files.c.path, files.c.ref_count)).all():
+        if counts[path] != ref_count:
+            connection.execute(update(files).where(files.c.path == path).values(ref_count=counts[path]))
+            changed += 1
+    return changed
+
+# -- migrating an existing upload tree -------------------------------------------
+
+def _upload_files(folder):
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+        for name in sorted(files):
+            if not name.startswith('.'):
+                path = os.path.join(root, name)
+                yield os.path.relpath(path, folder).replace(os.sep, '/'), path
+
+def dedupe_uploads(dry_run=False):
+    """Keep one copy of each distinct upload and register it in the store; returns a summary
+
+    Of each set of identical files the one already in the store is kept, else
+    the most referenced one, else the oldest, under its existing name so that
+    URLs to it keep working. References to the others are rewritten and the
+    others deleted once the rewrites are committed.
+    """
+    from app import db
+    from models import StoredFile
+
+    folder = current_app.config['UPLOAD_FOLDER']
+    connection = db.session.connection()
+    files = StoredFile.__table__
+    stored = {sha256: path for sha256, path in connection.execute(select(files.c.sha256, files.c.path))}
+    counts = reference_counts(connection)
+
+    groups = defaultdict(list)
+    sizes = {}
+    for relative, path in _upload_files(folder):
+        groups[file_digest(path)].append(relative)
+        sizes[relative] = os.path.getsize(path)
+
+    summary = {'files': len(sizes), 'distinct': len(groups), 'duplicates': 0, 'bytes_freed': 0, 'references_rewritten': 0}
+    redirects = {}
+    survivors = {}
+    for sha256, paths in groups.items():
+        keep = min(paths, key=lambda p: (p != stored.get(sha256), -counts[p],
+                                         os.path.getmtime(os.path.join(folder, p)), p))
+        survivors[sha256] = keep
+        for path in paths:
+            if path != keep:
+                redirects[path] = keep
+                summary['duplicates'] += 1
+                summary['bytes_freed'] += sizes[path]
+
+    for model, attr, directory in reference_columns():
+        for obj in model.query.filter(getattr(model, attr).isnot(None)):
+            value = getattr(obj, attr)
+            path = upload_path(value, directory)
+            if path in redirects:
+                summary['references_rewritten'] += 1
+                if not dry_run:
+                    setattr(obj, attr, _rewrite_reference(value, path, redirects[path], directory))
+
+    if dry_run:
+        db.session.rollback()
+        return summary
+
+    db.session.flush()
+    connection = db.session.connection()
+    for sha256, path in survivors.items():
+        values = {'path': path, 'size': sizes[path], 'mime_type': mimetypes.guess_type(path)[0]}
+        stmt = upsert(connection, files, [files.c.sha256], values)
+        connection.execute(stmt.values(sha256=sha256, ref_count=0, **values))
+    reconcile_refcounts(connection)
+    db.session.commit()
+
+    # Only now that no committed row points at them
+    for path in redirects:
+        os.unlink(os.path.join(folder, path))
+    logger.info(f"Deduplicated uploads: removed {summary['duplicates']} copies, {summary['bytes_freed']} bytes")
+    return summary
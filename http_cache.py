@@ -0,0 +1,138 @@
+"""
+HTTP caching for dynamic pages.
+
+Every response gets a Cache-Control policy chosen per route: the view's
+``@cache_policy``, then ``CACHE_CONTROL_POLICIES`` by endpoint or blueprint,
+then ``DEFAULT_CACHE_CONTROL`` (revalidate on every use). Static files with
+content-hashed names from the asset manifest (see asset_utils.py) are
+``immutable`` for ``STATIC_IMMUTABLE_MAX_AGE``; other static files revalidate.
+
+Views decorated with ``@conditional(scopes...)`` get a weak ETag and a
+Last-Modified date from the revision stamps of the content they show (see
+revisions.py). A matching If-None-Match / If-Modified-Since is answered with
+304 before the view runs, so no queries or rendering happen. Other GET
+responses fall back to an ETag hashed from the body, which still saves the
+transfer. Views that render forms should not use ``@conditional``: a cached
+page would keep an old CSRF token.
+"""
+import hashlib
+import logging
+from datetime import timezone
+from functools import wraps
+from flask import current_app, request, session
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY = 'private, no-cache'
+
+def cache_policy(value):
+    """Set the Cache-Control header for one view, e.g. @cache_policy('no-store')"""
+    def decorator(view):
+        view._cache_policy = value
+        return view
+    return decorator
+
+def _current_user_id():
+    from flask_login import current_user
+    return current_user.get_id() if current_user.is_authenticated else None
+
+def validators(scopes, view_args, per_user=True):
+    """(etag, last_modified) for a request from the stamps of its scopes
+
+    Scope names may use the view's arguments and ``user_id`` as format fields,
+    e.g. ``'user:{user_id}'``.
+    """
+    from revisions import current
+
+    user_id = _current_user_id()
+    names = [scope.format(user_id=user_id, **view_args) for scope in scopes]
+    stamps = current(names)
+    parts = [
+        request.endpoint or '',
+        request.full_path,
+        str(user_id) if per_user else '',
+        str(current_app.config.get('ETAG_SEED', '')),
+    ] + [f"{name}={value}" for name, (value, _) in sorted(stamps.items())]
+    etag = hashlib.blake2b('|'.join(parts).encode('utf-8'), digest_size=12).hexdigest()
+
+    modified = [updated_at for _, updated_at in stamps.values()]
+    last_modified = None
+    if modified and None not in modified:
+        last_modified = max(modified).replace(microsecond=0, tzinfo=timezone.utc)
+    return etag, last_modified
+
+def _not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since
+    return False
+
+def conditional(*scopes, per_user=True):
+    """Validate a GET view against revision stamps and answer 304 without running it
+
+    ``per_user=False`` shares one ETag between users, for pages that do not
+    depend on who is logged in.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # A pending flash message must be rendered, never revalidated away
+            if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                return view(*args, **kwargs)
+            etag, last_modified = validators(scopes, kwargs, per_user)
+            if _not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag, weak=True)
+                if last_modified is not None:
+                    response.last_modified = last_modified
+            return response
+        return wrapper
+    return decorator
+
+def resolve_policy():
+    """Cache-Control value for the current request's route"""
+    config = current_app.config
+    view = current_app.view_functions.get(request.endpoint)
+    policy = getattr(view, '_cache_policy', None)
+    if policy is None:
+        policies = config.get('CACHE_CONTROL_POLICIES', {})
+        policy = policies.get(request.endpoint) or policies.get(request.blueprint)
+    if policy is None and request.endpoint == 'static':
+        policy = f"public, max-age={config.get('STATIC_CACHE_TIMEOUT', 86400)}"
+    return policy or config.get('DEFAULT_CACHE_CONTROL', DEFAULT_POLICY)
+
+def _is_hashed_asset():
+    manifest = current_app.extensions.get('asset_manifest')
+    return (request.endpoint == 'static' and manifest is not None
+            and manifest.is_hashed((request.view_args or {}).get('filename')))
+
+def apply_cache_policy(response):
+    """Set Cache-Control and, for plain GET responses, a body-hash validator"""
+    if response.status_code in (200, 206, 304) and _is_hashed_asset():
+        # A hashed name always refers to the same bytes; never revalidate it
+        max_age = current_app.config.get('STATIC_IMMUTABLE_MAX_AGE', 31536000)
+        response.headers['Cache-Control'] = f"public, max-age={max_age}, immutable"
+        return response
+    if 'Cache-Control' not in response.headers:
+        response.headers['Cache-Control'] = 'no-store' if response.status_code >= 500 else resolve_policy()
+    cache_control = response.headers['Cache-Control']
+    if 'private' in cache_control:
+        # Pages differ per session cookie; shared caches must not mix them up
+        response.vary.add('Cookie')
+
+    if (request.method in ('GET', 'HEAD') and response.status_code == 200
+            and 'no-store' not in cache_control
+            and not response.is_streamed and not response.direct_passthrough
+            and response.get_etag()[0] is None
+            and response.calculate_content_length() <= current_app.config.get('ETAG_BODY_HASH_MAX', 1024 * 1024)):
+        response.add_etag(weak=True)
+        response.make_conditional(request)
+    return response
+
+def init_http_cache(app):
+    """Apply per-route Cache-Control policies and body-hash ETags to every response"""
+    app.after_request(apply_cache_policy)
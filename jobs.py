@@ -0,0 +1,497 @@
+"""
+Durable background jobs.
+
+Work that does not have to finish before the response (writing feedback,
+badge evaluation, audio indexing) is queued as a row in the ``job`` table
+and run by ``flask jobs-worker``:
+
+    db.session.add(record)
+    db.session.flush()
+    enqueue('practice.feedback', {'record_id': record.id}, key=f'feedback:{record.id}')
+    db.session.commit()
+
+The row is written in the caller's transaction, so a job exists exactly when
+the record it is about was committed. A task gets the payload as keyword
+arguments and runs in the same transaction that marks its job done, so its
+database work and the job's completion are committed together.
+
+Jobs run at least once. A failed job is retried with exponential backoff
+until it has used ``max_attempts``. A job whose worker died runs again when
+its lease (``JOBS_LEASE_SECONDS``) runs out. Tasks must therefore be safe to
+run twice. Higher ``priority`` runs first. An idempotency key turns a second
+enqueue of the same work into a no-op while the row exists; finished rows
+are removed by ``flask jobs-purge``. Workers claim jobs with a
+compare-and-set UPDATE, which behaves the same on SQLite and PostgreSQL.
+``/admin/jobs`` shows the queue.
+"""
+import os
+import json
+import time
+import signal
+import socket
+import logging
+import threading
+import traceback
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from flask import abort, current_app, render_template_string, request
+from sqlalchemy import and_, delete, func, or_, select, update
+from counters import insert_ignore
+
+logger = logging.getLogger(__name__)
+
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+Task = namedtuple('Task', 'fn priority max_attempts')
+
+TASKS = {}
+
+def task(name, priority=0, max_attempts=None):
+    """Register a function as the task run for jobs named name"""
+    def decorator(fn):
+        TASKS[name] = Task(fn, priority, max_attempts)
+        return fn
+    return decorator
+
+def _jobs_table():
+    from models import Job
+    return Job.__table__
+
+# -- producer side ---------------------------------------------------------------
+
+def enqueue(name, payload=None, key=None, priority=None, delay=0, max_attempts=None):
+    """Queue a job in the current transaction (committed by the caller)
+
+    Returns False when a job with the same idempotency key already exists.
+    """
+    from app import db
+
+    if name not in TASKS:
+        raise ValueError(f"Unknown task: {name}")
+    registered = TASKS[name]
+    now = datetime.utcnow()
+    jobs = _jobs_table()
+    connection = db.session.connection()
+    # Keyed jobs are inserted at most once
+    stmt = insert_ignore(connection, jobs, [jobs.c.idempotency_key]) if key is not None else jobs.insert()
+    stmt = stmt.values(
+        task=name,
+        payload=json.dumps(payload or {}),
+        idempotency_key=key,
+        priority=registered.priority if priority is None else priority,
+        status='queued',
+        attempts=0,
+        max_attempts=max_attempts or registered.max_attempts or current_app.config.get('JOBS_MAX_ATTEMPTS', 5),
+        run_at=now + timedelta(seconds=delay),
+        created_at=now,
+    )
+    return connection.execute(stmt).rowcount == 1
+
+# -- claiming and running ----------------------------------------------------------
+
+def _retry_delay(attempts):
+    config = current_app.config
+    return min(config.get('JOBS_RETRY_BASE', 10) * 2 ** max(attempts - 1, 0), config.get('JOBS_RETRY_MAX', 3600))
+
+def claim(limit, worker_id):
+    """Mark up to limit due jobs as running for worker_id; returns their ids, most urgent first"""
+    from app import db
+
+    jobs = _jobs_table()
+    now = datetime.utcnow()
+    lease = now + timedelta(seconds=current_app.config.get('JOBS_LEASE_SECONDS', 300))
+    connection = db.session.connection()
+    expired = and_(jobs.c.status == 'running', jobs.c.locked_until < now)
+
+    # Jobs abandoned by a dead worker on their last attempt are not run again
+    connection.execute(update(jobs).where(expired, jobs.c.attempts >= jobs.c.max_attempts).values(
+        status='failed', locked_by=None, locked_until=None, finished_at=now,
+        last_error='Worker lost: lease expired on the last attempt',
+    ))
+
+    due = and_(or_(and_(jobs.c.status == 'queued', jobs.c.run_at <= now), expired),
+               jobs.c.attempts < jobs.c.max_attempts)
+    candidates = connection.execute(
+        select(jobs.c.id).where(due).order_by(jobs.c.priority.desc(), jobs.c.run_at, jobs.c.id).limit(limit * 2)
+    ).scalars().all()
+
+    claimed = []
+    for job_id in candidates:
+        if len(claimed) == limit:
+            break
+        # Another worker may have taken it since the SELECT; only one UPDATE matches
+        result = connection.execute(update(jobs).where(jobs.c.id == job_id, due).values(
+            status='running', locked_by=worker_id, locked_until=lease, attempts=jobs.c.attempts + 1,
+        ))
+        if result.rowcount == 1:
+            claimed.append(job_id)
+    db.session.commit()
+    return claimed
+
+def extend_leases(job_ids, worker_id):
+    """Keep jobs that are still running from being picked up by another worker"""
+    from app import db
+
+    if not job_ids:
+        return
+    jobs = _jobs_table()
+    lease = datetime.utcnow() + timedelta(seconds=current_app.config.get('JOBS_LEASE_SECONDS', 300))
+    db.session.execute(update(jobs).where(jobs.c.id.in_(job_ids), jobs.c.locked_by == worker_id)
+                       .values(locked_until=lease))
+    db.session.commit()
+
+def release(job_ids, worker_id, error):
+    """Put claimed jobs back in the queue after their worker process failed"""
+    from app import db
+
+    for job_id in job_ids:
+        _record_failure(db.session.connection(), job_id, worker_id, error)
+    db.session.commit()
+
+def _record_failure(connection, job_id, worker_id, error):
+    jobs = _jobs_table()
+    row = connection.execute(select(jobs.c.attempts, jobs.c.max_attempts)
+                             .where(jobs.c.id == job_id, jobs.c.locked_by == worker_id)).first()
+    if row is None:
+        return None  # the lease expired and another worker owns the job now
+    now = datetime.utcnow()
+    retry = row.attempts < row.max_attempts
+    values = {'status': 'queued' if retry else 'failed', 'locked_by': None, 'locked_until': None, 'last_error': error}
+    if retry:
+        values['run_at'] = now + timedelta(seconds=_retry_delay(row.attempts))
+    else:
+        values['finished_at'] = now
+    connection.execute(update(jobs).where(jobs.c.id == job_id).values(**values))
+    return retry
+
+def run_job(job_id, worker_id):
+    """Run one claimed job; returns True when it succeeded"""
+    from app import db
+    from models import Job
+
+    job = db.session.get(Job, job_id)
+    if job is None or job.status != 'running' or job.locked_by != worker_id:
+        return False
+    name, payload = job.task, json.loads(job.payload or '{}')
+    started = time.perf_counter()
+    try:
+        if name not in TASKS:
+            raise LookupError(f"Unknown task: {name}")
+        TASKS[name].fn(**payload)
+        jobs = _jobs_table()
+        result = db.session.execute(update(jobs).where(jobs.c.id == job_id, jobs.c.locked_by == worker_id).values(
+            status='done', locked_by=None, locked_until=None, last_error=None, finished_at=datetime.utcnow(),
+        ))
+        if result.rowcount != 1:
+            # Another worker took the job over; its run counts, not this one
+            db.session.rollback()
+            logger.warning(f"Job {job_id} ({name}) lost its lease before finishing")
+            return False
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        error = traceback.format_exc()[-4000:]
+        retry = _record_failure(db.session.connection(), job_id, worker_id, error)
+        db.session.commit()
+        logger.warning(f"Job {job_id} ({name}) failed{', will retry' if retry else ''}: {_last_line(error)}")
+        return False
+    logger.info(f"Job {job_id} ({name}) done in {time.perf_counter() - started:.2f}s")
+    return True
+
+# -- worker ----------------------------------------------------------------------
+
+_process_app = None
+
+def _init_process():
+    """Give each pool process its own application, engine and connections"""
+    global _process_app
+    from app import create_app
+
+    # Ctrl-C reaches the whole process group; the parent decides when to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _process_app = create_app(web=False)
+
+def _run_in_process(job_id, worker_id):
+    with _process_app.app_context():
+        return run_job(job_id, worker_id)
+
+class _LeaseKeeper(threading.Thread):
+    """Renews the leases of the jobs a worker is running, also while one blocks the loop"""
+
+    def __init__(self, app, worker_id, interval):
+        super().__init__(name='job-leases', daemon=True)
+        self.app = app
+        self.worker_id = worker_id
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._job_ids = set()
+        self._stopped = threading.Event()
+
+    def add(self, job_id):
+        with self._lock:
+            self._job_ids.add(job_id)
+
+    def discard(self, job_id):
+        with self._lock:
+            self._job_ids.discard(job_id)
+
+    def run(self):
+        with self.app.app_context():
+            while not self._stopped.wait(self.interval):
+                with self._lock:
+                    job_ids = list(self._job_ids)
+                try:
+                    extend_leases(job_ids, self.worker_id)
+                except Exception as e:
+                    logger.warning(f"Could not renew job leases: {e}")
+
+    def stop(self):
+        self._stopped.set()
+
+def work(processes=None, burst=False):
+    """Run jobs until SIGTERM/SIGINT, or with burst until none are due; returns the number that succeeded
+
+    The calling process claims jobs and hands them to a pool of processes;
+    with processes=0 it runs them itself. Either way the running jobs' leases
+    are renewed from a thread, so a long job is not picked up a second time.
+    """
+    config = current_app.config
+    processes = config.get('JOBS_PROCESSES', 2) if processes is None else processes
+    poll_interval = config.get('JOBS_POLL_INTERVAL', 1.0)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    stopping = []
+
+    def stop(signum, frame):
+        logger.info("Job worker stopping after the running jobs")
+        stopping.append(signum)
+
+    previous = {signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+    leases = _LeaseKeeper(current_app._get_current_object(), worker_id, config.get('JOBS_LEASE_SECONDS', 300) / 3)
+    leases.start()
+    ran = 0
+    pool = ProcessPoolExecutor(processes, initializer=_init_process) if processes else None
+    running = {}
+    logger.info(f"Job worker {worker_id} started with {processes or 'no'} pool processes")
+    try:
+        while not stopping:
+            if pool is None:
+                job_ids = claim(1, worker_id)
+                if job_ids:
+                    leases.add(job_ids[0])
+                    try:
+                        succeeded = run_job(job_ids[0], worker_id)
+                    finally:
+                        leases.discard(job_ids[0])
+                    if succeeded is True:
+                        ran += 1
+                    continue
+            else:
+                free = processes - len(running)
+                for job_id in claim(free, worker_id) if free else ():
+                    leases.add(job_id)
+                    running[pool.submit(_run_in_process, job_id, worker_id)] = job_id
+                if running:
+                    done, _ = wait(running, timeout=poll_interval, return_when=FIRST_COMPLETED)
+                    lost = []
+                    for future in done:
+                        job_id = running.pop(future)
+                        leases.discard(job_id)
+                        try:
+                            if future.result() is True:
+                                ran += 1
+                        except BrokenProcessPool:
+                            lost.append(job_id)
+                        except Exception:
+                            logger.exception(f"Job {job_id} could not be run")
+                    if lost:
+                        # A pool process died (out of memory, segfault); the pool is
+                        # unusable, so requeue the job that killed it and all the others
+                        lost += running.values()
+                        logger.error(f"Job worker pool broke; requeueing jobs {sorted(lost)}")
+                        for job_id in lost:
+                            leases.discard(job_id)
+                        release(lost, worker_id, 'Worker process died')
+                        running.clear()
+                        pool.shutdown(wait=False, cancel_futures=True)
+                        pool = ProcessPoolExecutor(processes, initializer=_init_process)
+                    continue
+            if burst:
+                break
+            time.sleep(poll_interval)
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True)
+        leases.stop()
+        for signum, handler in previous.items():
+            signal.signal(signum, handler)
+    return ran
+
+# -- maintenance and status ----------------------------------------------------------
+
+def retry_failed(name=None):
+    """Queue failed jobs again with fresh attempts; returns how many"""
+    from app import db
+
+    jobs = _jobs_table()
+    stmt = update(jobs).where(jobs.c.status == 'failed')
+    if name:
+        stmt = stmt.where(jobs.c.task == name)
+    result = db.session.execute(stmt.values(status='queued', attempts=0, run_at=datetime.utcnow(), finished_at=None))
+    db.session.commit()
+    return result.rowcount
+
+def purge(days=7):
+    """Delete jobs that finished successfully more than days ago; returns how many
+
+    Their idempotency keys become free again.
+    """
+    from app import db
+
+    jobs = _jobs_table()
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    result = db.session.execute(delete(jobs).where(jobs.c.status == 'done', jobs.c.finished_at < cutoff))
+    db.session.commit()
+    return result.rowcount
+
+def _last_line(text):
+    lines = (text or '').strip().splitlines()
+    return lines[-1] if lines else ''
+
+def queue_status(connection, failures=20):
+    """Job counts per task and status, the age of the oldest due job and the latest failures"""
+    jobs = _jobs_table()
+    now = datetime.utcnow()
+    counts = {}
+    for name, status, count in connection.execute(
+        select(jobs.c.task, jobs.c.status, func.count()).group_by(jobs.c.task, jobs.c.status)
+    ):
+        counts.setdefault(name, dict.fromkeys(STATUSES, 0))[status] = count
+    oldest = connection.execute(
+        select(func.min(jobs.c.run_at)).where(jobs.c.status == 'queued', jobs.c.run_at <= now)
+    ).scalar()
+    recent = connection.execute(
+        select(jobs.c.id, jobs.c.task, jobs.c.attempts, jobs.c.last_error, jobs.c.finished_at)
+        .where(jobs.c.status == 'failed').order_by(jobs.c.finished_at.desc()).limit(failures)
+    ).all()
+    return {
+        'totals': {status: sum(c[status] for c in counts.values()) for status in STATUSES},
+        'tasks': counts,
+        'oldest_due_seconds': (now - oldest).total_seconds() if oldest else 0,
+        'failures': [{
+            'id': row.id,
+            'task': row.task,
+            'attempts': row.attempts,
+            'error': _last_line(row.last_error),
+            'finished_at': row.finished_at.isoformat() if row.finished_at else None,
+        } for row in recent],
+    }
+
+STATUS_TEMPLATE = """<!doctype html>
+<title>Background jobs</title>
+<style>
+  body { font-family: sans-serif; margin: 2em; }
+  table { border-collapse: collapse; width: 100%; margin-bottom: 2em; }
+  td, th { border: 1px solid #ccc; padding: .3em .5em; text-align: left; vertical-align: top; }
+  code { white-space: pre-wrap; font-size: .85em; }
+</style>
+<h1>Background jobs</h1>
+<p>{% for status, count in status.totals.items() %}{{ status }}: {{ count }}{% if not loop.last %} &middot; {% endif %}{% endfor %}.
+Oldest due job has waited {{ status.oldest_due_seconds|round(1) }}s.</p>
+<table>
+  <tr><th>Task</th>{% for name in statuses %}<th>{{ name }}</th>{% endfor %}</tr>
+  {% for name, counts in status.tasks|dictsort %}
+  <tr><td>{{ name }}</td>{% for s in statuses %}<td>{{ counts[s] }}</td>{% endfor %}</tr>
+  {% else %}
+  <tr><td colspan="{{ statuses|length + 1 }}">No jobs.</td></tr>
+  {% endfor %}
+</table>
+<h2>Recent failures</h2>
+<table>
+  <tr><th>Job</th><th>Task</th><th>Attempts</th><th>Finished</th><th>Error</th></tr>
+  {% for failure in status.failures %}
+  <tr><td>{{ failure.id }}</td><td>{{ failure.task }}</td><td>{{ failure.attempts }}</td>
+      <td>{{ failure.finished_at or '' }}</td><td><code>{{ failure.error }}</code></td></tr>
+  {% else %}
+  <tr><td colspan="5">None. Requeue failed jobs with <code>flask jobs-retry</code>.</td></tr>
+  {% endfor %}
+</table>
+"""
+
+def status_view():
+    from flask_login import current_user
+    from app import db
+
+    if not (current_user.is_authenticated and current_user.is_admin):
+        abort(403)
+    status = queue_status(db.session.connection())
+    if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        return status
+    return render_template_string(STATUS_TEMPLATE, status=status, statuses=STATUSES)
+
+def init_jobs(app):
+    """Serve the queue status at /admin/jobs (admins only)"""
+    app.add_url_rule('/admin/jobs', 'job_status', status_view)
+
+# -- tasks -----------------------------------------------------------------------
+
+def queue_submission_work(record, writing=False):
+    """Queue the slow follow-ups of a stored practice record; call before committing it
+
+    Submission endpoints add the record, call this and commit, and return
+    without waiting for feedback or badge evaluation.
+    """
+    from app import db
+
+    if record.id is None:
+        db.session.flush()
+    if writing and not record.feedback:
+        enqueue('practice.feedback', {'record_id': record.id}, key=f'feedback:{record.id}')
+    enqueue('badges.evaluate', {'user_id': record.user_id}, key=f'badges:{record.user_id}:{record.id}')
+
+@task('practice.feedback', priority=10)
+def writing_feedback(record_id):
+    """Assess a writing answer and store the feedback (and score, if unscored)"""
+    from app import db
+    from models import PracticeRecord
+    from utils import analyze_writing
+
+    record = db.session.get(PracticeRecord, record_id)
+    if record is None or record.feedback:
+        return
+    result = analyze_writing(_answer_text(record.answers))
+    record.feedback = result['feedback']
+    if not record.score:
+        record.score = result['score']
+
+def _answer_text(answers):
+    """The written text of a PracticeRecord.answers value (JSON or plain text)"""
+    try:
+        parsed = json.loads(answers or '')
+    except (TypeError, ValueError):
+        return answers or ''
+    if isinstance(parsed, dict):
+        return '\n'.join(value for value in parsed.values() if isinstance(value, str))
+    if isinstance(parsed, list):
+        return '\n'.join(value for value in parsed if isinstance(value, str))
+    return parsed if isinstance(parsed, str) else ''
+
+@task('badges.evaluate')
+def evaluate_badges(user_id):
+    """Evaluate every badge rule for a user (committed with the job)"""
+    from app import db
+    from badges import evaluate
+    from cache import invalidate_on_commit
+
+    if evaluate(db.session.connection(), [user_id]):
+        invalidate_on_commit(db.session, [f'user:{user_id}'])
+
+@task('audio.index', priority=-10)
+def index_uploaded_audio(filename):
+    """Build the frame index of an uploaded audio file before anyone plays it"""
+    from audio_stream import build_index
+
+    folder = current_app.config['UPLOAD_FOLDER']
+    if os.path.isfile(os.path.join(folder, 'audio', filename)):
+        build_index(folder, filename, current_app.config.get('AUDIO_INDEX_INTERVAL', 1.0))
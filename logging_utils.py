@@ -0,0 +1,240 @@
+"""
+Non-blocking, structured application logging.
+
+Request threads only put records on a bounded in-memory queue; a background
+listener thread formats them (JSON by default) and does the stream/file I/O.
+When the queue is full the record is dropped and counted instead of blocking
+the request. Noisy loggers can be sampled with ``LOG_SAMPLE_RATES``; sampling
+only applies below WARNING, so warnings and errors are always kept.
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import logging
+import threading
+import traceback
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# LogRecord attributes that are not worth repeating in JSON output
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any `extra=` fields"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, default=str)
+
+class SamplingFilter(logging.Filter):
+    """Keep 1 in N records below WARNING for the configured logger prefixes
+
+    ``rates`` maps a logger name (it also matches child loggers) to the
+    fraction of records to keep, e.g. ``{'error_handlers': 0.1}``.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates or {})
+        self._lock = threading.Lock()
+        self._seen = {}
+        self.sampled_out = 0
+
+    def _rate(self, name):
+        while name:
+            if name in self.rates:
+                return name, self.rates[name]
+            name = name.rpartition('.')[0]
+        return None, 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        prefix, rate = self._rate(record.name)
+        if rate >= 1.0:
+            return True
+        if rate <= 0:
+            self.sampled_out += 1
+            return False
+        every = max(1, round(1 / rate))
+        with self._lock:
+            seen = self._seen.get(prefix, 0)
+            self._seen[prefix] = seen + 1
+        if seen % every:
+            self.sampled_out += 1
+            return False
+        record.sample_rate = rate
+        return True
+
+class BoundedQueueHandler(QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking"""
+
+    def __init__(self, log_queue, context=None):
+        super().__init__(log_queue)
+        self.context = context
+        self.dropped = 0
+        self.enqueued = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record):
+        """Make the record safe to format on another thread
+
+        Only the cheap parts happen here: the message is interpolated, the
+        traceback rendered and request details captured while they still
+        exist. Formatting and I/O are left to the listener.
+        """
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        if self.context is not None:
+            for key, value in self.context().items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        return record
+
+def _request_fields():
+    from flask import has_request_context, request
+    if not has_request_context():
+        return {}
+    return {'method': request.method, 'path': request.path, 'remote_addr': request.remote_addr}
+
+class LogPipeline:
+    """The bounded queue, its handler on the root logger and the listener thread"""
+
+    def __init__(self, handlers, capacity=10000, sample_rates=None):
+        self.handlers = handlers
+        self.handler = BoundedQueueHandler(queue.Queue(maxsize=capacity), context=_request_fields)
+        self.sampler = SamplingFilter(sample_rates)
+        self.handler.addFilter(self.sampler)
+        self._listener = None
+
+    def start(self):
+        self._listener = QueueListener(self.handler.queue, *self.handlers, respect_handler_level=True)
+        self._listener.start()
+
+    def restart_after_fork(self):
+        # The listener thread does not survive a fork, and its queue lock may
+        # have been held at the time; the child starts over with fresh ones
+        self.handler.queue = queue.Queue(maxsize=self.handler.queue.maxsize)
+        self.start()
+
+    def stop(self):
+        """Flush queued records and stop the listener thread"""
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+        for handler in self.handlers:
+            handler.close()
+
+    def metrics(self):
+        return {
+            'queued': self.handler.queue.qsize(),
+            'capacity': self.handler.queue.maxsize,
+            'enqueued': self.handler.enqueued,
+            'dropped': self.handler.dropped,
+            'sampled_out': self.sampler.sampled_out,
+        }
+
+_pipeline = None
+
+def _output_handlers(app, formatter):
+    handlers = [logging.StreamHandler(sys.stderr)]
+    log_file = app.config.get('LOG_FILE')
+    if log_file:
+        handlers.append(RotatingFileHandler(
+            log_file,
+            maxBytes=app.config.get('LOG_FILE_MAX_BYTES', 10 * 1024 * 1024),
+            backupCount=app.config.get('LOG_FILE_BACKUP_COUNT', 10),
+            delay=True,
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+def init_logging(app):
+    """Install the configured logging mode on the root logger
+
+    LOG_MODE 'queue' (default) hands records to a background listener;
+    'sync' writes from the calling thread, as logging traditionally does.
+    Calling it again (another create_app) replaces the previous setup.
+    """
+    global _pipeline
+
+    level = app.config.get('LOG_LEVEL', 'INFO')
+    if app.config.get('LOG_FORMAT', 'json') == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+    handlers = _output_handlers(app, formatter)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if _pipeline is not None:
+        _pipeline.stop()
+        _pipeline = None
+
+    if app.config.get('LOG_MODE', 'queue') == 'queue':
+        _pipeline = LogPipeline(
+            handlers,
+            capacity=app.config.get('LOG_QUEUE_SIZE', 10000),
+            sample_rates=app.config.get('LOG_SAMPLE_RATES'),
+        )
+        _pipeline.start()
+        root.addHandler(_pipeline.handler)
+    else:
+        # One sampler per handler: a shared one would count every record once
+        # per handler, and each would keep a different subset
+        for handler in handlers:
+            handler.addFilter(SamplingFilter(app.config.get('LOG_SAMPLE_RATES')))
+            root.addHandler(handler)
+    root.setLevel(level)
+
+def log_metrics():
+    """Queue depth, drops and sampling counters for monitoring"""
+    if _pipeline is None:
+        return {'queued': 0, 'capacity': 0, 'enqueued': 0, 'dropped': 0, 'sampled_out': 0}
+    return _pipeline.metrics()
+
+def _restart_after_fork():
+    if _pipeline is not None:
+        _pipeline.restart_after_fork()
+
+@atexit.register
+def _flush_on_exit():
+    if _pipeline is not None:
+        _pipeline.stop()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
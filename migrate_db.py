@@ -1,10 +1,12 @@
 from flask_migrate import Migrate
-from app import app, db
+from app import create_app, db
 from models import User, Role, Section, Difficulty, Exercise, PracticeRecord
 from models import Badge, UserBadge, Score, ReadingPassage, ReadingTest, ReadingQuestion, Article, ArticleView
 import os
 import sys
 
+app = create_app(web=False)
+
 # Initialize Flask-Migrate
 migrate = Migrate(app, db)
 
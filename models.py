@@ -12,6 +12,10 @@ class Role(db.Model):
 
 class User(UserMixin, db.Model):
     """User model for authentication and profile"""
+    __table_args__ = (
+        db.Index('ix_user_points_total', 'points_total'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -25,6 +29,9 @@ class User(UserMixin, db.Model):
     last_name = db.Column(db.String(50))
     target_score = db.Column(db.Float, default=7.0)
     
+    # Running total of PracticeRecord.points_earned, maintained by counters.py
+    points_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Relationships
     scores = db.relationship('Score', backref='user', lazy=True)
     practice_records = db.relationship('PracticeRecord', backref='user', lazy=True)
@@ -46,10 +53,21 @@ class User(UserMixin, db.Model):
     
     @property
     def points(self):
-        total = 0
-        for record in self.practice_records:
-            total += record.points_earned
-        return total
+        return self.points_total or 0
+    
+    @staticmethod
+    def points_for(user_ids):
+        """Return a {user_id: points} mapping for many users in a single query"""
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {}
+        rows = db.session.query(User.id, User.points_total).filter(User.id.in_(user_ids)).all()
+        return {user_id: total or 0 for user_id, total in rows}
+    
+    @staticmethod
+    def leaderboard(limit=10):
+        """Return the top users ordered by their maintained points total"""
+        return User.query.order_by(User.points_total.desc(), User.id).limit(limit).all()
 
 class Section(db.Model):
     """IELTS exam sections"""
@@ -77,6 +95,10 @@ class Difficulty(db.Model):
 
 class Exercise(db.Model):
     """Exercises for practice"""
+    __table_args__ = (
+        db.Index('ix_exercise_section_difficulty_mock', 'section_id', 'difficulty_id', 'is_mock_test'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
@@ -84,30 +106,50 @@ class Exercise(db.Model):
     difficulty_id = db.Column(db.Integer, db.ForeignKey('difficulty.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_mock_test = db.Column(db.Boolean, default=False)
-    content = db.Column(db.Text, nullable=False)  # JSON content storing questions, answers, etc.
+    # JSON content storing questions, answers, etc. Deferred so listings and stats only load
+    # metadata; use Exercise.with_content() when a test is actually opened.
+    content = db.deferred(db.Column(db.Text, nullable=False))
     duration = db.Column(db.Integer, default=0)  # Duration in minutes
     points = db.Column(db.Integer, default=10)  # Points awarded for completion
     
-    # For listening exercises
-    audio_file = db.Column(db.String(255))
+    # For listening exercises; active_history so file_store.py can move reference counts
+    audio_file = db.column_property(db.Column(db.String(255)), active_history=True)
     
     # Relationships
     records = db.relationship('PracticeRecord', backref='exercise', lazy=True)
     
     def __repr__(self):
         return f'<Exercise {self.title}>'
+    
+    @staticmethod
+    def with_content():
+        """Exercise query that loads the deferred content column up front"""
+        return Exercise.query.options(db.undefer(Exercise.content))
+    
+    @property
+    def parsed_content(self):
+        """Content as parsed JSON, shared through the per-process cache (read-only)"""
+        from utils import parse_exercise_content
+        return parse_exercise_content(self)
 
 class PracticeRecord(db.Model):
     """Record of user's practice sessions"""
+    __table_args__ = (
+        db.Index('ix_practice_record_user_completed', 'user_id', 'completed_at'),
+        db.Index('ix_practice_record_exercise_id', 'exercise_id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     exercise_id = db.Column(db.Integer, db.ForeignKey('exercise.id'), nullable=False)
     started_at = db.Column(db.DateTime, default=datetime.utcnow)
-    completed_at = db.Column(db.DateTime)
+    # active_history so badges.py can tell completions and score changes apart
+    completed_at = db.column_property(db.Column(db.DateTime), active_history=True)
     answers = db.Column(db.Text)  # JSON answers provided by user
-    score = db.Column(db.Float)  # Score between 0-9
+    score = db.column_property(db.Column(db.Float), active_history=True)  # Score between 0-9
     feedback = db.Column(db.Text)  # AI feedback
-    points_earned = db.Column(db.Integer, default=0)
+    # active_history so counters.py sees the previous value when points are re-scored
+    points_earned = db.column_property(db.Column(db.Integer, default=0), active_history=True)
     
     def __repr__(self):
         return f'<PracticeRecord {self.id}>'
@@ -141,8 +183,28 @@ class Score(db.Model):
         self.overall = round(total / 4, 1)
         return self.overall
 
+class ScoreRollup(db.Model):
+    """Per-user, per-section daily and weekly score aggregates maintained by rollups.py"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    section_id = db.Column(db.Integer, db.ForeignKey('section.id'), primary_key=True)
+    period = db.Column(db.String(8), primary_key=True)  # 'day' or 'week'
+    period_start = db.Column(db.Date, primary_key=True)  # the day, or the Monday of the week
+    count = db.Column(db.Integer, nullable=False, default=0)  # scored completions
+    score_sum = db.Column(db.Float, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<ScoreRollup {self.user_id} {self.section_id} {self.period} {self.period_start}>'
+    
+    @property
+    def average(self):
+        return self.score_sum / self.count if self.count else 0
+
 class Badge(db.Model):
     """Badges for gamification"""
+    __table_args__ = (
+        db.Index('ix_badge_section_points', 'section_id', 'points_required'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
     description = db.Column(db.Text)
@@ -159,6 +221,10 @@ class Badge(db.Model):
 
 class UserBadge(db.Model):
     """Association table for users and their earned badges"""
+    __table_args__ = (
+        db.Index('uq_user_badge_user_badge', 'user_id', 'badge_id', unique=True),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     badge_id = db.Column(db.Integer, db.ForeignKey('badge.id'), nullable=False)
@@ -167,6 +233,15 @@ class UserBadge(db.Model):
     def __repr__(self):
         return f'<UserBadge {self.id}>'
 
+class UserCounter(db.Model):
+    """Per-user running counters evaluated by the badge rules in badges.py"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    name = db.Column(db.String(64), primary_key=True)  # e.g. "section_completed:1", "high_scores"
+    value = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<UserCounter {self.user_id} {self.name}={self.value}>'
+
 class ReadingPassage(db.Model):
     """Model to store reading passages"""
     id = db.Column(db.Integer, primary_key=True)
@@ -222,7 +297,7 @@ class Article(db.Model):
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
     summary = db.Column(db.Text)
-    image_url = db.Column(db.String(255))
+    image_url = db.column_property(db.Column(db.String(255)), active_history=True)  # see file_store.py
     category = db.Column(db.String(50))  # e.g., "Reading Tips", "IELTS Strategy", "Writing Samples"
     section_id = db.Column(db.Integer, db.ForeignKey('section.id'))
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -230,6 +305,11 @@ class Article(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     is_published = db.Column(db.Boolean, default=True)
     
+    # View counters maintained by counters.py; unique viewers are estimated from viewer_sketch
+    view_total = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    unique_viewers = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    viewer_sketch = db.Column(db.LargeBinary)  # HyperLogLog registers over viewer user ids
+    
     # Relationships
     section = db.relationship('Section', backref='articles', lazy=True)
     author = db.relationship('User', backref='articles', lazy=True)
@@ -241,16 +321,19 @@ class Article(db.Model):
     @property
     def view_count(self):
         """Get the total number of views for this article"""
-        return len(self.views)
+        return self.view_total or 0
     
     @property
     def unique_view_count(self):
-        """Get the number of unique users who viewed this article"""
-        unique_users = set([view.user_id for view in self.views])
-        return len(unique_users)
+        """Get the (approximate) number of unique users who viewed this article"""
+        return self.unique_viewers or 0
 
 class ArticleView(db.Model):
     """Model to track article views"""
+    __table_args__ = (
+        db.Index('ix_article_view_article_viewed', 'article_id', 'viewed_at'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     article_id = db.Column(db.Integer, db.ForeignKey('article.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -258,3 +341,67 @@ class ArticleView(db.Model):
     
     def __repr__(self):
         return f'<ArticleView article_id={self.article_id} user_id={self.user_id}>'
+
+class ViewSpoolBatch(db.Model):
+    """A view_buffer.py spool file whose views are already in the database"""
+    name = db.Column(db.String(255), primary_key=True)
+    ingested_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f'<ViewSpoolBatch {self.name}>'
+
+
+class Revision(db.Model):
+    """Change stamp per content scope, bumped by revisions.py when rows in it are written"""
+    scope = db.Column(db.String(100), primary_key=True)  # e.g. "articles", "user:42"
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<Revision {self.scope}={self.value}>'
+
+class StoredFile(db.Model):
+    """An upload kept once per distinct content by file_store.py"""
+    sha256 = db.Column(db.String(64), primary_key=True)
+    path = db.Column(db.String(255), nullable=False, unique=True)  # relative to UPLOAD_FOLDER
+    size = db.Column(db.BigInteger, nullable=False)
+    mime_type = db.Column(db.String(100))
+    # Exercise.audio_file / Article.image_url values pointing at this file
+    ref_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StoredFile {self.path} refs={self.ref_count}>'
+
+class Job(db.Model):
+    """A unit of background work for jobs.py"""
+    __table_args__ = (
+        db.Index('ix_job_status_priority_run_at', 'status', 'priority', 'run_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text)  # JSON keyword arguments for the task
+    # Jobs enqueued again with the same key while this row exists are dropped
+    idempotency_key = db.Column(db.String(128), unique=True)
+    priority = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # higher runs first
+    status = db.Column(db.String(16), nullable=False, default='queued', server_default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    max_attempts = db.Column(db.Integer, nullable=False, default=5, server_default='5')
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # not before; pushed back on retries
+    locked_by = db.Column(db.String(64))
+    locked_until = db.Column(db.DateTime)  # a running job past its lease is picked up again
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    def __repr__(self):
+        return f'<Job {self.id} {self.task} {self.status}>'
+
+class SchemaVersion(db.Model):
+    """Upgrade steps from schema.py that have been applied to this database"""
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SchemaVersion {self.version}>'
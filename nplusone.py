@@ -0,0 +1,226 @@
+"""
+N+1 query detection for development and staging.
+
+While enabled, every SQL statement a request runs is reduced to a fingerprint
+(literals and IN-list lengths removed) and attributed to the application code
+that issued it. A SELECT fingerprint that repeats ``NPLUSONE_THRESHOLD`` times
+or more in one request is reported as a likely N+1: typically a lazy
+relationship or a per-row property used inside a loop. Findings are logged,
+kept for ``/admin/nplusone`` and can fail test runs through the
+``pytest_nplusone`` plugin.
+
+Walking the stack for every statement is not free; keep it off in production.
+"""
+import os
+import re
+import sys
+import hashlib
+import logging
+import threading
+from collections import Counter, deque
+from contextvars import ContextVar
+from datetime import datetime
+from flask import abort, current_app, g, render_template_string, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+CALL_SITE_DEPTH = 2  # application frames recorded per statement
+
+_IGNORED_DIRS = ('site-packages', 'dist-packages', f'{os.sep}lib{os.sep}python')
+
+_tracker = ContextVar('nplusone_tracker', default=None)
+
+_WHITESPACE = re.compile(r'\s+')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAM = re.compile(r'%\(\w+\)s|:\w+|\$\d+|%s|\?')
+_IN_LIST = re.compile(r'IN \((?:\?\s*,\s*)*\?\)', re.IGNORECASE)
+
+def fingerprint(statement):
+    """(short hash, normalized SQL) for a statement, ignoring literal values"""
+    normalized = _WHITESPACE.sub(' ', statement).strip()
+    normalized = _STRING.sub('?', normalized)
+    normalized = _PARAM.sub('?', normalized)
+    normalized = _NUMBER.sub('?', normalized)
+    normalized = _IN_LIST.sub('IN (...)', normalized)
+    digest = hashlib.blake2b(normalized.encode('utf-8'), digest_size=6).hexdigest()
+    return digest, normalized
+
+def _is_application_frame(filename):
+    return (filename.startswith(PROJECT_ROOT)
+            and filename != __file__
+            and not any(part in filename[len(PROJECT_ROOT):] for part in _IGNORED_DIRS))
+
+def call_site(depth=CALL_SITE_DEPTH):
+    """The innermost application frames on the stack, as 'file:line in func' strings"""
+    frames = []
+    frame = sys._getframe(1)
+    while frame is not None and len(frames) < depth:
+        code = frame.f_code
+        if _is_application_frame(code.co_filename):
+            filename = os.path.relpath(code.co_filename, PROJECT_ROOT)
+            frames.append(f"{filename}:{frame.f_lineno} in {code.co_name}")
+        frame = frame.f_back
+    return ' <- '.join(frames) or '<outside application code>'
+
+class QueryTracker:
+    """Statement fingerprints and call sites seen while the tracker is active
+
+    Statements are also passed on to the tracker that was active when this one
+    started, so a test tracker still sees the queries of requests it makes.
+    """
+
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.total = 0
+        self.statements = {}  # fingerprint -> [normalized sql, count, Counter of call sites]
+
+    def record(self, statement, digest=None, normalized=None, site=None):
+        if digest is None:
+            digest, normalized = fingerprint(statement)
+            site = call_site()
+        self.total += 1
+        entry = self.statements.get(digest)
+        if entry is None:
+            entry = self.statements[digest] = [normalized, 0, Counter()]
+        entry[1] += 1
+        entry[2][site] += 1
+        if self.parent is not None:
+            self.parent.record(statement, digest, normalized, site)
+
+    def findings(self, threshold):
+        """Repeated SELECT fingerprints, most frequent first"""
+        found = []
+        for digest, (normalized, count, sites) in self.statements.items():
+            if count >= threshold and normalized.upper().startswith(('SELECT', 'WITH')):
+                found.append({
+                    'fingerprint': digest,
+                    'statement': normalized,
+                    'count': count,
+                    'call_sites': sites.most_common(),
+                })
+        return sorted(found, key=lambda finding: -finding['count'])
+
+    def __enter__(self):
+        install()
+        self.parent = _tracker.get()
+        self._token = _tracker.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        _tracker.reset(self._token)
+
+def _record_statement(conn, cursor, statement, parameters, context, executemany):
+    tracker = _tracker.get()
+    if tracker is not None:
+        tracker.record(statement)
+
+def install():
+    """Listen to statements on every engine, once per process"""
+    if not event.contains(Engine, 'before_cursor_execute', _record_statement):
+        event.listen(Engine, 'before_cursor_execute', _record_statement)
+
+def track_queries():
+    """Context manager collecting fingerprints outside a request (scripts, tests)"""
+    return QueryTracker()
+
+class ReportStore:
+    """The most recent requests that triggered findings"""
+
+    def __init__(self, size=100):
+        self._lock = threading.Lock()
+        self._reports = deque(maxlen=size)
+
+    def add(self, report):
+        with self._lock:
+            self._reports.appendleft(report)
+
+    def resize(self, size):
+        with self._lock:
+            self._reports = deque(self._reports, maxlen=size)
+
+    def recent(self):
+        with self._lock:
+            return list(self._reports)
+
+    def clear(self):
+        with self._lock:
+            self._reports.clear()
+
+reports = ReportStore()
+
+def _start_request():
+    tracker = QueryTracker(parent=_tracker.get())
+    g._nplusone_token = _tracker.set(tracker)
+    g._nplusone_tracker = tracker
+
+def _finish_request(response):
+    tracker = g.pop('_nplusone_tracker', None)
+    token = g.pop('_nplusone_token', None)
+    if tracker is None:
+        return response
+    _tracker.reset(token)
+    findings = tracker.findings(current_app.config.get('NPLUSONE_THRESHOLD', 5))
+    if findings:
+        reports.add({
+            'at': datetime.utcnow(),
+            'method': request.method,
+            'path': request.path,
+            'endpoint': request.endpoint,
+            'total_queries': tracker.total,
+            'findings': findings,
+        })
+        for finding in findings:
+            logger.warning(f"Possible N+1 in {request.endpoint}: {finding['count']}x "
+                           f"{finding['statement'][:120]} from {finding['call_sites'][0][0]}")
+        response.headers['X-NPlusOne-Findings'] = str(len(findings))
+    return response
+
+REPORT_TEMPLATE = """<!doctype html>
+<title>N+1 query report</title>
+<style>
+  body { font-family: sans-serif; margin: 2em; }
+  table { border-collapse: collapse; width: 100%; margin-bottom: 2em; }
+  td, th { border: 1px solid #ccc; padding: .3em .5em; text-align: left; vertical-align: top; }
+  code { white-space: pre-wrap; font-size: .85em; }
+</style>
+<h1>N+1 query report</h1>
+<p>Threshold: {{ threshold }} identical SELECTs per request. Showing the {{ reports|length }} most recent requests with findings.</p>
+{% for report in reports %}
+<h2>{{ report.method }} {{ report.path }} <small>({{ report.endpoint }}, {{ report.total_queries }} queries, {{ report.at.strftime('%Y-%m-%d %H:%M:%S') }})</small></h2>
+<table>
+  <tr><th>Count</th><th>Statement</th><th>Call sites</th></tr>
+  {% for finding in report.findings %}
+  <tr>
+    <td>{{ finding.count }}</td>
+    <td><code>{{ finding.statement }}</code></td>
+    <td>{% for site, count in finding.call_sites %}<code>{{ count }}x {{ site }}</code><br>{% endfor %}</td>
+  </tr>
+  {% endfor %}
+</table>
+{% else %}
+<p>No N+1 patterns recorded yet.</p>
+{% endfor %}
+"""
+
+def report_view():
+    from flask_login import current_user
+    if not (current_user.is_authenticated and current_user.is_admin):
+        abort(403)
+    if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        return {'threshold': current_app.config.get('NPLUSONE_THRESHOLD', 5), 'reports': reports.recent()}
+    return render_template_string(REPORT_TEMPLATE, reports=reports.recent(),
+                                  threshold=current_app.config.get('NPLUSONE_THRESHOLD', 5))
+
+def init_nplusone(app):
+    """Track per-request query fingerprints when NPLUSONE_ENABLED is set"""
+    if not app.config.get('NPLUSONE_ENABLED'):
+        return
+    install()
+    reports.resize(app.config.get('NPLUSONE_REPORT_SIZE', 100))
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/admin/nplusone', 'nplusone_report', report_view)
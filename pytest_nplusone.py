@@ -0,0 +1,73 @@
+"""
+pytest plugin that fails tests introducing new N+1 query patterns.
+
+Enable it with ``pytest -p pytest_nplusone`` (or ``pytest_plugins =
+['pytest_nplusone']`` in a conftest). Every test runs inside a query tracker;
+repeated SELECT fingerprints at or above ``--nplusone-threshold`` fail the
+test unless they are listed in the baseline file or the test is marked
+``@pytest.mark.allow_nplusone``. Record the current findings as the baseline
+with ``--nplusone-update-baseline``.
+"""
+import os
+import json
+import pytest
+from nplusone import track_queries
+
+DEFAULT_BASELINE = '.nplusone-baseline.json'
+
+def pytest_addoption(parser):
+    group = parser.getgroup('nplusone', 'N+1 query detection')
+    group.addoption('--nplusone', choices=('fail', 'warn', 'off'), default='fail',
+                    help='what to do when a test issues repeated identical SELECTs (default: fail)')
+    group.addoption('--nplusone-threshold', type=int, default=5,
+                    help='identical SELECTs in one test that count as an N+1 (default: 5)')
+    group.addoption('--nplusone-baseline', default=DEFAULT_BASELINE,
+                    help=f'JSON file of known findings to ignore (default: {DEFAULT_BASELINE})')
+    group.addoption('--nplusone-update-baseline', action='store_true',
+                    help='write every finding of this run to the baseline file')
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'allow_nplusone: do not fail this test on N+1 findings')
+    config._nplusone_found = {}
+    path = config.getoption('--nplusone-baseline')
+    config._nplusone_baseline = set()
+    if os.path.exists(path) and not config.getoption('--nplusone-update-baseline'):
+        with open(path, encoding='utf-8') as f:
+            config._nplusone_baseline = {tuple(entry) for entry in json.load(f)}
+
+def _key(finding):
+    # The statement and the code issuing it identify a finding across runs
+    return finding['fingerprint'], finding['call_sites'][0][0]
+
+@pytest.hookimpl(wrapper=True)
+def pytest_runtest_call(item):
+    mode = item.config.getoption('--nplusone')
+    if mode == 'off':
+        return (yield)
+    with track_queries() as tracker:
+        result = yield  # a failing test raises here and is reported as usual
+
+    findings = tracker.findings(item.config.getoption('--nplusone-threshold'))
+    for finding in findings:
+        item.config._nplusone_found[_key(finding)] = finding
+    new = [finding for finding in findings
+           if _key(finding) not in item.config._nplusone_baseline]
+    if not new or item.get_closest_marker('allow_nplusone') or item.config.getoption('--nplusone-update-baseline'):
+        return result
+
+    lines = [f"{len(new)} new N+1 query pattern(s):"]
+    for finding in new:
+        lines.append(f"  {finding['count']}x {finding['statement'][:200]}")
+        for site, count in finding['call_sites']:
+            lines.append(f"      {count}x {site}")
+    message = '\n'.join(lines)
+    if mode == 'warn':
+        item.warn(pytest.PytestWarning(message))
+        return result
+    pytest.fail(message, pytrace=False)
+
+def pytest_sessionfinish(session):
+    config = session.config
+    if config.getoption('--nplusone-update-baseline'):
+        with open(config.getoption('--nplusone-baseline'), 'w', encoding='utf-8') as f:
+            json.dump(sorted(config._nplusone_found), f, indent=2)
@@ -0,0 +1,208 @@
+"""
+Per-endpoint request metrics in Prometheus text format.
+
+Every request records its latency, the number of SQL statements it ran and
+the time they took (from SQLAlchemy cursor events), and its response size,
+labelled by Flask endpoint. The counters of the in-process caches and
+buffers are exported alongside. Metrics are per worker process: scrape each
+worker, or sum them in the query.
+
+Recording a request is a handful of dictionary updates under a lock, cheap
+enough to keep on in production (``python benchmarks.py request_metrics``).
+"""
+import hmac
+import time
+import bisect
+import logging
+import threading
+from contextvars import ContextVar
+from flask import Response, abort, current_app, g, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# [statement count, seconds] for the request running in this context
+_sql_usage = ContextVar('request_sql_usage', default=None)
+
+class Histogram:
+    """Cumulative-bucket histogram for one label set"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class RequestMetrics:
+    """Thread-safe per-endpoint request statistics"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}  # endpoint -> (latency, sql_count, size histograms, sql seconds)
+        self._responses = {}  # (endpoint, method, status) -> count
+
+    def record(self, endpoint, method, status, seconds, sql_count, sql_seconds, size):
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = [
+                    Histogram(LATENCY_BUCKETS), Histogram(SQL_COUNT_BUCKETS), Histogram(SIZE_BUCKETS), 0.0,
+                ]
+            stats[0].observe(seconds)
+            stats[1].observe(sql_count)
+            if size is not None:
+                stats[2].observe(size)
+            stats[3] += sql_seconds
+            key = (endpoint, method, status)
+            self._responses[key] = self._responses.get(key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._responses.clear()
+
+    def render(self):
+        """Request metrics in the Prometheus text exposition format"""
+        with self._lock:
+            endpoints = {name: (stats[0], stats[1], stats[2], stats[3]) for name, stats in self._endpoints.items()}
+            lines = [
+                '# HELP http_requests_total Requests handled, by endpoint, method and status.',
+                '# TYPE http_requests_total counter',
+            ]
+            for (endpoint, method, status), count in sorted(self._responses.items()):
+                lines.append(f'http_requests_total{{endpoint="{endpoint}",method="{method}",status="{status}"}} {count}')
+            _histogram_lines(lines, 'http_request_duration_seconds', 'Request latency.',
+                             ((name, stats[0]) for name, stats in endpoints.items()))
+            _histogram_lines(lines, 'http_request_sql_statements', 'SQL statements executed per request.',
+                             ((name, stats[1]) for name, stats in endpoints.items()))
+            _histogram_lines(lines, 'http_response_size_bytes', 'Response body size.',
+                             ((name, stats[2]) for name, stats in endpoints.items()))
+            lines += [
+                '# HELP http_request_sql_seconds_total Time spent in SQL statements.',
+                '# TYPE http_request_sql_seconds_total counter',
+            ]
+            for name, stats in sorted(endpoints.items()):
+                lines.append(f'http_request_sql_seconds_total{{endpoint="{name}"}} {stats[3]:.6f}')
+        return lines
+
+def _format_bound(bound):
+    return repr(float(bound)) if isinstance(bound, float) else str(bound)
+
+def _histogram_lines(lines, name, help_text, histograms):
+    lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+    for endpoint, histogram in sorted(histograms, key=lambda item: item[0]):
+        label = f'endpoint="{endpoint}"'
+        cumulative = 0
+        for bound, count in zip(histogram.bounds, histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{label},le="{_format_bound(bound)}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{label},le="+Inf"}} {histogram.count}')
+        lines.append(f'{name}_sum{{{label}}} {histogram.sum:.6f}')
+        lines.append(f'{name}_count{{{label}}} {histogram.count}')
+
+request_metrics = RequestMetrics()
+
+def _component_metrics(app):
+    """metrics() snapshots of the in-process caches, buffers and log queue"""
+    from cache import cache
+    from content_cache import content_cache
+    from logging_utils import log_metrics
+    from user_loader import identity_cache
+
+    components = {
+        'app_cache': cache.metrics(),
+        'content_cache': content_cache.metrics(),
+        'identity_cache': identity_cache.metrics(),
+        'log_queue': log_metrics(),
+    }
+    view_buffer = app.extensions.get('article_view_buffer')
+    if view_buffer is not None:
+        components['view_buffer'] = view_buffer.metrics()
+    return components
+
+def render_metrics(app):
+    lines = request_metrics.render()
+    for component, values in _component_metrics(app).items():
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f'# TYPE {component}_{key} gauge')
+                lines.append(f'{component}_{key} {value}')
+    return '\n'.join(lines) + '\n'
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _sql_usage.get() is not None:
+        conn.info.setdefault('request_metrics_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    usage = _sql_usage.get()
+    if usage is None:
+        return
+    started = conn.info.get('request_metrics_started')
+    if started:
+        usage[0] += 1
+        usage[1] += time.perf_counter() - started.pop()
+
+def _start_request():
+    g._metrics_started = time.perf_counter()
+    g._metrics_token = _sql_usage.set([0, 0.0])
+
+def _finish_request(response):
+    started = g.pop('_metrics_started', None)
+    token = g.pop('_metrics_token', None)
+    if started is None:
+        return response
+    usage = _sql_usage.get() or [0, 0.0]
+    if token is not None:
+        _sql_usage.reset(token)
+    request_metrics.record(
+        request.endpoint or 'unmatched',
+        request.method,
+        response.status_code,
+        time.perf_counter() - started,
+        usage[0],
+        usage[1],
+        None if response.is_streamed else response.calculate_content_length(),
+    )
+    return response
+
+def _authorized():
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        supplied = request.headers.get('Authorization', '')
+        if hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+            return True
+    from flask_login import current_user
+    return current_user.is_authenticated and current_user.is_admin
+
+def metrics_view():
+    if not _authorized():
+        abort(403)
+    return Response(render_metrics(current_app), mimetype='text/plain; version=0.0.4')
+
+def init_request_metrics(app):
+    """Instrument requests and serve /admin/metrics (admins or METRICS_TOKEN)"""
+    from app import db
+
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    with app.app_context():
+        engine = db.engine
+    for name, fn in (('before_cursor_execute', _before_cursor_execute),
+                     ('after_cursor_execute', _after_cursor_execute)):
+        if not event.contains(engine, name, fn):
+            event.listen(engine, name, fn)
+
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule('/admin/metrics', 'request_metrics', metrics_view)
@@ -0,0 +1,76 @@
+"""
+Revision stamps for content scopes.
+
+A scope is a named slice of content that a page is built from: "exercises",
+"articles", "badges", or one user's practice history ("user:<id>"). Writes to
+rows in a scope bump its ``Revision`` row inside the same transaction, so
+every worker sees a new stamp exactly when the data is committed. Pages use
+the stamps as ETag / Last-Modified validators (see http_cache.py) without
+rendering or hashing anything.
+"""
+import logging
+from datetime import datetime
+from sqlalchemy import event, select
+from counters import upsert
+
+logger = logging.getLogger(__name__)
+
+def revision_scopes(obj):
+    """Scopes whose content changes when obj is written"""
+    from models import Article, Badge, Exercise, PracticeRecord
+
+    if isinstance(obj, Exercise):
+        return {'exercises'}
+    if isinstance(obj, Article):
+        return {'articles'}
+    if isinstance(obj, PracticeRecord):
+        return {f'user:{obj.user_id}'}
+    if isinstance(obj, Badge):
+        return {'badges'}
+    return set()
+
+def bump(connection, scopes):
+    """Advance the stamps of scopes on connection (inside the caller's transaction)"""
+    from models import Revision
+
+    if not scopes:
+        return
+    revisions = Revision.__table__
+    now = datetime.utcnow()
+    stmt = upsert(
+        connection, revisions,
+        index_elements=[revisions.c.scope],
+        set_=lambda row: {'value': revisions.c.value + 1, 'updated_at': row.updated_at},
+    )
+    # Sorted, so concurrent transactions lock rows in the same order
+    connection.execute(stmt, [{'scope': scope, 'value': 1, 'updated_at': now} for scope in sorted(scopes)])
+
+def _bump_flushed(session, flush_context):
+    scopes = set()
+    for obj in list(session.new) + list(session.deleted):
+        scopes |= revision_scopes(obj)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=False):
+            scopes |= revision_scopes(obj)
+    if scopes:
+        bump(session.connection(), scopes)
+
+def register_revision_listeners(session):
+    """Attach the stamp maintenance hook to a (scoped) session, once"""
+    if not event.contains(session, 'after_flush', _bump_flushed):
+        event.listen(session, 'after_flush', _bump_flushed)
+
+def current(scopes):
+    """{scope: (value, updated_at)} for scopes; never-written scopes map to (0, None)"""
+    from app import db
+    from models import Revision
+
+    scopes = sorted(set(scopes))
+    found = {scope: (0, None) for scope in scopes}
+    if scopes:
+        revisions = Revision.__table__
+        for scope, value, updated_at in db.session.execute(
+            select(revisions.c.scope, revisions.c.value, revisions.c.updated_at).where(revisions.c.scope.in_(scopes))
+        ):
+            found[scope] = (value, updated_at)
+    return found
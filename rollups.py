@@ -0,0 +1,221 @@
+"""
+Materialized score time series for progress charts.
+
+Scored practice completions are folded into ``ScoreRollup`` rows per user,
+section and day/week as records are saved, so a chart over months of practice
+reads a few dozen aggregate rows instead of every record. ``score_series``
+downsamples long histories on the server to keep chart payloads small.
+"""
+import math
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from sqlalchemy import and_, delete, event, select
+from cache import memoize
+from counters import previous_value, upsert
+
+logger = logging.getLogger(__name__)
+
+PERIODS = ('day', 'week')
+
+_PENDING_KEY = 'rollups.pending'
+
+def period_start(period, moment):
+    """First day of the day/week bucket that contains moment"""
+    day = moment.date() if hasattr(moment, 'date') else moment
+    if period == 'week':
+        return day - timedelta(days=day.weekday())
+    return day
+
+def _scored(completed_at, score):
+    """(completed_at, score) if the record counts towards the charts, else None"""
+    if completed_at and score:
+        return completed_at, score
+    return None
+
+def _add_contribution(deltas, user_id, section_id, state, sign):
+    completed_at, score = state
+    for period in PERIODS:
+        key = (user_id, section_id, period, period_start(period, completed_at))
+        count, total = deltas[key]
+        deltas[key] = (count + sign, total + sign * score)
+
+def _collect_deleted_records(session, flush_context, instances):
+    from models import PracticeRecord
+
+    pending = session.info.setdefault(_PENDING_KEY, [])
+    for obj in session.deleted:
+        if isinstance(obj, PracticeRecord):
+            before = _scored(obj.completed_at, obj.score)
+            if before:
+                pending.append((obj.user_id, obj.exercise_id, before, None))
+
+def _apply_record_changes(session, flush_context):
+    """Move each changed record's contribution between rollup buckets"""
+    from models import PracticeRecord
+
+    pending = session.info.pop(_PENDING_KEY, None) or []
+    for obj in session.new:
+        if isinstance(obj, PracticeRecord):
+            after = _scored(obj.completed_at, obj.score)
+            if after:
+                pending.append((obj.user_id, obj.exercise_id, None, after))
+    for obj in session.dirty:
+        if isinstance(obj, PracticeRecord):
+            before = _scored(previous_value(obj, 'completed_at'), previous_value(obj, 'score'))
+            after = _scored(obj.completed_at, obj.score)
+            if before != after:
+                pending.append((obj.user_id, obj.exercise_id, before, after))
+    if pending:
+        apply_changes(session.connection(), pending)
+
+def apply_changes(connection, changes):
+    """Apply (user_id, exercise_id, before, after) record changes to the rollups"""
+    from models import Exercise
+
+    exercises = Exercise.__table__
+    exercise_ids = {exercise_id for _, exercise_id, _, _ in changes}
+    sections = dict(connection.execute(
+        select(exercises.c.id, exercises.c.section_id).where(exercises.c.id.in_(exercise_ids))
+    ).all())
+
+    deltas = defaultdict(lambda: (0, 0.0))
+    for user_id, exercise_id, before, after in changes:
+        section_id = sections.get(exercise_id)
+        if section_id is None:
+            continue
+        if before:
+            _add_contribution(deltas, user_id, section_id, before, -1)
+        if after:
+            _add_contribution(deltas, user_id, section_id, after, 1)
+    _upsert(connection, deltas)
+
+def _upsert(connection, deltas):
+    from models import ScoreRollup
+
+    rows = [
+        {'user_id': user_id, 'section_id': section_id, 'period': period,
+         'period_start': start, 'count': count, 'score_sum': total}
+        for (user_id, section_id, period, start), (count, total) in deltas.items()
+        if count or total
+    ]
+    if not rows:
+        return
+    rollups = ScoreRollup.__table__
+    stmt = upsert(
+        connection, rollups,
+        index_elements=[rollups.c.user_id, rollups.c.section_id, rollups.c.period, rollups.c.period_start],
+        set_=lambda row: {
+            'count': rollups.c.count + row.count,
+            'score_sum': rollups.c.score_sum + row.score_sum,
+        },
+    )
+    connection.execute(stmt, rows)
+
+def register_rollup_listeners(session):
+    """Attach the rollup maintenance hooks to a (scoped) session, once"""
+    hooks = (
+        ('before_flush', _collect_deleted_records),
+        ('after_flush', _apply_record_changes),
+    )
+    for name, fn in hooks:
+        if not event.contains(session, name, fn):
+            event.listen(session, name, fn)
+
+# -- backfill --------------------------------------------------------------
+
+def rebuild(batch_size=500, connection=None):
+    """Recompute every user's rollups from practice records, in user batches"""
+    from app import db
+    from models import User
+
+    users = User.__table__
+    last_id = 0
+    rebuilt = 0
+    while True:
+        if connection is not None:
+            user_ids = _rebuild_batch(connection, users, last_id, batch_size)
+        else:
+            with db.engine.begin() as batch_connection:
+                user_ids = _rebuild_batch(batch_connection, users, last_id, batch_size)
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+        rebuilt += len(user_ids)
+    logger.info(f"Rebuilt score rollups for {rebuilt} users")
+    return rebuilt
+
+def _rebuild_batch(connection, users, last_id, batch_size):
+    from models import Exercise, PracticeRecord, ScoreRollup
+
+    user_ids = connection.execute(
+        select(users.c.id).where(users.c.id > last_id).order_by(users.c.id).limit(batch_size)
+    ).scalars().all()
+    if not user_ids:
+        return user_ids
+
+    records = PracticeRecord.__table__
+    exercises = Exercise.__table__
+    rollups = ScoreRollup.__table__
+    deltas = defaultdict(lambda: (0, 0.0))
+    scored = connection.execute(
+        select(records.c.user_id, exercises.c.section_id, records.c.completed_at, records.c.score)
+        .join(exercises, records.c.exercise_id == exercises.c.id)
+        .where(records.c.user_id.in_(user_ids), records.c.completed_at.isnot(None))
+        .execution_options(yield_per=5000)
+    )
+    for user_id, section_id, completed_at, score in scored:
+        state = _scored(completed_at, score)
+        if state:
+            _add_contribution(deltas, user_id, section_id, state, 1)
+
+    connection.execute(delete(rollups).where(rollups.c.user_id.in_(user_ids)))
+    _upsert(connection, deltas)
+    return user_ids
+
+# -- reading ---------------------------------------------------------------
+
+@memoize(tags=lambda user_id, *args, **kwargs: [f'user:{user_id}'])
+def score_series(user_id, section_id=None, start=None, end=None, max_points=60):
+    """Average score over time for a progress chart, at most max_points long
+
+    Uses daily buckets when they fit, weekly buckets otherwise, and merges
+    adjacent weeks (count-weighted) when even those exceed max_points.
+    Returns a list of {'start', 'average', 'count'} dicts ordered by date.
+    """
+    from app import db
+    from models import ScoreRollup
+
+    rollups = ScoreRollup.__table__
+
+    def load(period):
+        conditions = [rollups.c.user_id == user_id, rollups.c.period == period, rollups.c.count > 0]
+        if section_id is not None:
+            conditions.append(rollups.c.section_id == section_id)
+        if start is not None:
+            conditions.append(rollups.c.period_start >= period_start(period, start))
+        if end is not None:
+            conditions.append(rollups.c.period_start <= end)
+        buckets = defaultdict(lambda: [0, 0.0])
+        for bucket_start, count, total in db.session.execute(
+            select(rollups.c.period_start, rollups.c.count, rollups.c.score_sum).where(and_(*conditions))
+        ):
+            buckets[bucket_start][0] += count
+            buckets[bucket_start][1] += total
+        return sorted((bucket_start, count, total) for bucket_start, (count, total) in buckets.items())
+
+    buckets = load('day')
+    if len(buckets) > max_points:
+        buckets = load('week')
+    if len(buckets) > max_points:
+        group = math.ceil(len(buckets) / max_points)
+        merged = []
+        for i in range(0, len(buckets), group):
+            chunk = buckets[i:i + group]
+            merged.append((chunk[0][0], sum(c for _, c, _ in chunk), sum(t for _, _, t in chunk)))
+        buckets = merged
+
+    return [
+        {'start': bucket_start, 'average': round(total / count, 2), 'count': count}
+        for bucket_start, count, total in buckets
+    ]
@@ -0,0 +1,149 @@
+"""
+Versioned schema upgrades for existing databases.
+
+``db.create_all()`` only creates missing tables, so columns and indexes added to
+models after a database was first created are applied here. Each step is
+idempotent and runs once; applied versions are recorded in ``schema_version``.
+"""
+import logging
+from sqlalchemy import delete, func, inspect, select
+from sqlalchemy.schema import CreateColumn
+
+logger = logging.getLogger(__name__)
+
+def _quote(conn, name):
+    return conn.dialect.identifier_preparer.quote(name)
+
+def _add_column(conn, column):
+    """Add a model column to its existing table unless it is already there"""
+    table = column.table.name
+    existing = {c['name'] for c in inspect(conn).get_columns(table)}
+    if column.name in existing:
+        return False
+    ddl = CreateColumn(column).compile(dialect=conn.dialect)
+    conn.exec_driver_sql(f"ALTER TABLE {_quote(conn, table)} ADD COLUMN {ddl}")
+    return True
+
+def _v1_user_points_total(conn):
+    """User.points_total counter, backfilled from practice records"""
+    from models import User
+    from counters import points_reconcile_statement
+
+    _add_column(conn, User.__table__.c.points_total)
+    conn.execute(points_reconcile_statement())
+
+def _v2_article_view_counters(conn):
+    """Article view counters and viewer sketch, backfilled from article views"""
+    from models import Article, ArticleView
+    from counters import record_article_views
+
+    columns = Article.__table__.c
+    added = [_add_column(conn, column) for column in (columns.view_total, columns.unique_viewers, columns.viewer_sketch)]
+    if any(added):
+        views = ArticleView.__table__
+        viewers = {}
+        for article_id, user_id in conn.execute(views.select().with_only_columns(views.c.article_id, views.c.user_id)):
+            viewers.setdefault(article_id, []).append(user_id)
+        record_article_views(conn, viewers)
+
+def _create_indexes(conn, *indexes):
+    """Create model indexes that do not exist yet"""
+    for index in indexes:
+        index.create(conn, checkfirst=True)
+
+def _v3_core_index_pack(conn):
+    """Composite and unique indexes for the hot query paths"""
+    from models import User, Exercise, PracticeRecord, Badge, UserBadge, ArticleView
+
+    # The unique (user_id, badge_id) index cannot be built over duplicate awards
+    user_badges = UserBadge.__table__
+    keep = select(func.min(user_badges.c.id)).group_by(user_badges.c.user_id, user_badges.c.badge_id)
+    result = conn.execute(delete(user_badges).where(user_badges.c.id.not_in(keep)))
+    if result.rowcount:
+        logger.info(f"Removed {result.rowcount} duplicate badge awards")
+
+    _create_indexes(conn, *(
+        index
+        for model in (User, Exercise, PracticeRecord, Badge, UserBadge, ArticleView)
+        for index in model.__table__.indexes
+    ))
+
+def _v4_badge_counters(conn):
+    """Per-user badge counters, built from practice records"""
+    from models import UserCounter
+    from badges import backfill
+
+    UserCounter.__table__.create(conn, checkfirst=True)
+    backfill(connection=conn)
+
+def _v5_score_rollups(conn):
+    """Daily and weekly score rollups, built from practice records"""
+    from models import ScoreRollup
+    from rollups import rebuild
+
+    ScoreRollup.__table__.create(conn, checkfirst=True)
+    rebuild(connection=conn)
+
+def _v6_revisions(conn):
+    """Revision stamps for HTTP validators; scopes start counting from their next write"""
+    from models import Revision
+
+    Revision.__table__.create(conn, checkfirst=True)
+
+def _v7_stored_files(conn):
+    """Content-addressed upload store; run 'flask dedupe-uploads' to register existing files"""
+    from models import StoredFile
+
+    StoredFile.__table__.create(conn, checkfirst=True)
+
+def _v8_jobs(conn):
+    """Background job queue"""
+    from models import Job
+
+    Job.__table__.create(conn, checkfirst=True)
+
+def _v9_view_spool_batches(conn):
+    """Ingested article-view spool files, so a replay never inserts views twice"""
+    from models import ViewSpoolBatch
+
+    ViewSpoolBatch.__table__.create(conn, checkfirst=True)
+
+# (version, step) pairs; append new steps with the next version number
+UPGRADE_STEPS = [
+    (1, _v1_user_points_total),
+    (2, _v2_article_view_counters),
+    (3, _v3_core_index_pack),
+    (4, _v4_badge_counters),
+    (5, _v5_score_rollups),
+    (6, _v6_revisions),
+    (7, _v7_stored_files),
+    (8, _v8_jobs),
+    (9, _v9_view_spool_batches),
+]
+
+SCHEMA_VERSION = UPGRADE_STEPS[-1][0]
+
+def current_version(conn):
+    """Return the highest applied schema version, or 0 for an unversioned database"""
+    from models import SchemaVersion
+
+    if not inspect(conn).has_table(SchemaVersion.__tablename__):
+        return 0
+    table = SchemaVersion.__table__
+    return conn.execute(table.select().with_only_columns(table.c.version).order_by(table.c.version.desc()).limit(1)).scalar() or 0
+
+def upgrade(engine):
+    """Apply every pending upgrade step in order; return the resulting version"""
+    from models import SchemaVersion
+
+    SchemaVersion.__table__.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        version = current_version(conn)
+        for step_version, step in UPGRADE_STEPS:
+            if step_version <= version:
+                continue
+            logger.info(f"Applying schema upgrade {step_version}: {step.__doc__}")
+            step(conn)
+            conn.execute(SchemaVersion.__table__.insert().values(version=step_version))
+            version = step_version
+    return version
@@ -1,10 +1,12 @@
 import json
 import os
-from app import app, db
+from app import create_app, db
 from models import User, Role, Section, Difficulty, Exercise, Badge
 from werkzeug.security import generate_password_hash
 from datetime import datetime
 
+app = create_app(web=False)
+
 def setup_database():
     """Set up the initial database schema and seed data"""
     # Set up proper database path
@@ -0,0 +1,60 @@
+"""
+Compact probabilistic counters stored alongside the rows they describe.
+"""
+import math
+import hashlib
+
+class HyperLogLog:
+    """HyperLogLog distinct-value estimator with byte-per-register storage
+
+    With the default precision of 10 the sketch is 1 KiB and the standard
+    error of the estimate is about 3%.
+    """
+
+    def __init__(self, data=None, precision=10):
+        self.precision = precision
+        self.size = 1 << precision
+        if data:
+            self.registers = bytearray(data)
+            if len(self.registers) != self.size:
+                raise ValueError(f"Sketch has {len(self.registers)} registers, expected {self.size}")
+        else:
+            self.registers = bytearray(self.size)
+
+    @staticmethod
+    def _hash(value):
+        # Stable across processes, unlike the built-in hash()
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big')
+
+    def add(self, value):
+        """Add a value; return True if the sketch changed"""
+        h = self._hash(value)
+        remaining_bits = 64 - self.precision
+        index = h >> remaining_bits
+        rest = h & ((1 << remaining_bits) - 1)
+        rank = remaining_bits - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def update(self, values):
+        changed = False
+        for value in values:
+            changed = self.add(value) or changed
+        return changed
+
+    def estimate(self):
+        """Return the estimated number of distinct values added"""
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Linear counting is more accurate for small cardinalities
+            return int(round(m * math.log(m / zeros)))
+        return int(round(raw))
+
+    def to_bytes(self):
+        return bytes(self.registers)
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# Tests import the top-level modules the same way the app does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def app(tmp_path):
+    """Application without the web layer, on a fresh SQLite database with the full schema"""
+    from app import create_app, db
+    from config import DevelopmentConfig
+
+    config = type('TestDatabaseConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'test.db'}",
+        'VIEW_BUFFER_ENABLED': False,
+        'VIEW_BUFFER_SPOOL_DIR': str(tmp_path / 'spool'),
+        'LOG_FILE': None,
+    })
+    app = create_app(config, web=False)
+    with app.app_context():
+        yield app
+        db.session.remove()
@@ -0,0 +1,79 @@
+"""AppCache on RedisBackend, against fakeredis as a local Redis stand-in."""
+import pytest
+
+fakeredis = pytest.importorskip('fakeredis')
+
+import cache as cache_module
+from cache import _MISSING, AppCache, RedisBackend, memoize
+
+@pytest.fixture
+def server():
+    return fakeredis.FakeServer()
+
+def make_cache(server):
+    return AppCache(RedisBackend(client=fakeredis.FakeRedis(server=server)), prefix='test:', default_timeout=60)
+
+@pytest.fixture
+def app_cache(server, monkeypatch):
+    app_cache = make_cache(server)
+    monkeypatch.setattr(cache_module, 'cache', app_cache)
+    return app_cache
+
+def test_set_and_get(app_cache):
+    app_cache.set('stats', {'completed': 3}, tags=['user:1'])
+    assert app_cache.get('stats', ['user:1']) == {'completed': 3}
+    assert app_cache.get('other', ['user:1']) is _MISSING
+
+def test_timeout_becomes_redis_expiry(app_cache):
+    app_cache.set('stats', 1, timeout=30)
+    assert 0 < app_cache.backend.client.ttl('test:stats') <= 30
+
+def test_invalidating_a_tag_only_stales_its_entries(app_cache):
+    app_cache.set('a', 1, tags=['user:1', 'leaderboard'])
+    app_cache.set('b', 2, tags=['user:2'])
+    app_cache.invalidate('leaderboard')
+    assert app_cache.get('a', ['user:1', 'leaderboard']) is _MISSING
+    assert app_cache.get('b', ['user:2']) == 2
+
+def test_invalidation_is_shared_between_workers(server, app_cache):
+    other_worker = make_cache(server)
+    app_cache.set('a', 1, tags=['articles'])
+    assert other_worker.get('a', ['articles']) == 1
+    other_worker.invalidate('articles')
+    assert app_cache.get('a', ['articles']) is _MISSING
+
+def test_clear_removes_only_prefixed_keys(app_cache):
+    app_cache.backend.client.set('unrelated', b'x')
+    app_cache.set('a', 1, tags=['articles'])
+    app_cache.clear()
+    assert app_cache.get('a', ['articles']) is _MISSING
+    assert app_cache.backend.client.get('unrelated') == b'x'
+
+def test_memoize_caches_until_invalidated(app_cache):
+    calls = []
+
+    @memoize(tags=lambda user_id: [f'user:{user_id}'])
+    def stats(user_id):
+        calls.append(user_id)
+        return len(calls)
+
+    assert stats(1) == stats(1) == 1
+    app_cache.invalidate('user:1')
+    assert stats(1) == 2
+    assert calls == [1, 1]
+
+def test_value_computed_across_an_invalidation_is_not_served(app_cache):
+    calls = []
+
+    @memoize(tags=['articles'])
+    def article_list():
+        calls.append(None)
+        if len(calls) == 1:
+            # Another worker commits an article while this one is still querying
+            app_cache.invalidate('articles')
+        return len(calls)
+
+    assert article_list() == 1
+    # The first result was stored against the tag version it was read under
+    assert article_list() == 2
+    assert article_list() == 2
@@ -0,0 +1,46 @@
+"""Dialect-specific upsert statements used by the counter and queue writers."""
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import mssql, mysql, postgresql, sqlite
+
+from counters import dialect_insert, insert_ignore, upsert
+from models import Job, UserCounter
+
+counters = UserCounter.__table__
+jobs = Job.__table__
+
+def connection_for(dialect):
+    return SimpleNamespace(dialect=dialect)
+
+def compile_sql(stmt, dialect):
+    return str(stmt.compile(dialect=dialect))
+
+def add_to_counter(connection):
+    return upsert(
+        connection, counters,
+        index_elements=[counters.c.user_id, counters.c.name],
+        set_=lambda row: {'value': counters.c.value + row.value},
+    )
+
+@pytest.mark.parametrize('dialect', [postgresql.dialect(), sqlite.dialect()])
+def test_upsert_uses_on_conflict(dialect):
+    sql = compile_sql(add_to_counter(connection_for(dialect)), dialect)
+    assert 'ON CONFLICT (user_id, name) DO UPDATE SET value = (user_counter.value + excluded.value)' in sql
+
+def test_upsert_on_mysql_updates_on_duplicate_key():
+    dialect = mysql.dialect()
+    sql = compile_sql(add_to_counter(connection_for(dialect)), dialect)
+    assert 'ON DUPLICATE KEY UPDATE value = (user_counter.value + VALUES(value))' in sql
+
+def test_insert_ignore():
+    for dialect in (postgresql.dialect(), sqlite.dialect()):
+        sql = compile_sql(insert_ignore(connection_for(dialect), jobs, [jobs.c.idempotency_key]), dialect)
+        assert 'ON CONFLICT (idempotency_key) DO NOTHING' in sql
+    dialect = mysql.dialect()
+    sql = compile_sql(insert_ignore(connection_for(dialect), jobs, [jobs.c.idempotency_key]), dialect)
+    assert sql.startswith('INSERT IGNORE INTO job')
+
+def test_unsupported_dialect_is_rejected():
+    with pytest.raises(ValueError, match='mssql'):
+        dialect_insert(connection_for(mssql.dialect()), counters)
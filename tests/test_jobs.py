@@ -0,0 +1,25 @@
+"""Running queued jobs in the worker process."""
+from app import db
+from models import Job
+import jobs
+
+@jobs.task('test.ok')
+def ok():
+    pass
+
+@jobs.task('test.broken', max_attempts=1)
+def broken():
+    raise RuntimeError('broken')
+
+def test_work_counts_only_jobs_that_succeeded(app):
+    jobs.enqueue('test.ok')
+    jobs.enqueue('test.broken')
+    db.session.commit()
+    assert jobs.work(processes=0, burst=True) == 1
+    assert sorted((job.task, job.status) for job in Job.query) == [('test.broken', 'failed'), ('test.ok', 'done')]
+
+def test_keyed_jobs_are_queued_once(app):
+    assert jobs.enqueue('test.ok', key='once') is True
+    assert jobs.enqueue('test.ok', key='once') is False
+    db.session.commit()
+    assert Job.query.count() == 1
@@ -0,0 +1,13 @@
+"""The hot queries in check_query_plans.py must keep using an index."""
+import pytest
+
+from check_query_plans import explain, known_queries
+
+@pytest.mark.parametrize('name', [name for name, _ in known_queries()])
+def test_query_uses_an_index(app, name):
+    from app import db
+
+    stmt = dict(known_queries())[name]
+    with db.engine.connect() as conn:
+        sql, plan, full_scans = explain(conn, stmt)
+    assert not full_scans, f"{name} regressed to a full scan:\n{sql}\n" + '\n'.join(map(str, plan))
@@ -0,0 +1,24 @@
+"""AppCache on the per-process SimpleBackend and tagging of model writes."""
+import time
+
+from cache import AppCache, SimpleBackend, model_tags
+from models import PracticeRecord, UserBadge
+
+def test_local_timeout_caps_entry_lifetime():
+    app_cache = AppCache(SimpleBackend(), prefix='test:', default_timeout=3600, max_timeout=60)
+    app_cache.set('stats', 1)
+    app_cache.set('forever', 2, timeout=0)
+    now = time.monotonic()
+    for key in ('test:stats', 'test:forever'):
+        expires, _ = app_cache.backend._entries[key]
+        assert now < expires <= now + 60
+
+def test_shorter_timeouts_are_kept():
+    app_cache = AppCache(SimpleBackend(), prefix='test:', max_timeout=60)
+    app_cache.set('stats', 1, timeout=5)
+    expires, _ = app_cache.backend._entries['test:stats']
+    assert expires <= time.monotonic() + 5
+
+def test_badge_awards_stale_the_users_stats():
+    assert model_tags(UserBadge(user_id=3, badge_id=1)) == {'user:3'}
+    assert 'user:3' in model_tags(PracticeRecord(user_id=3, exercise_id=1))
@@ -0,0 +1,53 @@
+"""Legacy /static/uploads/ URLs on an app with protected uploads."""
+import json
+import os
+
+import pytest
+from flask import Flask
+from flask_login import LoginManager
+
+from audio_stream import init_audio
+from upload_delivery import init_upload_delivery
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def client(tmp_path):
+    static = tmp_path / 'static'
+    uploads = static / 'uploads'
+    (uploads / 'audio').mkdir(parents=True)
+    (uploads / 'images').mkdir()
+    (uploads / 'audio' / 'ielts_listening_test1.mp3').write_bytes(b'\xff\xfb' * 64)
+    (uploads / 'images' / 'article.png').write_bytes(b'png')
+    (uploads / '.audio-index').mkdir()
+    (static / 'site.css').write_text('body {}')
+
+    app = Flask(__name__, static_folder=str(static))
+    app.config.update(SECRET_KEY='test', UPLOAD_FOLDER=str(uploads), UPLOAD_REQUIRE_AUTH=True)
+    login_manager = LoginManager(app)
+    login_manager.user_loader(lambda user_id: None)
+    init_upload_delivery(app)
+    init_audio(app)
+    return app.test_client()
+
+def test_legacy_audio_url_redirects_to_audio_endpoint(client):
+    with open(os.path.join(ROOT, 'listening_test_structure.json')) as f:
+        legacy = json.load(f)['audio_url']
+    response = client.get(legacy)
+    assert response.status_code == 301
+    assert response.headers['Location'] == '/audio/ielts_listening_test1.mp3'
+    assert client.get(response.headers['Location']).status_code == 403
+
+def test_legacy_image_url_redirects_to_upload_endpoint(client):
+    response = client.get('/static/uploads/images/article.png?v=2')
+    assert response.status_code == 301
+    assert response.headers['Location'] == '/uploads/images/article.png?v=2'
+    assert client.get(response.headers['Location']).status_code == 403
+
+def test_hidden_uploads_are_not_served(client):
+    assert client.get('/static/uploads/.audio-index/x.json').status_code == 404
+
+def test_other_static_files_are_served(client):
+    response = client.get('/static/site.css')
+    assert response.status_code == 200
+    response.close()
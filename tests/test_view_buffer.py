@@ -0,0 +1,60 @@
+"""Replay of article-view spool files left by workers that died."""
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from app import db
+from models import Article, ArticleView, User
+from view_buffer import ArticleViewBuffer
+
+@pytest.fixture(autouse=True)
+def article(app):
+    user = User.query.first()
+    article = Article(title='Spooled', content='text', author_id=user.id)
+    db.session.add(article)
+    db.session.commit()
+    return article
+
+@pytest.fixture
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+def write_spool(directory, name, views=2):
+    article_id = Article.query.first().id
+    with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+        for _ in range(views):
+            f.write(json.dumps({'article_id': article_id, 'user_id': 1, 'viewed_at': '2026-01-01T00:00:00'}) + '\n')
+
+def test_replayed_file_left_after_its_commit_is_not_inserted_again(app, dead_pid):
+    buffer = ArticleViewBuffer(app)
+    name = f"views-{dead_pid}.abcd1234.1.flushing"
+    write_spool(buffer.spool_dir, name)
+    assert buffer.replay_spool() == 2
+    # A crash between the commit and the unlink leaves the file behind
+    write_spool(buffer.spool_dir, name)
+    assert buffer.replay_spool() == 0
+    assert ArticleView.query.count() == 2
+    # The counters were updated outside this session
+    db.session.expire_all()
+    assert Article.query.first().view_total == 2
+    assert os.listdir(buffer.spool_dir) == []
+
+def test_file_claimed_by_a_dead_replayer_is_reclaimed(app, dead_pid):
+    buffer = ArticleViewBuffer(app)
+    write_spool(buffer.spool_dir, f"replay-{dead_pid}-views-{dead_pid}.abcd1234.active", views=3)
+    assert buffer.replay_spool() == 3
+    assert ArticleView.query.count() == 3
+    assert os.listdir(buffer.spool_dir) == []
+
+def test_files_of_live_workers_are_left_alone(app):
+    buffer = ArticleViewBuffer(app)
+    parent = os.getppid()
+    write_spool(buffer.spool_dir, f"views-{parent}.abcd1234.active")
+    write_spool(buffer.spool_dir, f"replay-{parent}-views-1.abcd1234.active")
+    assert buffer.replay_spool() == 0
+    assert len(os.listdir(buffer.spool_dir)) == 2
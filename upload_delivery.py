@@ -0,0 +1,195 @@
+"""
+Delivery of uploaded files.
+
+``/uploads/<filename>`` (and ``/audio/<filename>``, see audio_stream.py)
+check authorization in Flask: the request needs a logged-in user or a valid
+signed URL. With ``UPLOAD_DELIVERY = 'x-accel'`` or ``'x-sendfile'`` the
+bytes are then sent by the front server, nginx through ``X-Accel-Redirect``
+or Apache/lighttpd through ``X-Sendfile``, so a long audio download no longer
+ties up a worker. ``'direct'`` (the default) sends them from Python.
+
+Signed URLs carry an expiry time and an HMAC over the path and expiry keyed
+by ``UPLOAD_URL_SECRET``. Expiries are rounded up to whole ``UPLOAD_URL_TTL``
+periods so everyone gets the same URL for a while, which lets the CDN at
+``CDN_DOMAIN`` cache one copy of a protected file instead of one per user.
+"""
+import os
+import hmac
+import time
+import base64
+import hashlib
+import logging
+import mimetypes
+from urllib.parse import quote
+from flask import abort, current_app, redirect, request, send_from_directory, url_for
+from werkzeug.utils import safe_join
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_MODES = ('direct', 'x-accel', 'x-sendfile')
+
+def _secret():
+    secret = current_app.config.get('UPLOAD_URL_SECRET') or current_app.secret_key
+    return secret.encode() if isinstance(secret, str) else secret
+
+def signature(path, expires):
+    """URL-safe HMAC of a URL path and its expiry time"""
+    digest = hmac.new(_secret(), f"{path}\n{expires}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode()
+
+def signed_url(endpoint, filename, ttl=None):
+    """URL of an upload that works without a session until it expires
+
+    Points at CDN_DOMAIN when one is configured, so the CDN can fetch and
+    cache the file from this app.
+    """
+    ttl = ttl or current_app.config.get('UPLOAD_URL_TTL', 3600)
+    # Valid for between one and two TTLs, shared by every request in the same period
+    expires = (int(time.time()) // ttl + 2) * ttl
+    path = url_for(endpoint, filename=filename)
+    query = f"expires={expires}&sig={signature(path, expires)}"
+    cdn_domain = current_app.config.get('CDN_DOMAIN')
+    return f"{cdn_domain.rstrip('/') if cdn_domain else ''}{path}?{query}"
+
+def _signed_expiry():
+    """Expiry time of a valid signed request, or None"""
+    expires = request.args.get('expires', type=int)
+    sig = request.args.get('sig', '')
+    if expires is None or not sig or expires < time.time():
+        return None
+    expected = signature(request.script_root + request.path, expires)
+    return expires if hmac.compare_digest(sig.encode(), expected.encode()) else None
+
+def authorize(max_age=None):
+    """Check access to an upload; returns the Cache-Control for the response or aborts
+
+    Signed requests may be cached by shared caches, but not past the expiry
+    of the signature; session requests only by the browser.
+    """
+    if max_age is None:
+        max_age = current_app.config.get('UPLOAD_MAX_AGE', 86400)
+    expires = _signed_expiry()
+    if expires is not None:
+        return f"public, max-age={max(0, min(max_age, int(expires - time.time())))}"
+    if current_app.config.get('UPLOAD_REQUIRE_AUTH', True):
+        from flask_login import current_user
+        if not current_user.is_authenticated:
+            abort(403)
+        return f"private, max-age={max_age}"
+    return f"public, max-age={max_age}"
+
+def offload(filename, cache_control):
+    """Response handing the file to the front server, or None in 'direct' mode
+
+    filename is relative to UPLOAD_FOLDER and already checked to exist.
+    """
+    config = current_app.config
+    mode = config.get('UPLOAD_DELIVERY', 'direct')
+    if mode == 'direct':
+        return None
+
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    # The front server supplies the body, length, ranges and validators
+    response = current_app.response_class(b'', mimetype=mimetype, direct_passthrough=True)
+    if mode == 'x-accel':
+        prefix = config.get('UPLOAD_ACCEL_PREFIX', '/_protected_uploads/')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(filename)
+    elif mode == 'x-sendfile':
+        response.headers['X-Sendfile'] = os.path.abspath(os.path.join(config['UPLOAD_FOLDER'], filename))
+    else:
+        raise ValueError(f"Unsupported UPLOAD_DELIVERY: {mode}")
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def upload_file_path(folder, *parts):
+    """Absolute path of a servable file under folder, or None
+
+    Names with a dot-prefixed segment (indexes, partial uploads) are never served.
+    """
+    if any(segment.startswith('.') for part in parts for segment in part.split('/')):
+        return None
+    path = safe_join(folder, *parts)
+    return path if path is not None and os.path.isfile(path) else None
+
+def upload_view(filename):
+    cache_control = authorize()
+    folder = current_app.config['UPLOAD_FOLDER']
+    if upload_file_path(folder, filename) is None:
+        abort(404)
+
+    response = offload(filename, cache_control)
+    if response is None:
+        response = send_from_directory(folder, filename, conditional=True)
+        response.headers['Cache-Control'] = cache_control
+    return response
+
+def upload_url(value, signed=None):
+    """URL for an upload path or a stored /static/uploads/ URL; signed when a CDN serves uploads"""
+    from file_store import UPLOAD_URL_PATH
+
+    if value and value.startswith(UPLOAD_URL_PATH):
+        value = value[len(UPLOAD_URL_PATH):]
+    if not value or '://' in value or value.startswith('/'):
+        return value
+    if signed is None:
+        signed = bool(current_app.config.get('CDN_DOMAIN'))
+    if signed:
+        return signed_url('upload_file', value)
+    return url_for('upload_file', filename=value)
+
+def _upload_relative_path(filename):
+    """Path relative to UPLOAD_FOLDER of a static filename that resolves into it, or None"""
+    path = safe_join(current_app.static_folder, filename)
+    if path is None:
+        return None
+    uploads = os.path.realpath(current_app.config['UPLOAD_FOLDER'])
+    path = os.path.realpath(path)
+    if not path.startswith(uploads + os.sep):
+        return None
+    return os.path.relpath(path, uploads).replace(os.sep, '/')
+
+def _legacy_upload_url(relative):
+    """Access-checked URL for an upload that used to be linked under /static/uploads/"""
+    from audio_stream import AUDIO_DIR
+
+    if relative.startswith(AUDIO_DIR + '/') and 'audio_stream' in current_app.view_functions:
+        url = url_for('audio_stream', filename=relative[len(AUDIO_DIR) + 1:])
+    else:
+        url = url_for('upload_file', filename=relative)
+    if request.query_string:
+        url += '?' + request.query_string.decode('latin-1')
+    return url
+
+def _protect_static(static):
+    """Wrap the static view so it does not serve uploads around the access check
+
+    While UPLOAD_REQUIRE_AUTH is set, stored /static/uploads/... URLs (article
+    images, listening audio) are redirected to /uploads/ or /audio/. Audio
+    indexes and partial uploads (dot-prefixed names) are never served.
+    """
+    def static_view(filename):
+        relative = _upload_relative_path(filename)
+        if relative is not None:
+            if any(segment.startswith('.') for segment in relative.split('/')):
+                abort(404)
+            if current_app.config.get('UPLOAD_REQUIRE_AUTH', True):
+                return redirect(_legacy_upload_url(relative), 301)
+        return static(filename=filename)
+    return static_view
+
+def init_upload_delivery(app):
+    """Serve uploads at /uploads/<filename> after checking authorization
+
+    UPLOAD_FOLDER sits inside the static folder, so the static view is made
+    to redirect to these endpoints while UPLOAD_REQUIRE_AUTH is set.
+    """
+    mode = app.config.get('UPLOAD_DELIVERY', 'direct')
+    if mode not in DELIVERY_MODES:
+        raise ValueError(f"Unsupported UPLOAD_DELIVERY: {mode}")
+    if mode != 'direct' and not app.config.get('UPLOAD_URL_SECRET'):
+        logger.warning("UPLOAD_URL_SECRET is not set; signed upload URLs only work within one worker")
+    if app.has_static_folder and 'static' in app.view_functions:
+        app.view_functions['static'] = _protect_static(app.view_functions['static'])
+    app.add_url_rule('/uploads/<path:filename>', 'upload_file', upload_view)
+    app.add_template_global(upload_url)
+    app.add_template_global(signed_url)
@@ -1,7 +1,10 @@
 import os
 import uuid
+import hashlib
 import mimetypes
 import logging
+import threading
+from collections import namedtuple
 from werkzeug.utils import secure_filename
 from flask import current_app
 
@@ -16,6 +19,28 @@ try:
 except (ImportError, OSError):
     logger.warning("python-magic or libmagic not available, using mimetypes fallback for MIME type detection")
 
+# Map acceptable MIME types by file category
+ALLOWED_MIME_TYPES = {
+    'image': ['image/jpeg', 'image/png', 'image/gif', 'image/svg+xml', 'image/webp'],
+    'audio': ['audio/mpeg', 'audio/mp4', 'audio/ogg', 'audio/wav', 'audio/webm'],
+    'document': ['application/pdf', 'application/msword', 
+                'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+                'text/plain']
+}
+
+# Result of a streamed save: path relative to UPLOAD_FOLDER, SHA-256 hex digest, bytes, sniffed type
+SavedUpload = namedtuple('SavedUpload', ['path', 'sha256', 'size', 'mime_type'])
+
+# Loading the magic database is expensive and a detector must not be shared
+# between threads, so each thread keeps its own
+_detectors = threading.local()
+
+def _detector():
+    detector = getattr(_detectors, 'magic', None)
+    if detector is None:
+        detector = _detectors.magic = magic.Magic(mime=True)
+    return detector
+
 class FileUploader:
     """Utility for handling file uploads securely"""
     
@@ -43,8 +68,7 @@ class FileUploader:
         """Get MIME type using magic if available, fallback to mimetypes"""
         if MAGIC_AVAILABLE:
             try:
-                mime = magic.Magic(mime=True)
-                return mime.from_file(filepath)
+                return _detector().from_file(filepath)
             except Exception as e:
                 logger.error(f"Error with magic MIME detection: {str(e)}")
         
@@ -53,7 +77,95 @@ class FileUploader:
         return mime_type or 'application/octet-stream'
     
     @staticmethod
-    def save_file(file, directory, file_type=None, check_content=True):
+    def sniff_mime_type(head, filename):
+        """Get the MIME type from the first bytes of an upload, fallback to its filename"""
+        if MAGIC_AVAILABLE:
+            try:
+                return _detector().from_buffer(head)
+            except Exception as e:
+                logger.error(f"Error with magic MIME detection: {str(e)}")
+        
+        mime_type, _ = mimetypes.guess_type(filename)
+        return mime_type or 'application/octet-stream'
+    
+    @staticmethod
+    def content_matches(content_type, file_type):
+        """Check a detected MIME type against the claimed file type"""
+        if file_type and file_type in ALLOWED_MIME_TYPES:
+            return content_type in ALLOWED_MIME_TYPES[file_type]
+        return True
+    
+    @staticmethod
+    def _check_upload(file, file_type):
+        """Error message for an unacceptable upload, or None"""
+        if not file or file.filename == '':
+            return 'No file selected'
+        if not FileUploader.allowed_file(file.filename, file_type):
+            return 'File type not allowed'
+        return None
+    
+    @staticmethod
+    def _unique_filename(filename):
+        # Create a secure filename with a UUID to prevent collisions
+        original_name = secure_filename(filename)
+        name, ext = original_name.rsplit('.', 1)
+        return f"{name}_{uuid.uuid4().hex[:8]}.{ext}"
+    
+    @staticmethod
+    def save_stream(file, directory, file_type=None, check_content=True):
+        """
+        Save an upload by streaming it to disk in fixed-size chunks
+        
+        The MIME type is sniffed from the first chunk, so a file of the wrong
+        type is rejected before anything is written. The rest is copied in
+        UPLOAD_CHUNK_SIZE pieces while its SHA-256 is computed, into a
+        temporary file that is renamed into place once complete.
+        
+        Returns:
+            Tuple of (success, SavedUpload or error message)
+        """
+        error = FileUploader._check_upload(file, file_type)
+        if error:
+            return (False, error)
+        
+        config = current_app.config
+        stream = file.stream
+        head = stream.read(config.get('UPLOAD_SNIFF_SIZE', 8192))
+        content_type = FileUploader.sniff_mime_type(head, file.filename)
+        if check_content and not FileUploader.content_matches(content_type, file_type):
+            return (False, f"File content doesn't match {file_type} type")
+        
+        unique_filename = FileUploader._unique_filename(file.filename)
+        target_dir = os.path.join(config['UPLOAD_FOLDER'], directory)
+        os.makedirs(target_dir, exist_ok=True)
+        
+        chunk_size = config.get('UPLOAD_CHUNK_SIZE', 64 * 1024)
+        digest = hashlib.sha256()
+        size = 0
+        # Not mkstemp: its 0600 mode would hide the file from a web server serving uploads
+        partial_path = os.path.join(target_dir, f".{unique_filename}.part")
+        try:
+            with open(partial_path, 'xb') as out:
+                chunk = head
+                while chunk:
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+                    chunk = stream.read(chunk_size)
+            os.replace(partial_path, os.path.join(target_dir, unique_filename))
+        except Exception as e:
+            logger.error(f"Error saving file: {str(e)}")
+            try:
+                os.unlink(partial_path)
+            except OSError:
+                pass
+            return (False, f"Error saving file: {str(e)}")
+        
+        saved = SavedUpload(os.path.join(directory, unique_filename), digest.hexdigest(), size, content_type)
+        return (True, saved)
+    
+    @staticmethod
+    def save_file(file, directory, file_type=None, check_content=True, stream=None):
         """
         Save a file securely
         
@@ -62,20 +174,26 @@ class FileUploader:
             directory: Directory within UPLOAD_FOLDER to save to
             file_type: Type of file ('image', 'audio', etc.) for validation
             check_content: Whether to verify MIME type
+            stream: Stream the upload through save_stream (default: UPLOAD_STREAMING);
+                streamed uploads go to the content-addressed store if UPLOAD_DEDUPLICATE
         
         Returns:
             Tuple of (success, filename or error message)
         """
-        if not file or file.filename == '':
-            return (False, 'No file selected')
-            
-        if not FileUploader.allowed_file(file.filename, file_type):
-            return (False, 'File type not allowed')
+        if stream is None:
+            stream = current_app.config.get('UPLOAD_STREAMING', True)
+        if stream and current_app.config.get('UPLOAD_DEDUPLICATE'):
+            from file_store import store
+            return store(file, directory, file_type, check_content)
+        if stream:
+            success, result = FileUploader.save_stream(file, directory, file_type, check_content)
+            return (True, result.path) if success else (False, result)
+        
+        error = FileUploader._check_upload(file, file_type)
+        if error:
+            return (False, error)
             
-        # Create a secure filename with a UUID to prevent collisions
-        original_name = secure_filename(file.filename)
-        name, ext = original_name.rsplit('.', 1)
-        unique_filename = f"{name}_{uuid.uuid4().hex[:8]}.{ext}"
+        unique_filename = FileUploader._unique_filename(file.filename)
         
         # Ensure the target directory exists
         target_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], directory)
@@ -92,20 +210,10 @@ class FileUploader:
             if check_content:
                 content_type = FileUploader.get_mime_type(filepath)
                 
-                # Map acceptable MIME types by file category
-                mime_map = {
-                    'image': ['image/jpeg', 'image/png', 'image/gif', 'image/svg+xml', 'image/webp'],
-                    'audio': ['audio/mpeg', 'audio/mp4', 'audio/ogg', 'audio/wav', 'audio/webm'],
-                    'document': ['application/pdf', 'application/msword', 
-                                'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-                                'text/plain']
-                }
-                
-                if file_type and file_type in mime_map:
-                    if content_type not in mime_map[file_type]:
-                        # Content doesn't match claimed type - delete and return error
-                        os.unlink(filepath)
-                        return (False, f"File content doesn't match {file_type} type")
+                if not FileUploader.content_matches(content_type, file_type):
+                    # Content doesn't match claimed type - delete and return error
+                    os.unlink(filepath)
+                    return (False, f"File content doesn't match {file_type} type")
             
             # Return the path relative to the upload folder
             relative_path = os.path.join(directory, unique_filename)
@@ -123,11 +231,23 @@ class FileUploader:
 
     @staticmethod
     def delete_file(filename):
-        """Delete a file from the uploads directory"""
+        """
+        Delete a file from the uploads directory unless a row still refers to it
+        
+        Deduplicated uploads can be shared by several exercises or articles, so
+        delete or repoint the referencing row first, then delete the file.
+        """
+        from file_store import forget, is_referenced
+        
+        if is_referenced(filename):
+            logger.warning(f"Not deleting {filename}: still referenced by an exercise or article")
+            return False
+        
         filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
         try:
             if os.path.exists(filepath):
                 os.unlink(filepath)
+                forget(filename)
                 return True
             return False
         except Exception as e:
@@ -0,0 +1,150 @@
+"""
+Fast path for Flask-Login's user loader.
+
+Users are loaded together with their role in one query, and the identity
+columns are kept in a short-TTL per-process cache so most requests build
+``current_user`` without touching the database. Profile, role and password
+changes evict the affected entries in this process; other workers pick them
+up within ``USER_CACHE_TTL`` seconds. Columns not in the snapshot (password
+hash, points) load on first access as usual.
+"""
+import time
+import logging
+import threading
+from flask import current_app, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+
+logger = logging.getLogger(__name__)
+
+USER_COLUMNS = ('id', 'username', 'email', 'role_id', 'first_name', 'last_name',
+                'target_score', 'created_at', 'last_login')
+ROLE_COLUMNS = ('id', 'name', 'description')
+
+class IdentityCache:
+    """Thread-safe TTL cache of user and role column snapshots"""
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}  # user_id -> (expires_at, user_values, role_values)
+        self.hits = 0
+        self.misses = 0
+        self.queries = 0
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1], entry[2]
+            self._entries.pop(user_id, None)
+            self.misses += 1
+            return None
+
+    def put(self, user_id, user_values, role_values):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, user_values, role_values)
+
+    def invalidate(self, user_id=None):
+        """Drop one user, or everyone when user_id is None"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+    def metrics(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'queries': self.queries,
+        }
+
+identity_cache = IdentityCache()
+
+def _count_auth_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get('_loading_user'):
+        g.auth_query_count = g.get('auth_query_count', 0) + 1
+        identity_cache.queries += 1
+
+def _attach(session, user_values, role_values):
+    """Add cached snapshots to the session as persistent objects, without a query"""
+    from models import Role, User
+
+    role = Role(**role_values)
+    make_transient_to_detached(role)
+    role = session.merge(role, load=False)
+
+    user = User(**user_values)
+    make_transient_to_detached(user)
+    set_committed_value(user, 'role', role)
+    user = session.merge(user, load=False)
+    # Everything outside the snapshot loads from the database on first access
+    session.expire(user, [attr.key for attr in User.__mapper__.column_attrs if attr.key not in user_values])
+    return user
+
+def load_user(user_id):
+    """Return the User for a session user id, with its role already loaded"""
+    from app import db
+    from models import User
+
+    user_id = int(user_id)
+    existing = db.session.identity_map.get(db.session.identity_key(User, user_id))
+    if existing is not None:
+        return existing
+
+    cached = identity_cache.get(user_id)
+    if cached is not None:
+        return _attach(db.session, *cached)
+
+    g._loading_user = True
+    try:
+        user = User.query.options(joinedload(User.role)).filter(User.id == user_id).first()
+    finally:
+        g._loading_user = False
+    if user is not None and user.role is not None:
+        identity_cache.put(
+            user_id,
+            {column: getattr(user, column) for column in USER_COLUMNS},
+            {column: getattr(user.role, column) for column in ROLE_COLUMNS},
+        )
+    return user
+
+def _invalidate_user(mapper, connection, target):
+    identity_cache.invalidate(target.id)
+
+def _invalidate_all(mapper, connection, target):
+    identity_cache.invalidate()
+
+def init_user_loader(app, login_manager):
+    """Install the cached loader and its invalidation hooks"""
+    from app import db
+    from models import Role, User
+
+    identity_cache.ttl = app.config.get('USER_CACHE_TTL', 30)
+    login_manager.user_loader(load_user)
+
+    hooks = (
+        (User, 'after_update', _invalidate_user),
+        (User, 'after_delete', _invalidate_user),
+        (Role, 'after_update', _invalidate_all),
+        (Role, 'after_delete', _invalidate_all),
+    )
+    for target, name, fn in hooks:
+        if not event.contains(target, name, fn):
+            event.listen(target, name, fn)
+
+    with app.app_context():
+        if not event.contains(db.engine, 'before_cursor_execute', _count_auth_query):
+            event.listen(db.engine, 'before_cursor_execute', _count_auth_query)
+
+    @app.after_request
+    def add_auth_query_header(response):
+        if current_app.config.get('AUTH_QUERY_HEADER'):
+            response.headers['X-Auth-Query-Count'] = str(g.get('auth_query_count', 0))
+        return response
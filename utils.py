@@ -1,6 +1,8 @@
 import re
 import json
+from dataclasses import dataclass, field, asdict
 from datetime import datetime
+from cache import memoize
 
 def analyze_writing(text):
     """
@@ -62,80 +64,137 @@ def parse_json(json_str):
     except (json.JSONDecodeError, TypeError):
         return {}
 
+def parse_exercise_content(exercise):
+    """Parsed (cached, read-only) content of an exercise"""
+    from content_cache import parse_content
+    try:
+        return parse_content(exercise.content, exercise.id)
+    except (json.JSONDecodeError, TypeError):
+        return {}
+
 def check_badge_eligibility(user):
-    """Check if user is eligible for any new badges"""
-    from app import db
-    from models import Badge, UserBadge, Section
-    
-    # Check section-based badges
-    for section in Section.query.all():
-        # Get completed exercises for this section
-        section_records = [r for r in user.practice_records 
-                          if r.completed_at and r.exercise.section_id == section.id]
-        
-        # Count completed exercises
-        completed_count = len(section_records)
-        
-        # Check for badges based on completion count
-        if completed_count >= 5:
-            # Find badge for completing 5 exercises in this section
-            badge = Badge.query.filter_by(
-                section_id=section.id, 
-                points_required=50
-            ).first()
-            
-            if badge and not UserBadge.query.filter_by(user_id=user.id, badge_id=badge.id).first():
-                # Award badge
-                user_badge = UserBadge()
-                user_badge.user_id = user.id
-                user_badge.badge_id = badge.id
-                db.session.add(user_badge)
-                db.session.commit()
-    
-    # Check for overall score badges
-    high_scores = [r.score for r in user.practice_records 
-                   if r.completed_at and r.score and r.score >= 7.0]
-    
-    if len(high_scores) >= 3:
-        # Find badge for achieving high scores
-        badge = Badge.query.filter_by(
-            section_id=None,  # Overall badge
-            points_required=200
-        ).first()
-        
-        if badge and not UserBadge.query.filter_by(user_id=user.id, badge_id=badge.id).first():
-            # Award badge
-            user_badge = UserBadge()
-            user_badge.user_id = user.id
-            user_badge.badge_id = badge.id
-            db.session.add(user_badge)
-            db.session.commit()
+    """Check if user is eligible for any new badges
+
+    Badges are normally awarded as practice records are saved (see badges.py);
+    this re-evaluates every rule for the user from their counters.
+    """
+    from badges import evaluate_user
+    return evaluate_user(user.id)
             
+@dataclass
+class SectionStats:
+    """Completion count and mean score for one section"""
+    completed: int = 0
+    average_score: float = 0
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+@dataclass
+class UserStats:
+    """Dashboard statistics; also readable like the dict get_user_stats used to return"""
+    total_completed: int = 0
+    section_data: dict = field(default_factory=dict)  # section name -> SectionStats
+    recent_records: list = field(default_factory=list)
+    badges_earned: int = 0
+    average_score: float = 0
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def to_dict(self):
+        return {
+            'total_completed': self.total_completed,
+            'section_data': {name: asdict(section) for name, section in self.section_data.items()},
+            'recent_records': self.recent_records,
+            'badges_earned': self.badges_earned,
+            'average_score': self.average_score,
+        }
+
 def get_user_stats(user):
     """Get statistics for user dashboard"""
-    # Get completed practice records
-    completed_records = [r for r in user.practice_records if r.completed_at]
-    
-    # Get section data
-    from models import Section
-    section_data = {}
+    from sqlalchemy.orm import joinedload
+    from models import PracticeRecord
     
-    for section in Section.query.all():
-        section_records = [r for r in completed_records if r.exercise.section_id == section.id]
-        avg_score = sum([r.score for r in section_records if r.score]) / max(1, len([r for r in section_records if r.score]))
-        
-        section_data[section.name] = {
-            'completed': len(section_records),
-            'average_score': avg_score if section_records else 0
-        }
+    # Aggregates come from the cache; it is invalidated by the user's practice records
+    stats = _user_stat_totals(user.id)
     
     # Calculate recent progress
-    recent_records = sorted(completed_records, key=lambda r: r.completed_at or datetime.min, reverse=True)[:5]
+    stats.recent_records = PracticeRecord.query.options(
+        joinedload(PracticeRecord.exercise)
+    ).filter(
+        PracticeRecord.user_id == user.id,
+        PracticeRecord.completed_at.isnot(None),
+    ).order_by(PracticeRecord.completed_at.desc()).limit(5).all()
+    return stats
+
+@memoize(tags=lambda user_id: [f'user:{user_id}'])
+def _user_stat_totals(user_id):
+    """Per-section completions and scores plus badge count, without recent records"""
+    from app import db
+    from sqlalchemy import case, func
+    from models import Exercise, PracticeRecord, Section, UserBadge
     
-    return {
-        'total_completed': len(completed_records),
-        'section_data': section_data,
-        'recent_records': recent_records,
-        'badges_earned': len(user.badges),
-        'average_score': sum([r.score for r in completed_records if r.score]) / max(1, len([r for r in completed_records if r.score]))
-    }
\ No newline at end of file
+    # Zero scores are treated as "not scored", as they always have been
+    scored = case((PracticeRecord.score != 0, PracticeRecord.score))
+    
+    # Counts and score sums per section in one grouped query
+    rows = db.session.query(
+        Exercise.section_id,
+        func.count(PracticeRecord.id),
+        func.sum(scored),
+        func.count(scored),
+    ).join(Exercise, PracticeRecord.exercise_id == Exercise.id).filter(
+        PracticeRecord.user_id == user_id,
+        PracticeRecord.completed_at.isnot(None),
+    ).group_by(Exercise.section_id).all()
+    totals = {section_id: (completed, score_sum or 0, score_count) for section_id, completed, score_sum, score_count in rows}
+    
+    stats = UserStats()
+    score_sum_all = 0
+    score_count_all = 0
+    for section_id, section_name in db.session.query(Section.id, Section.name).all():
+        completed, score_sum, score_count = totals.get(section_id, (0, 0, 0))
+        stats.section_data[section_name] = SectionStats(
+            completed=completed,
+            average_score=score_sum / max(1, score_count) if completed else 0,
+        )
+        stats.total_completed += completed
+        score_sum_all += score_sum
+        score_count_all += score_count
+    stats.average_score = score_sum_all / max(1, score_count_all)
+    
+    stats.badges_earned = db.session.query(func.count(UserBadge.id)).filter(UserBadge.user_id == user_id).scalar()
+    return stats
+
+@memoize(timeout=300, tags=('articles',))
+def get_article_list(section_id=None, category=None, limit=20):
+    """Published articles, newest first, as plain dicts for listing pages
+    
+    View counts are written outside the ORM, so they can lag by the timeout.
+    """
+    from sqlalchemy.orm import load_only
+    from models import Article
+    
+    query = Article.query.options(load_only(
+        Article.id, Article.title, Article.summary, Article.image_url, Article.category,
+        Article.section_id, Article.created_at, Article.view_total,
+    )).filter(Article.is_published.is_(True))
+    if section_id is not None:
+        query = query.filter(Article.section_id == section_id)
+    if category is not None:
+        query = query.filter(Article.category == category)
+    articles = query.order_by(Article.created_at.desc(), Article.id.desc()).limit(limit).all()
+    return [{
+        'id': article.id,
+        'title': article.title,
+        'summary': article.summary,
+        'image_url': article.image_url,
+        'category': article.category,
+        'section_id': article.section_id,
+        'created_at': article.created_at,
+        'view_count': article.view_count,
+    } for article in articles]
@@ -1,6 +1,8 @@
-from app import app, db
+from app import create_app, db
 from models import Exercise
 
+app = create_app(web=False)
+
 def verify_test():
     """Verify that the listening test was added to the database"""
     with app.app_context():
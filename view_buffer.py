@@ -0,0 +1,306 @@
+"""
+Buffered ingestion of ArticleView events.
+
+Article reads call ``record_article_view`` instead of inserting a row inside the
+request. Events are queued in memory and appended to a per-process spool file;
+a background thread bulk-inserts them in batches and updates the article
+counters once per batch. Spool files left behind by a crashed or restarted
+worker are replayed, so at most ``VIEW_BUFFER_FSYNC_INTERVAL`` seconds of views
+can be lost on a host crash (nothing on a clean worker restart).
+
+Each spool file is named once per process start and recorded in
+``ViewSpoolBatch`` in the transaction that inserts its views. A file that
+survives its commit (a crash before the unlink) is then discarded on replay
+instead of being inserted twice. Files a replaying worker claimed before it
+died are reclaimed like any other spool file.
+"""
+import os
+import json
+import glob
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select
+
+logger = logging.getLogger(__name__)
+
+# Ingest records outlive any spool file that is still waiting to be cleaned up
+SPOOL_BATCH_RETENTION = timedelta(days=7)
+
+class ArticleViewBuffer:
+    """Per-process queue of article views flushed to the database in batches"""
+
+    def __init__(self, app):
+        self.app = app
+        self.flush_interval = app.config.get('VIEW_BUFFER_FLUSH_INTERVAL', 5.0)
+        self.max_batch = app.config.get('VIEW_BUFFER_MAX_BATCH', 500)
+        self.fsync_interval = app.config.get('VIEW_BUFFER_FSYNC_INTERVAL', 1.0)
+        self.spool_dir = app.config.get('VIEW_BUFFER_SPOOL_DIR')
+        if self.spool_dir:
+            os.makedirs(self.spool_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = []
+        self._spool = None
+        self._spool_seq = 0
+        self._spool_token = None
+        self._last_fsync = 0.0
+        self._pid = None
+        self._thread = None
+
+        self.flush_count = 0
+        self.events_flushed = 0
+        self.flush_errors = 0
+        self.last_batch_size = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.total_flush_seconds = 0.0
+
+    # -- producer side -----------------------------------------------------
+
+    def add(self, article_id, user_id, viewed_at=None):
+        """Queue a view; never touches the database"""
+        self._ensure_started()
+        event = {
+            'article_id': article_id,
+            'user_id': user_id,
+            'viewed_at': (viewed_at or datetime.utcnow()).isoformat(),
+        }
+        with self._lock:
+            self._pending.append(event)
+            if self.spool_dir:
+                self._append_to_spool(event)
+            pending = len(self._pending)
+        if pending >= self.max_batch:
+            self._wakeup.set()
+
+    def _spool_path(self, suffix):
+        # The token keeps names unique when a later process reuses the pid
+        return os.path.join(self.spool_dir, f"views-{os.getpid()}.{self._spool_token}.{suffix}")
+
+    def _append_to_spool(self, event):
+        if self._spool is None:
+            self._spool = open(self._spool_path('active'), 'a', encoding='utf-8')
+        self._spool.write(json.dumps(event) + '\n')
+        self._spool.flush()
+        now = time.monotonic()
+        if now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._spool.fileno())
+            self._last_fsync = now
+
+    def _rotate_spool(self):
+        """Close the active spool file and return its new name, or None"""
+        if self._spool is None:
+            return None
+        self._spool.close()
+        self._spool = None
+        self._spool_seq += 1
+        rotated = self._spool_path(f"{self._spool_seq}.flushing")
+        os.replace(self._spool_path('active'), rotated)
+        return rotated
+
+    # -- consumer side -----------------------------------------------------
+
+    def _ensure_started(self):
+        # Started lazily so a pre-forking server starts one thread per worker
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            self._pid = os.getpid()
+            self._pending = []
+            self._spool = None
+            self._spool_seq = 0
+            self._spool_token = os.urandom(4).hex()
+            self._thread = threading.Thread(target=self._run, name='article-view-buffer', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        self.replay_spool()
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+                self.replay_spool()
+            except Exception as e:
+                logger.error(f"Article view flush failed: {str(e)}")
+
+    def flush(self):
+        """Write all queued views to the database; return the number written"""
+        with self._lock:
+            batch, self._pending = self._pending, []
+            rotated = self._rotate_spool() if self.spool_dir else None
+        if not batch:
+            return 0
+
+        try:
+            self._write_batch(batch, _batch_name(rotated) if rotated else None)
+        except Exception:
+            self.flush_errors += 1
+            if rotated:
+                # Leave the events on disk for the next replay
+                os.replace(rotated, rotated.replace('.flushing', '.failed'))
+            raise
+        if rotated:
+            os.unlink(rotated)
+        return len(batch)
+
+    def _write_batch(self, batch, spool_name=None):
+        """Insert a batch in one transaction; False if spool_name was already ingested"""
+        from app import db
+        from models import ArticleView
+        from counters import record_article_views
+
+        started = time.perf_counter()
+        with self.app.app_context():
+            views = ArticleView.__table__
+            with db.engine.begin() as conn:
+                if spool_name and not _mark_ingested(conn, spool_name):
+                    logger.warning(f"Discarding spool file {spool_name}: its views are already in the database")
+                    return False
+                for i in range(0, len(batch), self.max_batch):
+                    chunk = batch[i:i + self.max_batch]
+                    rows = [{
+                        'article_id': event['article_id'],
+                        'user_id': event['user_id'],
+                        'viewed_at': datetime.fromisoformat(event['viewed_at']),
+                    } for event in chunk]
+                    conn.execute(views.insert(), rows)
+                    viewers = {}
+                    for row in rows:
+                        viewers.setdefault(row['article_id'], []).append(row['user_id'])
+                    record_article_views(conn, viewers)
+
+        elapsed = time.perf_counter() - started
+        self.flush_count += 1
+        self.events_flushed += len(batch)
+        self.last_batch_size = len(batch)
+        self.last_flush_seconds = elapsed
+        self.total_flush_seconds += elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        logger.debug(f"Flushed {len(batch)} article views in {elapsed * 1000:.1f}ms")
+        return True
+
+    def replay_spool(self):
+        """Ingest spool files left by failed flushes or workers that are gone"""
+        if not self.spool_dir:
+            return 0
+        replayed = 0
+        paths = glob.glob(os.path.join(self.spool_dir, 'views-*')) + glob.glob(os.path.join(self.spool_dir, 'replay-*'))
+        for path in sorted(paths):
+            name = os.path.basename(path)
+            pid = _owner_pid(name)
+            if pid != os.getpid() and _process_alive(pid):
+                continue
+            # This process's own files are still being flushed, unless a flush failed
+            if name.startswith(f"views-{pid}.{self._spool_token}.") and pid == os.getpid() and not name.endswith('.failed'):
+                continue
+            # Claim the file so only one worker replays it; a claim left by a
+            # replaying worker that died is taken over the same way
+            batch_name = _batch_name(path)
+            claimed = os.path.join(self.spool_dir, f"replay-{os.getpid()}-{batch_name}")
+            try:
+                os.replace(path, claimed)
+            except FileNotFoundError:
+                continue
+            batch = _read_spool(claimed)
+            try:
+                written = bool(batch) and self._write_batch(batch, batch_name)
+            except Exception as e:
+                logger.error(f"Could not replay {path}: {str(e)}")
+                os.replace(claimed, os.path.join(self.spool_dir, f"{batch_name}.failed"))
+                continue
+            os.unlink(claimed)
+            if written:
+                replayed += len(batch)
+        if replayed:
+            logger.info(f"Replayed {replayed} spooled article views")
+        return replayed
+
+    def metrics(self):
+        """Snapshot of buffer counters for monitoring"""
+        return {
+            'pending': len(self._pending),
+            'flushes': self.flush_count,
+            'events_flushed': self.events_flushed,
+            'flush_errors': self.flush_errors,
+            'last_batch_size': self.last_batch_size,
+            'last_flush_seconds': self.last_flush_seconds,
+            'max_flush_seconds': self.max_flush_seconds,
+            'avg_flush_seconds': self.total_flush_seconds / self.flush_count if self.flush_count else 0.0,
+        }
+
+def _read_spool(path):
+    events = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                # A crash mid-write can leave a truncated last line
+                logger.warning(f"Skipping unreadable line in {path}")
+    return events
+
+def _owner_pid(name):
+    """Pid of the process that wrote (views-<pid>...) or claimed (replay-<pid>-...) a spool file"""
+    if name.startswith('replay-'):
+        return int(name.split('-', 2)[1])
+    return int(name.split('-', 1)[1].split('.', 1)[0])
+
+def _batch_name(path):
+    """Name of a spool file as written, whatever it was renamed to since"""
+    name = os.path.basename(path)
+    if name.startswith('replay-'):
+        name = name.split('-', 2)[2]
+    for suffix in ('.failed', '.flushing'):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+def _mark_ingested(conn, name):
+    """Record a spool file in the transaction inserting its views; False if it already was"""
+    from models import ViewSpoolBatch
+
+    batches = ViewSpoolBatch.__table__
+    if conn.execute(select(batches.c.name).where(batches.c.name == name)).first() is not None:
+        return False
+    now = datetime.utcnow()
+    conn.execute(batches.delete().where(batches.c.ingested_at < now - SPOOL_BATCH_RETENTION))
+    conn.execute(batches.insert(), {'name': name, 'ingested_at': now})
+    return True
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def init_view_buffer(app):
+    """Attach an ArticleViewBuffer to the app when buffering is enabled"""
+    if app.config.get('VIEW_BUFFER_ENABLED'):
+        app.extensions['article_view_buffer'] = ArticleViewBuffer(app)
+
+def record_article_view(article_id, user_id, viewed_at=None):
+    """Record that a user viewed an article
+
+    Buffered when VIEW_BUFFER_ENABLED is set; otherwise the view is added to the
+    current session and committed with the rest of the request.
+    """
+    buffer = current_app.extensions.get('article_view_buffer')
+    if buffer is not None:
+        buffer.add(article_id, user_id, viewed_at)
+        return
+
+    from app import db
+    from models import ArticleView
+    db.session.add(ArticleView(article_id=article_id, user_id=user_id, viewed_at=viewed_at or datetime.utcnow()))